@@ -0,0 +1,161 @@
+"""
+Caché de los archivos del talonario (PDF e imagen).
+
+Cada archivo se guarda con la versión de la rifa con la que se generó
+(rifas.version, la suben los triggers con cada reserva, comprobante,
+aprobación, rechazo o expiración, y cuando cambian los datos de un
+comprador). Mientras la versión no cambie, pedir
+otra vez el PDF o la imagen no consulta el talonario ni vuelve a renderizar;
+y si el archivo ya se subió a Telegram se reenvía con su file_id, sin
+volver a subirlo. Una entrada puede tener varios archivos (la imagen de una
+rifa de más de 100 números es una por cada bloque de 100).
+
+Los archivos viven en ARTEFACTOS_DIR con el prefijo PREFIJO (al arrancar
+se borran los de ese prefijo, nada más de la carpeta) y se borran en orden
+LRU al pasar de ARTEFACTOS_MAX archivos o ARTEFACTOS_MAX_MB. Un archivo
+puede borrarse entre `obtener` y el envío: quien lo envía debe regenerarlo.
+"""
+import os
+import tempfile
+from collections import OrderedDict
+
+ARTEFACTOS_DIR = os.getenv(
+    "ARTEFACTOS_DIR",
+    os.path.join(tempfile.gettempdir(), "rifas_artefactos")
+)
+ARTEFACTOS_MAX = int(os.getenv("ARTEFACTOS_MAX", "50"))
+ARTEFACTOS_MAX_MB = float(os.getenv("ARTEFACTOS_MAX_MB", "200"))
+
+# Solo los archivos con este prefijo son de la caché (ARTEFACTOS_DIR puede
+# ser una carpeta compartida)
+PREFIJO = "talonario_"
+
+# (tipo, rifa_id) -> {"tipo", "rifa_id", "version", "rutas", "bytes", "file_ids"}
+# Solo la última versión de cada rifa: las anteriores ya no sirven
+_entradas = OrderedDict()
+
+_metrics = {"hits": 0, "misses": 0, "reusos_file_id": 0, "expulsados": 0}
+
+def iniciar():
+    """Borra los archivos de la caché de una ejecución anterior o de renders abortados"""
+    os.makedirs(ARTEFACTOS_DIR, exist_ok=True)
+
+    for nombre in os.listdir(ARTEFACTOS_DIR):
+        ruta = os.path.join(ARTEFACTOS_DIR, nombre)
+        if nombre.startswith(PREFIJO) and os.path.isfile(ruta):
+            _borrar(ruta)
+
+    _entradas.clear()
+
+def ruta_nueva(tipo, rifa_id, version, extension):
+    """Ruta (única) donde el render debe escribir el archivo de esta versión"""
+    os.makedirs(ARTEFACTOS_DIR, exist_ok=True)
+
+    descriptor, ruta = tempfile.mkstemp(
+        prefix=f"{PREFIJO}{rifa_id}_v{version}_",
+        suffix=f".{extension}",
+        dir=ARTEFACTOS_DIR
+    )
+    os.close(descriptor)
+
+    return ruta
+
+def obtener(tipo, rifa_id, version):
+    """La entrada de esta versión, o None si hay que generarla"""
+    entrada = _entradas.get((tipo, rifa_id))
+
+    if (
+        entrada is None
+        or entrada["version"] != version
+        or not all(os.path.exists(ruta) for ruta in entrada["rutas"])
+    ):
+        _metrics["misses"] += 1
+        return None
+
+    _entradas.move_to_end((tipo, rifa_id))
+    _metrics["hits"] += 1
+    return entrada
+
+def guardar(tipo, rifa_id, version, *rutas):
+    """Registra los archivos recién generados y devuelve su entrada"""
+    anterior = _entradas.pop((tipo, rifa_id), None)
+
+    # Dos admins pueden generar la misma rifa a la vez: se queda la versión
+    # mayor (o la que ya estaba, que puede tener file_id) si sus archivos siguen
+    if (
+        anterior is not None
+        and anterior["version"] >= version
+        and all(os.path.exists(ruta) for ruta in anterior["rutas"])
+    ):
+        _entradas[(tipo, rifa_id)] = anterior
+        _borrar(*rutas)
+        return anterior
+
+    if anterior is not None:
+        _borrar(*(ruta for ruta in anterior["rutas"] if ruta not in rutas))
+
+    entrada = {
+        "tipo": tipo,
+        "rifa_id": rifa_id,
+        "version": version,
+        "rutas": list(rutas),
+        "bytes": sum(os.path.getsize(ruta) for ruta in rutas),
+        "file_ids": None,
+    }
+    _entradas[(tipo, rifa_id)] = entrada
+    _expulsar()
+
+    return entrada
+
+def file_ids_guardados(entrada):
+    """file_id (uno por archivo) de una subida anterior de esta misma versión, o None"""
+    if entrada["file_ids"]:
+        _metrics["reusos_file_id"] += 1
+    return entrada["file_ids"]
+
+def recordar_file_ids(entrada, file_ids):
+    """Guarda los file_id de Telegram de la primera subida"""
+    actual = _entradas.get((entrada["tipo"], entrada["rifa_id"]))
+
+    if actual is not None and actual["version"] == entrada["version"]:
+        actual["file_ids"] = list(file_ids)
+
+def olvidar_file_ids(entrada):
+    """Los file_id dejaron de servir (p. ej. cambió el token): se vuelven a subir los archivos"""
+    actual = _entradas.get((entrada["tipo"], entrada["rifa_id"]))
+
+    if actual is not None:
+        actual["file_ids"] = None
+
+def descartar(*rutas):
+    """Borra archivos que no llegaron a la caché (render fallido o abortado)"""
+    _borrar(*rutas)
+
+def _borrar(*rutas):
+    for ruta in rutas:
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+
+def _expulsar():
+    limite_bytes = ARTEFACTOS_MAX_MB * 1024 * 1024
+
+    while _entradas and (
+        sum(len(e["rutas"]) for e in _entradas.values()) > ARTEFACTOS_MAX
+        or sum(e["bytes"] for e in _entradas.values()) > limite_bytes
+    ):
+        # La más reciente se conserva aunque sola pase del límite
+        if len(_entradas) == 1:
+            break
+
+        _, entrada = _entradas.popitem(last=False)
+        _borrar(*entrada["rutas"])
+        _metrics["expulsados"] += 1
+
+def artefactos_metrics():
+    return {
+        "archivos": sum(len(e["rutas"]) for e in _entradas.values()),
+        "mb": sum(e["bytes"] for e in _entradas.values()) / (1024 * 1024),
+        **_metrics,
+    }
@@ -0,0 +1,224 @@
+"""
+Benchmark de las consultas calientes con y sin los índices (necesita PostgreSQL).
+
+Trabaja en un esquema aparte (benchmark_consultas) de la base de
+DATABASE_URL, así que no toca las tablas del bot; el esquema se borra al
+terminar. Pasos:
+- aplica la migración 0001 (tablas sin índices secundarios),
+- carga un conjunto sintético: 10.000 rifas de 100 números, sus pagos y
+  usuarios,
+- mide cada consulta (plan con EXPLAIN ANALYZE y mediana de tiempos),
+- aplica las migraciones de índices (0002 y 0003) y vuelve a medir.
+
+Uso:
+    python benchmark_consultas.py [--rifas 10000] [--numeros 100] [--repetir 20] [--planes]
+"""
+import time
+import random
+import asyncio
+import argparse
+import psycopg
+from database import get_database_url
+from schema import upgrade
+
+ESQUEMA = "benchmark_consultas"
+
+# Migraciones que crean los índices de las consultas calientes
+VERSION_TABLAS = 1
+VERSION_INDICES = 3
+
+# Cada pago toma 3 números seguidos; se venden así el 60% de cada rifa
+NUMEROS_POR_PAGO = 3
+FRACCION_VENDIDA = 0.6
+
+# (nombre, sql) con parámetros por nombre que arma `parametros`
+CONSULTAS = [
+    ("grilla de una rifa", """
+        SELECT numero FROM numeros
+        WHERE rifa_id = %(rifa)s AND reservado = 1
+    """),
+    ("reservar números", """
+        SELECT numero FROM numeros
+        WHERE rifa_id = %(rifa)s AND numero = ANY(%(numeros)s) AND reservado = 0
+    """),
+    ("números de un pago", """
+        SELECT numero FROM numeros
+        WHERE pago_id = %(pago)s
+        ORDER BY numero
+    """),
+    ("último pago del usuario", """
+        SELECT id, rifa_id, timestamp, estado FROM pagos
+        WHERE user_id = %(usuario)s
+        ORDER BY timestamp DESC
+        LIMIT 1
+    """),
+    ("mis boletas", """
+        SELECT id, rifa_id, timestamp FROM pagos
+        WHERE user_id = %(usuario)s AND estado = 'aprobado'
+        ORDER BY timestamp DESC, id DESC
+        LIMIT 5
+    """),
+    ("pagos vencidos", """
+        SELECT id FROM pagos
+        WHERE estado = 'pendiente' AND timestamp <= %(vencimiento)s
+    """),
+    ("pagos de una rifa por estado", """
+        SELECT estado, COUNT(*) FROM pagos
+        WHERE rifa_id = %(rifa)s
+        GROUP BY estado
+    """),
+]
+
+async def cargar_datos(conn, rifas, numeros, usuarios):
+    """Llena las tablas con generate_series; devuelve la cantidad de pagos"""
+    pagos_por_rifa = int(numeros * FRACCION_VENDIDA) // NUMEROS_POR_PAGO
+    ahora = int(time.time())
+
+    await conn.execute("""
+        INSERT INTO rifas (nombre, precio, total_numeros)
+        SELECT 'Rifa ' || r, 1000, %s
+        FROM generate_series(1, %s) AS r
+    """, (numeros, rifas))
+
+    await conn.execute("""
+        INSERT INTO usuarios (user_id, nombre, telefono)
+        SELECT u, 'Usuario ' || u, '300' || u
+        FROM generate_series(1, %s) AS u
+    """, (usuarios,))
+
+    # La mayoría aprobados; pocos pendientes y todos recientes, como en el bot
+    await conn.execute("""
+        INSERT INTO pagos (id, user_id, rifa_id, estado, timestamp)
+        SELECT (r - 1) * %(por_rifa)s + b + 1,
+               1 + floor(random() * %(usuarios)s)::int,
+               r,
+               e.estado,
+               CASE WHEN e.estado = 'pendiente'
+                    THEN %(ahora)s - floor(random() * 1200)::int
+                    ELSE %(ahora)s - floor(random() * 365 * 86400)::int
+               END
+        FROM generate_series(1, %(rifas)s) AS r,
+             generate_series(0, %(por_rifa)s - 1) AS b,
+             LATERAL (
+                 SELECT CASE
+                     WHEN x < 0.70 THEN 'aprobado'
+                     WHEN x < 0.80 THEN 'rechazado'
+                     WHEN x < 0.95 THEN 'expirado'
+                     WHEN x < 0.98 THEN 'en_revision'
+                     ELSE 'pendiente'
+                 END AS estado
+                 -- b * 0: sin referencia a la fila, random() se evaluaría una sola vez
+                 FROM (SELECT random() + b * 0 AS x) azar
+             ) e
+    """, {"por_rifa": pagos_por_rifa, "usuarios": usuarios, "ahora": ahora, "rifas": rifas})
+
+    await conn.execute("SELECT setval(pg_get_serial_sequence('pagos', 'id'), %s)", (rifas * pagos_por_rifa,))
+
+    # Los números de pagos rechazados o expirados quedaron libres
+    await conn.execute("""
+        INSERT INTO numeros (rifa_id, numero, user_id, pago_id, reservado)
+        SELECT r, n, p.user_id, p.id, CASE WHEN p.id IS NULL THEN 0 ELSE 1 END
+        FROM generate_series(1, %(rifas)s) AS r
+        CROSS JOIN generate_series(0, %(numeros)s - 1) AS n
+        LEFT JOIN pagos p
+        ON n / %(por_pago)s < %(por_rifa)s
+        AND p.id = (r - 1) * %(por_rifa)s + n / %(por_pago)s + 1
+        AND p.estado IN ('pendiente', 'en_revision', 'aprobado')
+    """, {"rifas": rifas, "numeros": numeros, "por_pago": NUMEROS_POR_PAGO, "por_rifa": pagos_por_rifa})
+
+    await conn.execute("ANALYZE rifas, usuarios, pagos, numeros")
+
+    return rifas * pagos_por_rifa
+
+def parametros(args, pagos):
+    """Valores al azar para que cada repetición no lea las mismas páginas"""
+    return {
+        "rifa": random.randint(1, args.rifas),
+        "numeros": random.sample(range(args.numeros), 3),
+        "pago": random.randint(1, pagos),
+        "usuario": random.randint(1, args.usuarios),
+        "vencimiento": int(time.time()) - 600,
+    }
+
+def nodo_principal(plan):
+    """Primera línea del plan que lee una tabla (Seq Scan, Index Scan...)"""
+    for linea in plan:
+        if "Scan" in linea:
+            return linea.strip().lstrip("-> ").split("  (")[0]
+    return plan[0].split("  (")[0]
+
+async def medir(conn, args, pagos):
+    """{nombre: (mediana_ms, nodo, plan)} de cada consulta"""
+    resultados = {}
+
+    for nombre, sql in CONSULTAS:
+        cursor = await conn.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, parametros(args, pagos))
+        plan = [fila[0] for fila in await cursor.fetchall()]
+
+        tiempos = []
+        for _ in range(args.repetir):
+            inicio = time.perf_counter()
+            cursor = await conn.execute(sql, parametros(args, pagos))
+            await cursor.fetchall()
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+
+        resultados[nombre] = (sorted(tiempos)[len(tiempos) // 2], nodo_principal(plan), plan)
+
+    return resultados
+
+def imprimir_planes(titulo, resultados):
+    print(f"\n===== {titulo} =====")
+    for nombre, (_, _, plan) in resultados.items():
+        print(f"\n-- {nombre}")
+        print("\n".join(plan))
+
+async def main(args):
+    conn = await psycopg.AsyncConnection.connect(get_database_url(), autocommit=True)
+
+    try:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE")
+        await conn.execute(f"CREATE SCHEMA {ESQUEMA}")
+        await conn.execute(f"SET search_path TO {ESQUEMA}")
+
+        await upgrade(conn, VERSION_TABLAS)
+
+        inicio = time.perf_counter()
+        pagos = await cargar_datos(conn, args.rifas, args.numeros, args.usuarios)
+        print(
+            f"📦 {args.rifas:,} rifas, {args.rifas * args.numeros:,} números, "
+            f"{pagos:,} pagos, {args.usuarios:,} usuarios "
+            f"(carga en {time.perf_counter() - inicio:.1f}s)"
+        )
+
+        sin_indices = await medir(conn, args, pagos)
+
+        inicio = time.perf_counter()
+        aplicadas = await upgrade(conn, VERSION_INDICES)
+        await conn.execute("ANALYZE rifas, usuarios, pagos, numeros")
+        print(f"🗂️ Índices (migraciones {aplicadas}) creados en {time.perf_counter() - inicio:.1f}s\n")
+
+        con_indices = await medir(conn, args, pagos)
+
+        print(f"{'consulta':<30} {'sin índices':>12} {'con índices':>12} {'mejora':>8}")
+        for nombre, _ in CONSULTAS:
+            antes, nodo_antes, _ = sin_indices[nombre]
+            despues, nodo_despues, _ = con_indices[nombre]
+            print(f"{nombre:<30} {antes:>10.2f}ms {despues:>10.2f}ms {antes / despues:>7.0f}x")
+            print(f"{'':<4}{nodo_antes}  →  {nodo_despues}")
+
+        if args.planes:
+            imprimir_planes("Sin índices", sin_indices)
+            imprimir_planes("Con índices", con_indices)
+
+    finally:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE")
+        await conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de las consultas calientes con y sin índices")
+    parser.add_argument("--rifas", type=int, default=10000, help="Rifas del conjunto sintético")
+    parser.add_argument("--numeros", type=int, default=100, help="Números por rifa")
+    parser.add_argument("--usuarios", type=int, default=50000, help="Usuarios distintos que compran")
+    parser.add_argument("--repetir", type=int, default=20, help="Mediciones por consulta")
+    parser.add_argument("--planes", action="store_true", help="Imprime los planes completos")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,148 @@
+"""
+Benchmark de la imagen del talonario (no necesita base de datos ni token).
+
+Compara, con un talonario sintético de 100 números:
+- el método anterior: abrir y decodificar "Tabla diseñada.png" y dibujar cada
+  marca con ImageDraw en cada llamada,
+- render.componer_imagen desde cero (tabla en memoria + sprites),
+- render.componer_imagen incremental (la misma rifa con pocas celdas nuevas),
+- un bloque de una rifa de 1.000 números (tabla dibujada con sus números),
+- y aparte lo que cuesta codificar la foto (PNG o WebP), igual para todos.
+
+También verifica que la imagen con sprites sea idéntica, píxel a píxel, a
+la del método anterior.
+
+Uso:
+    python benchmark_imagen.py [--repetir 20] [--cambios 1 10]
+"""
+import os
+import time
+import tempfile
+import random
+import argparse
+import render
+
+ESTADOS = ["VENDIDO", "RESERVADO", "EN_REVISION", "DISPONIBLE"]
+
+def estados_sinteticos():
+    estados = {}
+    for numero in range(render.CELDAS):
+        estado = random.choice(ESTADOS)
+        if estado != "DISPONIBLE":
+            estados[numero] = estado
+    return estados
+
+def cambiar(estados, cantidad):
+    nuevos = dict(estados)
+    for numero in random.sample(range(render.CELDAS), cantidad):
+        estado = random.choice([e for e in ESTADOS if e != nuevos.get(numero, "DISPONIBLE")])
+        if estado == "DISPONIBLE":
+            nuevos.pop(numero, None)
+        else:
+            nuevos[numero] = estado
+    return nuevos
+
+def imagen_anterior(estados):
+    """El render como estaba en bot.py (referencia)"""
+    from PIL import Image, ImageDraw
+
+    img = Image.open(render.TABLA_BASE).convert("RGBA")
+    draw = ImageDraw.Draw(img)
+
+    for num in range(render.CELDAS):
+        fila = num // 10
+        columna = num % 10
+        centro_x = int(render.TABLE_X0 + columna * render.CELL_W + render.CELL_W / 2)
+        centro_y = int(render.TABLE_Y0 + fila * render.CELL_H + render.CELL_H / 2)
+
+        estado = estados.get(num, 'DISPONIBLE')
+        color = render.COLORES_ESTADO.get(estado)
+        o, r, w = render.MARCA_OFFSET, render.MARCA_RADIO, render.MARCA_WIDTH
+
+        if estado == 'VENDIDO':
+            draw.line([(centro_x - o, centro_y - o), (centro_x + o, centro_y + o)], fill=color, width=w)
+            draw.line([(centro_x - o, centro_y + o), (centro_x + o, centro_y - o)], fill=color, width=w)
+        elif estado == 'RESERVADO':
+            draw.ellipse([(centro_x - r, centro_y - r), (centro_x + r, centro_y + r)], outline=color, width=w)
+        elif estado == 'EN_REVISION':
+            draw.ellipse([(centro_x - r, centro_y - r), (centro_x + r, centro_y + r)], outline=color, width=w)
+            draw.line([(centro_x - r, centro_y), (centro_x + r, centro_y)], fill=color, width=w)
+
+    return img
+
+def medir(trabajo, repetir):
+    """Mediana en ms de `repetir` llamadas a `trabajo()`"""
+    tiempos = []
+    for _ in range(repetir):
+        inicio = time.perf_counter()
+        trabajo()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return sorted(tiempos)[len(tiempos) // 2]
+
+def main(args):
+    estados = estados_sinteticos()
+
+    # Primera llamada: decodifica la tabla y dibuja los sprites
+    inicio = time.perf_counter()
+    render.componer_imagen(0, estados)
+    arranque = (time.perf_counter() - inicio) * 1000
+
+    # Mismo resultado que antes, desde cero y después de cambios incrementales
+    render._recientes.clear()
+    iguales = render.componer_imagen(0, estados).tobytes() == imagen_anterior(estados).tobytes()
+    for cantidad in args.cambios:
+        estados = cambiar(estados, cantidad)
+        iguales &= render.componer_imagen(0, estados).tobytes() == imagen_anterior(estados).tobytes()
+
+    print(f"Imagen idéntica a la anterior: {'sí' if iguales else 'NO'}")
+    print(f"Primera llamada por proceso (decodificar + sprites): {arranque:.1f} ms\n")
+
+    def desde_cero():
+        render._recientes.clear()
+        render.componer_imagen(0, estados)
+
+    filas = [
+        ("anterior (abrir + ImageDraw)", medir(lambda: imagen_anterior(estados), args.repetir)),
+        ("sprites, desde cero", medir(desde_cero, args.repetir)),
+    ]
+
+    for cantidad in args.cambios:
+        def incremental():
+            nonlocal estados
+            estados = cambiar(estados, cantidad)
+            render.componer_imagen(0, estados)
+
+        render.componer_imagen(0, estados)
+        filas.append((f"sprites, {cantidad} celda(s) cambiada(s)", medir(incremental, args.repetir)))
+
+    # Bloque 500-599 de una rifa de 1.000: la primera vez se dibuja la tabla
+    grande = {numero + 500: estado for numero, estado in estados.items()}
+    inicio = time.perf_counter()
+    render.componer_imagen(1, grande, 1000, 500)
+    filas.append(("rifa de 1.000, primer bloque", (time.perf_counter() - inicio) * 1000))
+
+    def bloque_desde_cero():
+        render._recientes.clear()
+        render.componer_imagen(1, grande, 1000, 500)
+
+    filas.append(("rifa de 1.000, bloque repetido", medir(bloque_desde_cero, args.repetir)))
+
+    img = render.componer_imagen(0, estados)
+    lento = max(1, args.repetir // 4)
+    for formato in ("png", "webp"):
+        def codificar():
+            os.remove(render.guardar_imagen(img, tempfile.mktemp(suffix=f".{formato}"), formato))
+
+        ruta = render.guardar_imagen(img, tempfile.mktemp(suffix=f".{formato}"), formato)
+        filas.append((f"codificar {formato} ({os.path.getsize(ruta) // 1024} KB)", medir(codificar, lento)))
+        os.remove(ruta)
+
+    print(f"{'render':<32} {'mediana':>9}")
+    for nombre, ms in filas:
+        print(f"{nombre:<32} {ms:>7.1f}ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de la imagen del talonario")
+    parser.add_argument("--repetir", type=int, default=20, help="Mediciones por caso")
+    parser.add_argument("--cambios", type=int, nargs="+", default=[1, 10], help="Celdas que cambian entre renders")
+    main(parser.parse_args())
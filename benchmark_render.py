@@ -0,0 +1,92 @@
+"""
+Benchmark del render del talonario (no necesita base de datos ni token).
+
+Para cada tamaño de rifa arma un talonario sintético y mide:
+- el tiempo de generar el PDF,
+- cuánto se bloquea el loop de asyncio si se genera dentro del loop
+  (como antes) y cuánto si se genera con render.renderizar (proceso aparte).
+
+El bloqueo se mide con una tarea que debería despertar cada 10 ms: el
+retraso máximo es lo que habría esperado un comprador para ser atendido.
+
+Uso:
+    python benchmark_render.py [--tamanos 100 1000 10000] [--repetir 1]
+"""
+import os
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import render
+
+ESTADOS = ["VENDIDO", "RESERVADO", "EN REVISIÓN", "DISPONIBLE"]
+
+def talonario_sintetico(total):
+    datos = []
+    for numero in range(total):
+        estado = random.choice(ESTADOS)
+        if estado == "DISPONIBLE":
+            datos.append((numero, "DISPONIBLE", "", "", estado))
+        else:
+            datos.append((numero, f"Comprador {numero}", f"user{numero}", "3001234567", estado))
+    return datos
+
+async def medir_bloqueo(trabajo):
+    """Corre `trabajo` mientras un latido mide el mayor retraso del loop (ms)"""
+    maximo = 0.0
+    activo = True
+
+    async def latido():
+        nonlocal maximo
+        while activo:
+            antes = time.perf_counter()
+            await asyncio.sleep(0.01)
+            maximo = max(maximo, (time.perf_counter() - antes - 0.01) * 1000)
+
+    tarea = asyncio.create_task(latido())
+    await asyncio.sleep(0.05)
+
+    inicio = time.perf_counter()
+    ruta = await trabajo(tempfile.mktemp(suffix=".pdf"))
+    duracion = time.perf_counter() - inicio
+
+    activo = False
+    await tarea
+    os.remove(ruta)
+
+    return duracion, maximo
+
+async def main(args):
+    # El primer trabajo paga el arranque del worker (spawn + import de reportlab)
+    os.remove(await render.renderizar(
+        render.pdf_talonario, "calentamiento", "-", talonario_sintetico(10), tempfile.mktemp(suffix=".pdf")
+    ))
+
+    print(f"{'números':>8} | {'en el loop':>11} {'bloqueo':>9} | {'en worker':>10} {'bloqueo':>9}")
+
+    for total in args.tamanos:
+        datos = talonario_sintetico(total)
+
+        for _ in range(args.repetir):
+            async def en_loop(ruta):
+                return render.pdf_talonario("Benchmark", "-", datos, ruta)
+
+            async def en_worker(ruta):
+                return await render.renderizar(render.pdf_talonario, "Benchmark", "-", datos, ruta)
+
+            t_loop, b_loop = await medir_bloqueo(en_loop)
+            t_worker, b_worker = await medir_bloqueo(en_worker)
+
+            print(
+                f"{total:>8} | {t_loop:>10.2f}s {b_loop:>7.0f}ms | "
+                f"{t_worker:>9.2f}s {b_worker:>7.0f}ms"
+            )
+
+    render.detener()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark del render del talonario")
+    parser.add_argument("--tamanos", type=int, nargs="+", default=[100, 1000, 10000], help="Números por rifa")
+    parser.add_argument("--repetir", type=int, default=1, help="Mediciones por tamaño")
+    asyncio.run(main(parser.parse_args()))
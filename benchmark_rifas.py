@@ -0,0 +1,104 @@
+"""
+Benchmark de la creación de rifas (necesita PostgreSQL y el .env del bot).
+
+Para cada tamaño compara, en un esquema aparte (benchmark_rifas) con todas
+las migraciones aplicadas (índices y triggers de contadores incluidos):
+- el método anterior: un INSERT por número dentro de la transacción,
+- insertar_rifa del bot: la rifa y sus números en una sola sentencia.
+
+También verifica que cada rifa quede con exactamente los números 0 a
+total-1. El esquema se borra al terminar.
+
+Uso:
+    python benchmark_rifas.py [--tamanos 100 1000 10000] [--repetir 5]
+"""
+import time
+import asyncio
+import argparse
+import psycopg
+from database import get_database_url
+from schema import upgrade
+from bot import insertar_rifa
+
+ESQUEMA = "benchmark_rifas"
+
+async def insertar_rifa_anterior(db, nombre, precio, total_numeros):
+    """La creación como estaba en rifa_desc (referencia)"""
+    cursor = await db.execute("""
+        INSERT INTO rifas (nombre, precio, total_numeros)
+        VALUES (%s, %s, %s)
+        RETURNING id
+    """, (nombre, precio, total_numeros))
+
+    rifa_id = (await cursor.fetchone())[0]
+
+    for numero in range(total_numeros):
+        await db.execute("""
+            INSERT INTO numeros (rifa_id, numero)
+            VALUES (%s, %s)
+        """, (rifa_id, numero))
+
+    return rifa_id
+
+async def completa(conn, rifa_id, total):
+    """La rifa tiene una fila por cada número de 0 a total-1"""
+    cursor = await conn.execute("""
+        SELECT COUNT(*), COUNT(DISTINCT numero), MIN(numero), MAX(numero)
+        FROM numeros
+        WHERE rifa_id = %s
+    """, (rifa_id,))
+    return await cursor.fetchone() == (total, total, 0, total - 1)
+
+async def medir(conn, crear, total, repetir):
+    """Mediana en ms de crear la rifa `repetir` veces (cada una en su transacción)"""
+    tiempos = []
+    correcto = True
+
+    for _ in range(repetir):
+        inicio = time.perf_counter()
+        async with conn.transaction():
+            rifa_id = await crear(conn, "benchmark", 1000, total)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+
+        correcto &= await completa(conn, rifa_id, total)
+
+    return sorted(tiempos)[len(tiempos) // 2], correcto
+
+async def main(args):
+    conn = await psycopg.AsyncConnection.connect(get_database_url(), autocommit=True)
+
+    try:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE")
+        await conn.execute(f"CREATE SCHEMA {ESQUEMA}")
+        await conn.execute(f"SET search_path TO {ESQUEMA}")
+        await upgrade(conn)
+
+        filas = []
+        correcto = True
+
+        for total in args.tamanos:
+            # El método anterior con 10.000 números tarda: menos repeticiones
+            lento = max(1, args.repetir // max(1, total // 1000))
+            antes, bien_antes = await medir(conn, insertar_rifa_anterior, total, lento)
+            despues, bien_despues = await medir(conn, insertar_rifa, total, args.repetir)
+
+            filas.append((total, antes, despues))
+            correcto &= bien_antes and bien_despues
+
+        print(f"Números completos en todas las rifas: {'sí' if correcto else 'NO'}\n")
+        print(f"{'números':>8} {'un INSERT por número':>22} {'una sentencia':>15} {'mejora':>8}")
+        for total, antes, despues in filas:
+            print(f"{total:>8} {antes:>20.1f}ms {despues:>13.1f}ms {antes / despues:>7.0f}x")
+
+    finally:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE")
+        await conn.close()
+
+    if not correcto:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de la creación de rifas")
+    parser.add_argument("--tamanos", type=int, nargs="+", default=[100, 1000, 10000], help="Números por rifa")
+    parser.add_argument("--repetir", type=int, default=5, help="Mediciones por tamaño")
+    asyncio.run(main(parser.parse_args()))
@@ -1,10 +1,72 @@
 import os
+import html
+import traceback
+from contextlib import ExitStack
 from dotenv import load_dotenv
-from database import init_db, get_db, return_db
+from database import (
+    init_db,
+    connection,
+    init_connection_pool,
+    close_connection_pool,
+    pool_metrics
+)
+from cache import (
+    obtener_rifa,
+    esta_reservado,
+    marcar_reservados,
+    marcar_liberados,
+    invalidar_rifa,
+    estadisticas_cacheadas,
+    guardar_estadisticas,
+    invalidar_estadisticas,
+    cache_metrics
+)
+from dispatcher import (
+    encolar,
+    PRIORIDAD_ADMIN,
+    PRIORIDAD_USUARIO,
+    dispatcher_metrics
+)
+import dispatcher
+from difusion import (
+    crear_difusion,
+    iniciar_difusion,
+    reanudar_difusiones,
+    reintentar_difusiones,
+    cancelar_difusion,
+    detener_difusiones,
+    listar_difusiones
+)
+from webhook import webhook_activo, ejecutar_webhook
+from replicas import (
+    asumir_liderazgo,
+    es_lider,
+    soltar_liderazgo,
+    abrir_update,
+    limpiar_updates,
+    replicas_metrics
+)
+from persistencia import PersistenciaPostgres
+from render import (
+    renderizar,
+    pdf_talonario,
+    imagen_talonario,
+    RenderOcupado,
+    RenderReiniciado,
+    render_metrics,
+    renderizar_lote,
+    paginas_talonario,
+    IMAGEN_FORMATO
+)
+import render
+import artefactos
+from psycopg_pool import PoolTimeout
+from telegram.error import BadRequest
 from telegram import (
     Update,
     InlineKeyboardButton,
-    InlineKeyboardMarkup
+    InlineKeyboardMarkup,
+    InputMediaPhoto
 )
 from telegram.ext import (
     ApplicationBuilder,
@@ -13,6 +75,8 @@ from telegram.ext import (
     ConversationHandler,
     MessageHandler,
     CallbackQueryHandler,
+    TypeHandler,
+    ApplicationHandlerStop,
     filters
 )
 
@@ -26,16 +90,34 @@ TOKEN = os.getenv("TOKEN")
 GRUPO_RIFAS_ID = int(os.getenv("GRUPO_RIFAS_ID"))
 ADMIN_ID = int(os.getenv("ADMIN_ID"))
 
+# Segundos que tiene el usuario para enviar el comprobante
+TIEMPO_RESERVA = 10 * 60
+
+# Segundos entre barridos de la líder (pagos vencidos y difusiones de
+# réplicas que se cayeron, updates_procesados viejos)
+BARRIDO_INTERVALO = int(os.getenv("BARRIDO_INTERVALO", str(TIEMPO_RESERVA)))
+
 # Estados usuario
 NOMBRE, TELEFONO = range(2)
 
 # Estados creación de rifa (admin)
-RIFA_NOMBRE, RIFA_PRECIO, RIFA_PREMIO, RIFA_FECHA, RIFA_DESC = range(2, 7)
+RIFA_NOMBRE, RIFA_PRECIO, RIFA_PREMIO, RIFA_FECHA, RIFA_DESC, RIFA_TOTAL = range(2, 8)
+
+# Tamaño de las rifas
+TOTAL_NUMEROS_DEFECTO = 100
+MAX_NUMEROS_RIFA = 10000
 
 # =====================
 # MEMORIA TEMPORAL
 # =====================
 NUMEROS_POR_PAGINA = 50
+PAGINAS_POR_MENU = 20   # botones del menú "saltar a rango"
+SALTO_PAGINAS = 10      # botones ⏪ / ⏩
+BOLETAS_POR_PAGINA = 10        # compras por página en /misboletas
+MAX_NUMEROS_POR_BOLETA = 60    # números listados por compra antes de resumir
+REVISION_POR_PAGINA = 20       # pagos por página en la cola de revisión
+MAX_NUMEROS_REVISION = 15      # números listados por pago en la cola (límite de 4096 caracteres)
+FOTOS_POR_ALBUM = 10           # límite de Telegram por álbum (imágenes del talonario)
 
 rifas = {}
 
@@ -52,6 +134,36 @@ async def es_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except:
         return False
 
+# =====================
+# UTILIDAD: ERRORES
+# =====================
+async def manejar_error(update: object, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Registra el error con su traceback (al registrar un error handler PTB
+    deja de hacerlo) y responde al usuario cuando el pool está saturado
+    """
+    if not isinstance(context.error, PoolTimeout):
+        if isinstance(update, Update):
+            origen = update.callback_query.data if update.callback_query else (
+                update.effective_message.text if update.effective_message else None
+            )
+            usuario = update.effective_user.id if update.effective_user else None
+            print(f"❌ Error procesando el update {update.update_id} (usuario {usuario}, {origen!r}):")
+        else:
+            print(f"❌ Error fuera de un update ({update!r}):")
+        traceback.print_exception(context.error)
+        return
+
+    print("⚠️ Pool de conexiones agotado:", pool_metrics())
+
+    if isinstance(update, Update) and update.effective_chat:
+        encolar(
+            "send_message",
+            PRIORIDAD_USUARIO,
+            chat_id=update.effective_chat.id,
+            text="⏳ Hay mucha demanda en este momento. Intenta de nuevo en unos segundos."
+        )
+
 # =====================
 # MENÚ PRINCIPAL
 # =====================
@@ -174,14 +286,10 @@ async def nueva_compra_callback(update: Update, context: ContextTypes.DEFAULT_TY
     await query.answer()
     
     # Verificar que el usuario esté registrado
-    db = get_db()
-    cursor = db.cursor()
-    
-    try:
-        cursor.execute("SELECT nombre FROM usuarios WHERE user_id = %s", (query.from_user.id,))
-        usuario = cursor.fetchone()
-    finally:
-        return_db(db)
+    async with connection() as db:
+        cursor = db.cursor()
+        await cursor.execute("SELECT nombre FROM usuarios WHERE user_id = %s", (query.from_user.id,))
+        usuario = await cursor.fetchone()
     
     if not usuario:
         # Usuario no registrado, iniciar registro
@@ -201,28 +309,29 @@ async def menu_principal_callback(update: Update, context: ContextTypes.DEFAULT_
     
     await menu_principal(update, context)
 
+async def listar_rifas(solo_activas=True):
+    """
+    [(id, nombre, precio, total_numeros, ocupados, vendidos)] leído de los
+    contadores de la tabla rifas (los mantienen triggers, ver migración 0004),
+    sin recorrer los números de cada rifa.
+    """
+    async with connection() as db:
+        cursor = await db.execute("""
+            SELECT id, nombre, precio, total_numeros,
+                   numeros_ocupados, numeros_vendidos
+            FROM rifas
+            WHERE activa = 1 OR NOT %s
+            ORDER BY id DESC
+        """, (solo_activas,))
+
+        return await cursor.fetchall()
+
 async def ver_rifas_disponibles_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Muestra todas las rifas disponibles con su información"""
     query = update.callback_query
     await query.answer()
     
-    db = get_db()
-    cursor = db.cursor()
-
-    try:
-        cursor.execute("""
-            SELECT r.id, r.nombre, r.precio, r.total_numeros,
-                   COUNT(CASE WHEN n.reservado = 1 THEN 1 END) as reservados
-            FROM rifas r
-            LEFT JOIN numeros n ON r.id = n.rifa_id
-            WHERE r.activa = 1
-            GROUP BY r.id, r.nombre, r.precio, r.total_numeros
-            ORDER BY r.id DESC
-        """)
-
-        rifas_list = cursor.fetchall()
-    finally:
-        return_db(db)
+    rifas_list = await listar_rifas()
 
     if not rifas_list:
         keyboard = [[InlineKeyboardButton("◀️ Volver", callback_data="menu_principal")]]
@@ -234,7 +343,7 @@ async def ver_rifas_disponibles_callback(update: Update, context: ContextTypes.D
 
     texto = "🎟️ *RIFAS DISPONIBLES*\n\n"
 
-    for rifa_id, nombre, precio, total_numeros, reservados in rifas_list:
+    for rifa_id, nombre, precio, total_numeros, reservados, _ in rifas_list:
         disponibles = total_numeros - reservados
         porcentaje_vendido = (reservados / total_numeros * 100) if total_numeros > 0 else 0
         
@@ -272,11 +381,10 @@ async def recibir_nombre(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def recibir_telefono(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["telefono"] = update.message.text
 
-    db = get_db()
-    cursor = db.cursor()
+    async with connection() as db:
+        cursor = db.cursor()
 
-    try:
-        cursor.execute("""
+        await cursor.execute("""
             INSERT INTO usuarios 
             (user_id, username, nombre, telefono)
             VALUES (%s, %s, %s, %s)
@@ -291,9 +399,7 @@ async def recibir_telefono(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context.user_data["telefono"]
         ))
 
-        db.commit()
-    finally:
-        return_db(db)
+        await db.commit()
 
     await update.message.reply_text(
         "✅ *Datos registrados correctamente*",
@@ -308,19 +414,7 @@ async def recibir_telefono(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # =====================
 async def mostrar_rifas_para_compra(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Muestra las rifas disponibles para compra"""
-    db = get_db()
-    cursor = db.cursor()
-
-    try:
-        cursor.execute("""
-            SELECT id, nombre, precio
-            FROM rifas
-            WHERE activa = 1
-        """)
-
-        rifas_list = cursor.fetchall()
-    finally:
-        return_db(db)
+    rifas_list = await listar_rifas()
 
     if not rifas_list:
         await update.message.reply_text("❌ No hay rifas activas.")
@@ -330,11 +424,12 @@ async def mostrar_rifas_para_compra(update: Update, context: ContextTypes.DEFAUL
     texto = "🎟️ *Rifas disponibles:*\n\n"
     keyboard = []
 
-    for rifa_id, nombre, precio in rifas_list:
+    for rifa_id, nombre, precio, total_numeros, reservados, _ in rifas_list:
         texto += (
             f"🆔 ID: {rifa_id}\n"
             f"🎫 {nombre}\n"
-            f"💰 Precio: {precio}\n\n"
+            f"💰 Precio: {precio}\n"
+            f"📊 Disponibles: {total_numeros - reservados}/{total_numeros}\n\n"
         )
 
         keyboard.append([
@@ -372,25 +467,8 @@ async def comando_talonario(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("⛔ Solo el admin puede usar este comando.")
         return
 
-    db = get_db()
-    cursor = db.cursor()
-
-    try:
-        cursor.execute("""
-            SELECT r.id, r.nombre,
-                   COUNT(n.id) as vendidos
-            FROM rifas r
-            LEFT JOIN numeros n
-                ON r.id = n.rifa_id
-                AND n.pago_id IN (
-                    SELECT id FROM pagos WHERE estado = 'aprobado'
-                )
-            GROUP BY r.id, r.nombre
-        """)
-
-        rifas_list = cursor.fetchall()
-    finally:
-        return_db(db)
+    # Vendidos desde el contador de rifas, sin agrupar los números de cada una
+    rifas_list = await listar_rifas(solo_activas=False)
 
     if not rifas_list:
         await update.message.reply_text("❌ No hay rifas.")
@@ -398,7 +476,7 @@ async def comando_talonario(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     teclado = []
 
-    for rifa_id, nombre, vendidos in rifas_list:
+    for rifa_id, nombre, _, _, _, vendidos in rifas_list:
         teclado.append([
             InlineKeyboardButton(
                 f"{nombre} | 🎟️ {vendidos} vendidos",
@@ -422,13 +500,12 @@ async def mostrar_talonario(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     rifa_id = int(query.data.split("_")[1])
 
-    db = get_db()
-    cursor = db.cursor()
+    async with connection() as db:
+        cursor = db.cursor()
 
-    try:
         # Nombre de la rifa
-        cursor.execute("SELECT nombre FROM rifas WHERE id = %s", (rifa_id,))
-        rifa = cursor.fetchone()
+        await cursor.execute("SELECT nombre FROM rifas WHERE id = %s", (rifa_id,))
+        rifa = await cursor.fetchone()
 
         if not rifa:
             await query.message.reply_text("❌ Rifa no encontrada.")
@@ -437,7 +514,7 @@ async def mostrar_talonario(update: Update, context: ContextTypes.DEFAULT_TYPE):
         nombre_rifa = rifa[0]
 
         # Talonario
-        cursor.execute("""
+        await cursor.execute("""
             SELECT n.numero,
                    u.nombre,
                    u.username,
@@ -450,9 +527,7 @@ async def mostrar_talonario(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ORDER BY n.numero
         """, (rifa_id,))
 
-        filas = cursor.fetchall()
-    finally:
-        return_db(db)
+        filas = await cursor.fetchall()
 
     texto = f"📒 *TALONARIO – {nombre_rifa}*\n\n"
 
@@ -469,49 +544,20 @@ async def mostrar_talonario(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await query.message.reply_text(texto, parse_mode="Markdown")
 
-def obtener_numeros_pago(pago_id):
-    db = get_db()
-    cursor = db.cursor()
-
-    try:
-        cursor.execute("""
-            SELECT numero
-            FROM numeros
-            WHERE pago_id = %s
-            ORDER BY numero
-        """, (pago_id,))
-
-        numeros = [str(n[0]) for n in cursor.fetchall()]
-    finally:
-        return_db(db)
-
-    return ", ".join(numeros)
-
-async def enviar_comprobante_admin(context, pago_id, user_id, rifa_id, file_id):
-    import time
-
-    db = get_db()
-    cursor = db.cursor()
-
-    try:
-        cursor.execute("SELECT username FROM usuarios WHERE user_id = %s", (user_id,))
-        user = cursor.fetchone()
-
-        cursor.execute("SELECT timestamp FROM pagos WHERE id = %s", (pago_id,))
-        timestamp = cursor.fetchone()[0]
-
-        cursor.execute("SELECT precio FROM rifas WHERE id = %s", (rifa_id,))
-        precio = cursor.fetchone()[0]
-    finally:
-        return_db(db)
-
-    nombre = user[0] if user else "Sin nombre"
-    numeros = obtener_numeros_pago(pago_id)
-
-    cantidad = len(numeros.split(", ")) if numeros else 0
+async def enviar_comprobante_admin(pago, file_id):
+    """
+    `pago` es el resumen que arma recibir_comprobante en la misma consulta
+    que pasa el pago a revisión: (pago_id, user_id, username, precio,
+    números, segundos desde la reserva). Aquí no se vuelve a la base.
+    """
+    pago_id, user_id, username, precio, numeros, edad = pago
+
+    nombre = username or "Sin nombre"
+    cantidad = len(numeros)
+    numeros = ", ".join(str(n) for n in numeros)
     monto = precio * cantidad
 
-    minutos = int((time.time() - timestamp) / 60)
+    minutos = int(edad / 60)
 
     texto = (
         "<b>📌 Nuevo comprobante de pago</b>\n\n"
@@ -533,7 +579,10 @@ async def enviar_comprobante_admin(context, pago_id, user_id, rifa_id, file_id):
         ]
     ])
 
-    await context.bot.send_photo(
+    # Los comprobantes salen antes que cualquier aviso a usuarios
+    encolar(
+        "send_photo",
+        PRIORIDAD_ADMIN,
         chat_id=ADMIN_ID,
         photo=file_id,
         caption=texto,
@@ -570,6 +619,40 @@ async def toggle_numero(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await mostrar_numeros(query, context)
 
+async def reservar_numeros(db, rifa_id, user_id, numeros, timestamp):
+    """
+    Crea el pago y reserva los números en una sola sentencia.
+
+    Solo se toman los números que siguen libres (reservado = 0), así dos
+    compradores nunca obtienen el mismo número. Devuelve
+    (pago_id, precio, obtenidos); si faltan números en `obtenidos` el
+    llamador debe hacer rollback para descartar el pago.
+    """
+    cursor = await db.execute("""
+        WITH pago AS (
+            INSERT INTO pagos (user_id, rifa_id, estado, timestamp)
+            VALUES (%s, %s, 'pendiente', %s)
+            RETURNING id
+        ),
+        reservados AS (
+            UPDATE numeros n
+            SET reservado = 1,
+                user_id = %s,
+                pago_id = pago.id
+            FROM pago
+            WHERE n.rifa_id = %s
+            AND n.numero = ANY(%s)
+            AND n.reservado = 0
+            RETURNING n.numero
+        )
+        SELECT pago.id,
+               COALESCE((SELECT precio FROM rifas WHERE id = %s), 0),
+               ARRAY(SELECT numero FROM reservados ORDER BY numero)
+        FROM pago
+    """, (user_id, rifa_id, timestamp, user_id, rifa_id, sorted(numeros), rifa_id))
+
+    return await cursor.fetchone()
+
 async def confirmar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -585,58 +668,31 @@ async def confirmar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     import time
     timestamp = int(time.time())
 
-    db = get_db()
-    cursor = db.cursor()
+    async with connection() as db:
+        pago_id, precio, obtenidos = await reservar_numeros(
+            db, rifa_id, user_id, seleccionados, timestamp
+        )
 
-    try:
-        # Obtener precio de la rifa
-        cursor.execute("SELECT precio FROM rifas WHERE id = %s", (rifa_id,))
-        precio_result = cursor.fetchone()
-        precio = precio_result[0] if precio_result else 0
-        
-        # 🔒 Verificar que sigan libres
-        placeholders = ",".join(["%s"] * len(seleccionados))
-        cursor.execute(f"""
-            SELECT numero
-            FROM numeros
-            WHERE rifa_id = %s
-            AND numero IN ({placeholders})
-            AND reservado = 1
-        """, (rifa_id, *seleccionados))
-
-        ocupados = cursor.fetchall()
+        ocupados = sorted(set(seleccionados) - set(obtenidos))
 
         if ocupados:
-            db.rollback()
-            await query.message.reply_text(
-                "⛔ Algunos números ya fueron reservados.\n"
-                "Actualizando lista…"
-            )
-            await mostrar_numeros(query, context)
-            return
-
-        # 1️⃣ Crear el pago
-        cursor.execute("""
-            INSERT INTO pagos (user_id, rifa_id, estado, timestamp)
-            VALUES (%s, %s, 'pendiente', %s)
-            RETURNING id
-        """, (user_id, rifa_id, timestamp))
+            # 🔒 Alguien más los tomó: deshacer el pago y la reserva parcial
+            await db.rollback()
 
-        pago_id = cursor.fetchone()[0]
-
-        # 2️⃣ Reservar números ligados a ese pago
-        cursor.execute(f"""
-            UPDATE numeros
-            SET reservado = 1,
-                user_id = %s,
-                pago_id = %s
-            WHERE rifa_id = %s
-            AND numero IN ({placeholders})
-        """, (user_id, pago_id, rifa_id, *seleccionados))
+    if ocupados:
+        # La caché estaba desactualizada: esos números ya tienen dueño
+        marcar_reservados(rifa_id, ocupados)
+        context.user_data["seleccionados"] = set(obtenidos)
+        await query.message.reply_text(
+            "⛔ Algunos números ya fueron reservados: "
+            f"{', '.join(map(str, ocupados))}\n"
+            "Actualizando lista…"
+        )
+        await mostrar_numeros(query, context)
+        return
 
-        db.commit()
-    finally:
-        return_db(db)
+    marcar_reservados(rifa_id, obtenidos)
+    programar_expiracion(context.job_queue, pago_id, timestamp)
 
     # Calcular monto total
     cantidad_numeros = len(seleccionados)
@@ -664,55 +720,144 @@ async def confirmar(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     context.user_data.clear()
 
-async def ir_pag_0(update: Update, context: ContextTypes.DEFAULT_TYPE):
+def total_paginas(total_numeros):
+    return max(1, -(-total_numeros // NUMEROS_POR_PAGINA))
+
+def rango_pagina(pagina, total_numeros):
+    """Números (inicio, fin) que muestra la página, fin exclusivo"""
+    inicio = pagina * NUMEROS_POR_PAGINA
+    return inicio, min(inicio + NUMEROS_POR_PAGINA, total_numeros)
+
+def etiqueta_rango(inicio, fin):
+    return f"{inicio}–{fin - 1}"
+
+async def ir_pagina(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    context.user_data["pagina"] = 0
+    context.user_data["pagina"] = int(query.data.split("_")[1])
     await mostrar_numeros(query, context)
 
-async def ir_pag_1(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def menu_rangos(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Menú para saltar a un rango de números (en grupos si la rifa es grande)"""
     query = update.callback_query
     await query.answer()
 
-    context.user_data["pagina"] = 1
+    rifa_id = context.user_data.get("rifa_id")
+    rifa = await obtener_rifa(rifa_id) if rifa_id else None
+
+    if not rifa:
+        await query.message.edit_text("❌ Esta rifa ya no está disponible.")
+        return
+
+    total = rifa["total"]
+    paginas = total_paginas(total)
+    pagina_actual = context.user_data.get("pagina", 0)
+    partes = query.data.split("_")
+
+    if paginas <= PAGINAS_POR_MENU or len(partes) > 1:
+        # Lista de páginas (de un grupo, si hay muchas)
+        grupo = int(partes[1]) if len(partes) > 1 else 0
+        primera = grupo * PAGINAS_POR_MENU
+        ultima = min(primera + PAGINAS_POR_MENU, paginas)
+
+        botones = [
+            InlineKeyboardButton(
+                etiqueta_rango(*rango_pagina(pagina, total)),
+                callback_data=f"pag_{pagina}"
+            )
+            for pagina in range(primera, ultima)
+        ]
+        texto = "🔢 *Elige un rango de números:*"
+        volver = "rangos" if paginas > PAGINAS_POR_MENU else f"pag_{pagina_actual}"
+    else:
+        # Primero se elige el grupo de páginas
+        grupos = -(-paginas // PAGINAS_POR_MENU)
+        botones = []
+
+        for grupo in range(grupos):
+            inicio = rango_pagina(grupo * PAGINAS_POR_MENU, total)[0]
+            fin = rango_pagina(min((grupo + 1) * PAGINAS_POR_MENU, paginas) - 1, total)[1]
+            botones.append(
+                InlineKeyboardButton(etiqueta_rango(inicio, fin), callback_data=f"rangos_{grupo}")
+            )
+
+        texto = "🔢 *Elige un grupo de números:*"
+        volver = f"pag_{pagina_actual}"
+
+    keyboard = [botones[i:i + 4] for i in range(0, len(botones), 4)]
+    keyboard.append([InlineKeyboardButton("◀️ Volver", callback_data=volver)])
+
+    await query.message.edit_text(
+        texto,
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode="Markdown"
+    )
+
+async def numero_al_azar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Agrega a la selección un número libre al azar y salta a su página"""
+    import random
+
+    query = update.callback_query
+
+    rifa_id = context.user_data.get("rifa_id")
+    rifa = await obtener_rifa(rifa_id) if rifa_id else None
+    seleccionados = context.user_data.setdefault("seleccionados", set())
+
+    if not rifa:
+        await query.answer()
+        await query.message.edit_text("❌ Esta rifa ya no está disponible.")
+        return
+
+    total = rifa["total"]
+    elegido = None
+
+    # Con pocos números ocupados basta con unos intentos al azar
+    for _ in range(20):
+        numero = random.randrange(total)
+        if not esta_reservado(rifa, numero) and numero not in seleccionados:
+            elegido = numero
+            break
+
+    if elegido is None:
+        libres = [
+            numero for numero in range(total)
+            if not esta_reservado(rifa, numero) and numero not in seleccionados
+        ]
+        elegido = random.choice(libres) if libres else None
+
+    if elegido is None:
+        await query.answer("😕 No quedan números libres.", show_alert=True)
+        return
+
+    await query.answer(f"🎲 Número {elegido}")
+
+    seleccionados.add(elegido)
+    context.user_data["pagina"] = elegido // NUMEROS_POR_PAGINA
     await mostrar_numeros(query, context)
 
 async def mostrar_numeros(query, context: ContextTypes.DEFAULT_TYPE):
     rifa_id = context.user_data["rifa_id"]
     seleccionados = context.user_data.get("seleccionados", set())
 
-    db = get_db()
-    cursor = db.cursor()
+    # Disponibilidad desde la caché en memoria (sin consultas por cada toque)
+    rifa = await obtener_rifa(rifa_id)
 
-    try:
-        cursor.execute("""
-            SELECT nombre, precio
-            FROM rifas
-            WHERE id = %s
-        """, (rifa_id,))
-        rifa = cursor.fetchone()
-
-        cursor.execute("""
-            SELECT numero, reservado
-            FROM numeros
-            WHERE rifa_id = %s
-            ORDER BY numero
-        """, (rifa_id,))
-        numeros = cursor.fetchall()
-    finally:
-        return_db(db)
+    if not rifa:
+        await query.message.edit_text("❌ Esta rifa ya no está disponible.")
+        return
 
-    pagina = context.user_data.get("pagina", 0)
+    # Solo se recorre la ventana visible del bitmap: O(página) sin importar el total
+    paginas = total_paginas(rifa["total"])
+    pagina = min(max(context.user_data.get("pagina", 0), 0), paginas - 1)
+    context.user_data["pagina"] = pagina
 
-    if pagina == 0:
-        numeros = numeros[:50]
-    else:
-        numeros = numeros[50:100]
+    inicio, fin = rango_pagina(pagina, rifa["total"])
+    numeros = [(numero, esta_reservado(rifa, numero)) for numero in range(inicio, fin)]
 
     texto = (
-        f"🎟️ *{rifa[0]}*\n"
-        f"💰 Precio: {rifa[1]}\n\n"
+        f"🎟️ *{rifa['nombre']}*\n"
+        f"💰 Precio: {rifa['precio']}\n\n"
     )
 
     if seleccionados:
@@ -747,23 +892,44 @@ async def mostrar_numeros(query, context: ContextTypes.DEFAULT_TYPE):
     if fila:
         keyboard.append(fila)
 
-    nav = []
+    if paginas > 1:
+        nav = []
+
+        if pagina > 0:
+            nav.append(
+                InlineKeyboardButton("⬅️", callback_data=f"pag_{pagina - 1}")
+            )
 
-    if pagina == 1:
         nav.append(
-            InlineKeyboardButton("⬅️ 0–49", callback_data="pag_0")
+            InlineKeyboardButton(
+                f"🔢 {etiqueta_rango(inicio, fin)} ({pagina + 1}/{paginas})",
+                callback_data="rangos"
+            )
         )
 
-    nav.append(
-        InlineKeyboardButton("✅ Confirmar", callback_data="confirmar")
-    )
+        if pagina < paginas - 1:
+            nav.append(
+                InlineKeyboardButton("➡️", callback_data=f"pag_{pagina + 1}")
+            )
 
-    if pagina == 0:
-        nav.append(
-            InlineKeyboardButton("➡️ 50–99", callback_data="pag_1")
-        )
+        keyboard.append(nav)
+
+    if paginas > SALTO_PAGINAS:
+        keyboard.append([
+            InlineKeyboardButton(
+                f"⏪ -{SALTO_PAGINAS}",
+                callback_data=f"pag_{max(pagina - SALTO_PAGINAS, 0)}"
+            ),
+            InlineKeyboardButton(
+                f"+{SALTO_PAGINAS} ⏩",
+                callback_data=f"pag_{min(pagina + SALTO_PAGINAS, paginas - 1)}"
+            )
+        ])
 
-    keyboard.append(nav)
+    keyboard.append([
+        InlineKeyboardButton("🎲 Al azar", callback_data="azar"),
+        InlineKeyboardButton("✅ Confirmar", callback_data="confirmar")
+    ])
 
     await query.message.edit_text(
         texto,
@@ -771,47 +937,62 @@ async def mostrar_numeros(query, context: ContextTypes.DEFAULT_TYPE):
         parse_mode="Markdown"
     )
 
-async def mis_boletas(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-
-    db = get_db()
-    cursor = db.cursor()
+async def obtener_boletas_usuario(user_id, offset=0, limite=BOLETAS_POR_PAGINA):
+    """
+    Compras aprobadas del usuario con sus números, en una sola consulta.
+
+    Devuelve (boletas, total) donde boletas es una lista de
+    (pago_id, rifa_nombre, estado, timestamp, numeros) de la página pedida
+    y total es la cantidad de compras del usuario.
+    """
+    async with connection() as db:
+        cursor = await db.execute("""
+            WITH pagina AS (
+                SELECT p.id, p.rifa_id, p.estado, p.timestamp,
+                       COUNT(*) OVER () AS total
+                FROM pagos p
+                WHERE p.user_id = %s AND p.estado = 'aprobado'
+                ORDER BY p.timestamp DESC, p.id DESC
+                LIMIT %s OFFSET %s
+            )
+            SELECT pg.id, r.nombre, pg.estado, pg.timestamp,
+                   COALESCE(
+                       array_agg(n.numero ORDER BY n.numero)
+                       FILTER (WHERE n.numero IS NOT NULL),
+                       '{}'
+                   ),
+                   pg.total
+            FROM pagina pg
+            JOIN rifas r ON r.id = pg.rifa_id
+            LEFT JOIN numeros n ON n.pago_id = pg.id
+            GROUP BY pg.id, r.nombre, pg.estado, pg.timestamp, pg.total
+            ORDER BY pg.timestamp DESC, pg.id DESC
+        """, (user_id, limite, offset))
+
+        filas = await cursor.fetchall()
+
+    total = filas[0][5] if filas else 0
+    return [fila[:5] for fila in filas], total
+
+async def mostrar_mis_boletas(message, user_id, offset=0, editar=False):
+    """Arma y envía (o edita) la página de MIS BOLETAS que empieza en `offset`"""
+    from datetime import datetime
 
-    try:
-        cursor.execute("""
-            SELECT p.id, r.nombre, p.estado, p.timestamp
-            FROM pagos p
-            JOIN rifas r ON r.id = p.rifa_id
-            WHERE p.user_id = %s AND p.estado = 'aprobado'
-            ORDER BY p.timestamp DESC
-        """, (user_id,))
+    boletas, total = await obtener_boletas_usuario(user_id, offset)
 
-        pagos = cursor.fetchall()
+    if not boletas and offset > 0:
+        # La lista cambió desde que se dibujó el botón: volver al inicio
+        offset = 0
+        boletas, total = await obtener_boletas_usuario(user_id, offset)
 
-        if not pagos:
-            msg = (
-                "📭 *No tienes compras registradas aún.*"
-            )
-            if hasattr(update, 'message'):
-                await update.message.reply_text(msg, parse_mode="Markdown")
-            else:
-                await update.reply_text(msg, parse_mode="Markdown")
-            return
+    keyboard = []
 
+    if not boletas:
+        texto = "📭 *No tienes compras registradas aún.*"
+    else:
         texto = "🎟️ *MIS BOLETAS*\n\n"
 
-        import time
-        from datetime import datetime
-
-        for pago_id, rifa_nombre, estado, timestamp in pagos:
-            cursor.execute("""
-                SELECT numero
-                FROM numeros
-                WHERE pago_id = %s
-                ORDER BY numero
-            """, (pago_id,))
-
-            numeros = [str(n[0]) for n in cursor.fetchall()]
+        for pago_id, rifa_nombre, estado, timestamp, numeros in boletas:
             fecha = datetime.fromtimestamp(timestamp).strftime("%d/%m/%Y %H:%M")
 
             estado_txt = {
@@ -821,152 +1002,131 @@ async def mis_boletas(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "rechazado": "❌ Rechazado"
             }.get(estado, estado)
 
+            # En rifas grandes una compra puede tener cientos de números
+            numeros_txt = ", ".join(map(str, numeros[:MAX_NUMEROS_POR_BOLETA]))
+            if len(numeros) > MAX_NUMEROS_POR_BOLETA:
+                numeros_txt += f" … (+{len(numeros) - MAX_NUMEROS_POR_BOLETA})"
+
             texto += (
                 f"🎫 *Rifa:* {rifa_nombre}\n"
-                f"🎟️ *Números:* {', '.join(numeros) if numeros else '—'}\n"
+                f"🎟️ *Números:* {numeros_txt or '—'}\n"
                 f"💳 *Estado:* {estado_txt}\n"
                 f"🕒 *Fecha:* {fecha}\n"
                 "──────────────\n"
             )
-    finally:
-        return_db(db)
-
-    if hasattr(update, 'message'):
-        await update.message.reply_text(texto, parse_mode="Markdown")
-    else:
-        await update.reply_text(texto, parse_mode="Markdown")
-
-async def mis_boletas_callback(query, context: ContextTypes.DEFAULT_TYPE):
-    """Versión para callback de mis_boletas"""
-    user_id = query.from_user.id
-
-    db = get_db()
-    cursor = db.cursor()
-
-    try:
-        cursor.execute("""
-            SELECT p.id, r.nombre, p.estado, p.timestamp
-            FROM pagos p
-            JOIN rifas r ON r.id = p.rifa_id
-            WHERE p.user_id = %s AND p.estado = 'aprobado'
-            ORDER BY p.timestamp DESC
-        """, (user_id,))
 
-        pagos = cursor.fetchall()
-
-        if not pagos:
-            keyboard = [[InlineKeyboardButton("◀️ Volver", callback_data="menu_principal")]]
-            await query.message.reply_text(
-                "📭 *No tienes compras registradas aún.*",
-                reply_markup=InlineKeyboardMarkup(keyboard),
-                parse_mode="Markdown"
+        if total > BOLETAS_POR_PAGINA:
+            texto += (
+                f"\n📄 Compras {offset + 1}–{offset + len(boletas)} de {total}"
             )
-            return
-
-        texto = "🎟️ *MIS BOLETAS*\n\n"
 
-        import time
-        from datetime import datetime
+            nav = []
+            if offset > 0:
+                nav.append(InlineKeyboardButton(
+                    "⬅️ Más recientes",
+                    callback_data=f"misboletas_{max(offset - BOLETAS_POR_PAGINA, 0)}"
+                ))
+            if offset + BOLETAS_POR_PAGINA < total:
+                nav.append(InlineKeyboardButton(
+                    "Anteriores ➡️",
+                    callback_data=f"misboletas_{offset + BOLETAS_POR_PAGINA}"
+                ))
+            keyboard.append(nav)
 
-        for pago_id, rifa_nombre, estado, timestamp in pagos:
-            cursor.execute("""
-                SELECT numero
-                FROM numeros
-                WHERE pago_id = %s
-                ORDER BY numero
-            """, (pago_id,))
-
-            numeros = [str(n[0]) for n in cursor.fetchall()]
-            fecha = datetime.fromtimestamp(timestamp).strftime("%d/%m/%Y %H:%M")
-
-            estado_txt = {
-                "pendiente": "⏳ Pendiente de pago",
-                "en_revision": "🔍 En revisión",
-                "aprobado": "✅ Aprobado",
-                "rechazado": "❌ Rechazado"
-            }.get(estado, estado)
-
-            texto += (
-                f"🎫 *Rifa:* {rifa_nombre}\n"
-                f"🎟️ *Números:* {', '.join(numeros) if numeros else '—'}\n"
-                f"💳 *Estado:* {estado_txt}\n"
-                f"🕒 *Fecha:* {fecha}\n"
-                "──────────────\n"
-            )
-    finally:
-        return_db(db)
+    keyboard.append([InlineKeyboardButton("◀️ Volver", callback_data="menu_principal")])
 
-    keyboard = [[InlineKeyboardButton("◀️ Volver", callback_data="menu_principal")]]
-    await query.message.reply_text(
-        texto,
-        reply_markup=InlineKeyboardMarkup(keyboard),
-        parse_mode="Markdown"
-    )
+    if editar:
+        await message.edit_text(
+            texto,
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode="Markdown"
+        )
+    else:
+        await message.reply_text(
+            texto,
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode="Markdown"
+        )
 
-def get_estadisticas_rifa(rifa_id):
-    db = get_db()
-    cursor = db.cursor()
+async def mis_boletas(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await mostrar_mis_boletas(update.message, update.effective_user.id)
 
-    try:
-        # Total números
-        cursor.execute("""
-            SELECT total_numeros FROM rifas WHERE id = %s
-        """, (rifa_id,))
-        total = cursor.fetchone()[0]
+async def mis_boletas_callback(query, context: ContextTypes.DEFAULT_TYPE):
+    """Versión para callback de mis_boletas"""
+    await mostrar_mis_boletas(query.message, query.from_user.id)
 
-        # Pagos por estado
-        cursor.execute("""
-            SELECT estado, COUNT(*) 
-            FROM pagos
-            WHERE rifa_id = %s
-            GROUP BY estado
-        """, (rifa_id,))
+async def mis_boletas_pagina(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
 
-        pagos = {
-            "pendiente": 0,
-            "en_revision": 0,
-            "aprobado": 0,
-            "rechazado": 0,
-            "expirado": 0
+    offset = int(query.data.split("_")[1])
+    await mostrar_mis_boletas(query.message, query.from_user.id, offset, editar=True)
+
+async def get_estadisticas_rifas(rifa_id=None):
+    """
+    Estadísticas de una rifa (o de todas si rifa_id es None) en una sola
+    consulta. Devuelve {rifa_id: estadísticas}; se guardan en caché unos
+    segundos y se invalidan con cada cambio de estado de un pago.
+    """
+    cacheadas = estadisticas_cacheadas(rifa_id)
+    if cacheadas is not None:
+        return cacheadas
+
+    # Filtro fijo (no "%s IS NULL OR ..."): así el planner empuja
+    # r.id = X dentro del GROUP BY y solo toca los pagos de esa rifa
+    filtro = "WHERE r.id = %s" if rifa_id is not None else ""
+    parametros = (rifa_id,) if rifa_id is not None else ()
+
+    async with connection() as db:
+        cursor = await db.execute("""
+            SELECT r.id, r.nombre, r.total_numeros,
+                   r.numeros_vendidos,
+                   r.numeros_ocupados - r.numeros_vendidos,
+                   COALESCE(pag.pendiente, 0), COALESCE(pag.en_revision, 0),
+                   COALESCE(pag.aprobado, 0), COALESCE(pag.rechazado, 0),
+                   COALESCE(pag.expirado, 0)
+            FROM rifas r
+            LEFT JOIN (
+                SELECT rifa_id,
+                       COUNT(*) FILTER (WHERE estado = 'pendiente') AS pendiente,
+                       COUNT(*) FILTER (WHERE estado = 'en_revision') AS en_revision,
+                       COUNT(*) FILTER (WHERE estado = 'aprobado') AS aprobado,
+                       COUNT(*) FILTER (WHERE estado = 'rechazado') AS rechazado,
+                       COUNT(*) FILTER (WHERE estado = 'expirado') AS expirado
+                FROM pagos
+                GROUP BY rifa_id
+            ) pag ON pag.rifa_id = r.id
+            """ + filtro + """
+            ORDER BY r.id
+        """, parametros)
+
+        filas = await cursor.fetchall()
+
+    estadisticas = {}
+
+    for (id_rifa, nombre, total, vendidos, reservados,
+         pendiente, en_revision, aprobado, rechazado, expirado) in filas:
+        estadisticas[id_rifa] = {
+            "nombre": nombre,
+            "total": total,
+            "vendidos": vendidos,
+            "reservados": reservados,
+            "libres": total - vendidos - reservados,
+            "pagos": {
+                "pendiente": pendiente,
+                "en_revision": en_revision,
+                "aprobado": aprobado,
+                "rechazado": rechazado,
+                "expirado": expirado
+            }
         }
 
-        for estado, cantidad in cursor.fetchall():
-            pagos[estado] = cantidad
+    guardar_estadisticas(rifa_id, estadisticas)
+    return estadisticas
 
-        # Números vendidos (pagos aprobados)
-        cursor.execute("""
-            SELECT COUNT(*)
-            FROM numeros
-            WHERE rifa_id = %s
-            AND pago_id IN (
-                SELECT id FROM pagos WHERE estado = 'aprobado'
-            )
-        """, (rifa_id,))
-        vendidos = cursor.fetchone()[0]
-
-        # Números reservados (pendiente / en revisión)
-        cursor.execute("""
-            SELECT COUNT(*)
-            FROM numeros
-            WHERE rifa_id = %s
-            AND pago_id IN (
-                SELECT id FROM pagos
-                WHERE estado IN ('pendiente', 'en_revision')
-            )
-        """, (rifa_id,))
-        reservados = cursor.fetchone()[0]
-
-        libres = total - vendidos - reservados
-    finally:
-        return_db(db)
-
-    return {
-        "total": total,
-        "vendidos": vendidos,
-        "reservados": reservados,
-        "libres": libres,
-        "pagos": pagos
-    }
+async def get_estadisticas_rifa(rifa_id):
+    """Estadísticas de una rifa, o None si no existe"""
+    return (await get_estadisticas_rifas(rifa_id)).get(rifa_id)
 
 async def stats_rifa(update, context):
     if update.effective_user.id != ADMIN_ID:
@@ -978,7 +1138,11 @@ async def stats_rifa(update, context):
         return
 
     rifa_id = int(context.args[0])
-    stats = get_estadisticas_rifa(rifa_id)
+    stats = await get_estadisticas_rifa(rifa_id)
+
+    if not stats:
+        await update.message.reply_text("❌ La rifa no existe.")
+        return
 
     texto = (
         f"📊 *Estadísticas – Rifa #{rifa_id}*\n\n"
@@ -996,60 +1160,167 @@ async def stats_rifa(update, context):
 
     await update.message.reply_text(texto, parse_mode="Markdown")
 
-async def expirar_pagos_y_liberar_job(context: ContextTypes.DEFAULT_TYPE):
+async def estado_db(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ No autorizado.")
+        return
+
+    m = pool_metrics()
+    c = cache_metrics()
+    d = dispatcher_metrics()
+    r = replicas_metrics()
+    p = context.application.persistence.metricas()
+    g = render_metrics()
+    a = artefactos.artefactos_metrics()
+
+    histograma = "\n".join(
+        f"`{limite:>7}` ms: {cantidad}"
+        for limite, cantidad in m["acquire_ms_histogram"].items()
+        if cantidad
+    )
+
+    texto = (
+        "🐘 *Pool de conexiones*\n\n"
+        f"🔌 En uso: *{m['in_use']}* / {m['size']} abiertas "
+        f"(mín {m.get('min_size', 0)}, máx {m.get('max_size', 0)})\n"
+        f"⏳ En espera: *{m['waiting']}*\n"
+        f"⌛ Timeouts: *{m['timeouts']}*\n"
+        f"📥 Préstamos: {m['acquired']} (prom. {m['acquire_ms_avg']:.1f} ms)\n"
+        f"💔 Conexiones perdidas: {m.get('connections_lost', 0)}\n\n"
+        f"*Espera por conexión:*\n{histograma or '—'}\n\n"
+        f"🧠 Caché de números: {c['rifas']} rifas, "
+        f"{c['hits']} aciertos / {c['misses']} recargas\n\n"
+        "📤 *Cola de envíos*\n"
+        + "\n".join(f"{carril}: {cantidad}" for carril, cantidad in d["pendientes"].items())
+        + f"\n⏸ Esperando reintento: {d['diferidos']}\n"
+        f"✅ Enviados: {d['enviados']} · 🔁 Reintentos: {d['reintentos']} "
+        f"(429: {d['limitados']})\n"
+        f"❌ Fallidos: {d['fallidos']} · 🗑 Descartados: {d['descartados']}\n\n"
+        "🧩 *Réplica*\n"
+        f"👑 Líder: {'sí' if r['lider'] else 'no'}\n"
+        f"♻️ Updates repetidos: {r['duplicados']}\n"
+        f"📥 Estado recargado de otra réplica: {r['recargas']}\n"
+        f"🔎 Updates que consultaron la base: {r['consultas']}\n"
+        f"💾 Estado guardado: {p['guardados']} usuarios en {p['lotes']} lotes "
+        f"(pendientes: {p['pendientes']}, errores: {p['errores']})\n\n"
+        "🖨️ *Exportaciones*\n"
+        f"⚙️ En curso: {g['en_curso']} · ✅ Terminadas: {g['terminados']}\n"
+        f"🚫 Rechazadas: {g['rechazados']} · ⌛ Timeouts: {g['timeouts']} · "
+        f"❌ Errores: {g['errores']}\n"
+        f"🗂 Caché: {a['archivos']} archivos ({a['mb']:.1f} MB), "
+        f"{a['hits']} aciertos / {a['misses']} generados, "
+        f"{a['reusos_file_id']} reenvíos sin subir"
+    )
+
+    await update.message.reply_text(texto, parse_mode="Markdown")
+
+async def expirar_pagos(pago_id=None):
+    """
+    Expira los pagos pendientes cuyo plazo ya venció (solo `pago_id` si se
+    indica) y libera sus números. Devuelve la cantidad de pagos expirados.
+    """
     import time
     ahora = int(time.time())
 
-    db = get_db()
-    cursor = db.cursor()
+    # El timer de un pago ya dispara en su plazo: no se vuelve a exigir la
+    # edad (un disparo unos milisegundos antes dejaría el pago colgado)
+    limite = ahora if pago_id is not None else ahora - TIEMPO_RESERVA
 
-    try:
-        cursor.execute("""
-            SELECT id, user_id, timestamp
+    # Expirar pagos y liberar sus números en una sola sentencia; el commit
+    # ocurre al salir del bloque, antes de hablar con Telegram
+    async with connection() as db:
+        cursor = await db.execute("""
+            WITH expirados AS (
+                UPDATE pagos
+                SET estado = 'expirado'
+                WHERE estado = 'pendiente'
+                AND timestamp <= %s
+                AND (%s::integer IS NULL OR id = %s)
+                RETURNING id, user_id
+            ),
+            liberados AS (
+                UPDATE numeros n
+                SET reservado = 0,
+                    user_id = NULL,
+                    pago_id = NULL
+                FROM expirados e
+                WHERE n.pago_id = e.id
+                RETURNING e.id AS pago_id, n.rifa_id, n.numero
+            )
+            SELECT e.id, e.user_id, l.rifa_id,
+                   COALESCE(
+                       array_agg(l.numero) FILTER (WHERE l.numero IS NOT NULL),
+                       '{}'
+                   )
+            FROM expirados e
+            LEFT JOIN liberados l ON l.pago_id = e.id
+            GROUP BY e.id, e.user_id, l.rifa_id
+        """, (limite, pago_id, pago_id))
+
+        expirados = await cursor.fetchall()
+
+    if not expirados:
+        return 0
+
+    for pago_id, user_id, rifa_id, numeros in expirados:
+        if rifa_id is not None:
+            marcar_liberados(rifa_id, numeros)
+
+    # Avisar a los usuarios a través de la cola de envíos
+    for _, user_id, _, _ in expirados:
+        encolar(
+            "send_message",
+            PRIORIDAD_USUARIO,
+            chat_id=user_id,
+            text=(
+                "⏱ *Tiempo expirado*\n\n"
+                "No enviaste el comprobante dentro de los 10 minutos.\n"
+                "🎟️ Los números fueron liberados automáticamente.\n\n"
+                "Si deseas participar nuevamente, escribe /start."
+            ),
+            parse_mode="Markdown"
+        )
+
+    return len(expirados)
+
+def programar_expiracion(job_queue, pago_id, timestamp):
+    """Agenda la expiración del pago justo al cumplirse TIEMPO_RESERVA"""
+    import time
+
+    job_queue.run_once(
+        expirar_pago_job,
+        when=max(timestamp + TIEMPO_RESERVA - time.time(), 0),
+        data=pago_id,
+        name=f"expira_pago_{pago_id}"
+    )
+
+def cancelar_expiracion(job_queue, pago_id):
+    for job in job_queue.get_jobs_by_name(f"expira_pago_{pago_id}"):
+        job.schedule_removal()
+
+async def expirar_pago_job(context: ContextTypes.DEFAULT_TYPE):
+    # Si el comprobante llegó justo a tiempo el UPDATE condicional no hace nada
+    await expirar_pagos(context.job.data)
+
+async def recuperar_expiraciones(application):
+    """
+    Al arrancar, vuelve a agendar los pagos pendientes (los timers viven en
+    memoria y se pierden al reiniciar). Los que ya vencieron se expiran de una.
+    """
+    expirados = await expirar_pagos()
+
+    async with connection() as db:
+        cursor = await db.execute("""
+            SELECT id, timestamp
             FROM pagos
             WHERE estado = 'pendiente'
         """)
+        pendientes = await cursor.fetchall()
 
-        pagos = cursor.fetchall()
+    for pago_id, timestamp in pendientes:
+        programar_expiracion(application.job_queue, pago_id, timestamp)
 
-        for pago_id, user_id, timestamp in pagos:
-            minutos = (ahora - timestamp) // 60
-
-            if minutos >= 10:
-                # Liberar números
-                cursor.execute("""
-                    UPDATE numeros
-                    SET reservado = 0,
-                        user_id = NULL,
-                        pago_id = NULL
-                    WHERE pago_id = %s
-                """, (pago_id,))
-
-                # Marcar como expirado
-                cursor.execute("""
-                    UPDATE pagos
-                    SET estado = 'expirado'
-                    WHERE id = %s
-                """, (pago_id,))
-
-                # Avisar al usuario
-                try:
-                    await context.bot.send_message(
-                        chat_id=user_id,
-                        text=(
-                            "⏱ *Tiempo expirado*\n\n"
-                            "No enviaste el comprobante dentro de los 10 minutos.\n"
-                            "🎟️ Los números fueron liberados automáticamente.\n\n"
-                            "Si deseas participar nuevamente, escribe /start."
-                        ),
-                        parse_mode="Markdown"
-                    )
-                except:
-                    pass
-
-        db.commit()
-    finally:
-        return_db(db)
+    print(f"⏱ Expiraciones: {expirados} vencidas, {len(pendientes)} reprogramadas")
 
 # =====================
 # CREACIÓN DE RIFAS (ADMIN)
@@ -1082,6 +1353,28 @@ async def rifa_precio(update, context):
     if "rifa" not in context.user_data:
         context.user_data["rifa"] = {}
     context.user_data["rifa"]["precio"] = update.message.text
+    await update.message.reply_text(
+        "🔢 ¿Cuántos números tendrá la rifa?\n\n"
+        f"Ejemplos: 100, 1000, 10000 (máximo {MAX_NUMEROS_RIFA:,})"
+    )
+    return RIFA_TOTAL
+
+async def rifa_total(update, context):
+    if "rifa" not in context.user_data:
+        context.user_data["rifa"] = {}
+
+    try:
+        total = int(update.message.text.strip().replace(".", "").replace(",", ""))
+    except ValueError:
+        total = 0
+
+    if not 1 <= total <= MAX_NUMEROS_RIFA:
+        await update.message.reply_text(
+            f"❌ Escribe un número entre 1 y {MAX_NUMEROS_RIFA:,}."
+        )
+        return RIFA_TOTAL
+
+    context.user_data["rifa"]["total_numeros"] = total
     await update.message.reply_text("🏆 Premio de la rifa:")
     return RIFA_PREMIO
 
@@ -1102,6 +1395,24 @@ async def rifa_fecha(update, context):
     )
     return RIFA_DESC
 
+async def insertar_rifa(db, nombre, precio, total_numeros):
+    """Crea la rifa y todos sus números (0 a total-1) en una sola sentencia; devuelve el id"""
+    cursor = await db.execute("""
+        WITH nueva_rifa AS (
+            INSERT INTO rifas (nombre, precio, total_numeros)
+            VALUES (%s, %s, %s)
+            RETURNING id
+        ),
+        nuevos_numeros AS (
+            INSERT INTO numeros (rifa_id, numero)
+            SELECT nueva_rifa.id, n
+            FROM nueva_rifa, generate_series(0, %s - 1) AS n
+        )
+        SELECT id FROM nueva_rifa
+    """, (nombre, precio, total_numeros, total_numeros))
+
+    return (await cursor.fetchone())[0]
+
 async def rifa_desc(update, context):
     if "rifa" not in context.user_data:
         await update.message.reply_text("❌ Error: sesión expirada. Intenta de nuevo.")
@@ -1109,38 +1420,18 @@ async def rifa_desc(update, context):
     
     rifa = context.user_data["rifa"]
 
-    db = get_db()
-    cursor = db.cursor()
+    total_numeros = rifa.get("total_numeros", TOTAL_NUMEROS_DEFECTO)
 
-    try:
-        # 1️⃣ Insertar rifa
-        cursor.execute("""
-            INSERT INTO rifas (nombre, precio, total_numeros)
-            VALUES (%s, %s, %s)
-            RETURNING id
-        """, (
-            rifa["nombre"],
-            int(rifa["precio"]),
-            100
-        ))
-
-        rifa_id = cursor.fetchone()[0]
-
-        # 2️⃣ Crear los números (0 al 99)
-        for i in range(0, 100):
-            cursor.execute("""
-                INSERT INTO numeros (rifa_id, numero)
-                VALUES (%s, %s)
-            """, (rifa_id, i))
+    async with connection() as db:
+        rifa_id = await insertar_rifa(db, rifa["nombre"], int(rifa["precio"]), total_numeros)
 
-        db.commit()
-    finally:
-        return_db(db)
+    invalidar_estadisticas(rifa_id)
 
     await update.message.reply_text(
         f"✅ *Rifa creada correctamente*\n\n"
         f"🆔 ID: {rifa_id}\n"
-        f"🎫 {rifa['nombre']}",
+        f"🎫 {rifa['nombre']}\n"
+        f"🔢 Números: 0 – {total_numeros - 1}",
         parse_mode="Markdown"
     )
     
@@ -1160,12 +1451,11 @@ async def recibir_comprobante(update, context):
     import time
     ahora = int(time.time())
 
-    db = get_db()
-    cursor = db.cursor()
+    async with connection() as db:
+        cursor = db.cursor()
 
-    try:
         # Validar que hay un pago pendiente
-        cursor.execute("""
+        await cursor.execute("""
             SELECT id, rifa_id, timestamp, estado
             FROM pagos
             WHERE user_id = %s
@@ -1173,7 +1463,7 @@ async def recibir_comprobante(update, context):
             LIMIT 1
         """, (user_id,))
 
-        pago = cursor.fetchone()
+        pago = await cursor.fetchone()
 
         if not pago:
             await update.message.reply_text(
@@ -1192,9 +1482,34 @@ async def recibir_comprobante(update, context):
             )
             return
 
-        minutos = (ahora - inicio) // 60
-
-        if minutos >= 10:
+        # Condicional: si el timer de expiración ganó la carrera no se toca.
+        # La misma sentencia trae todo lo que necesita el mensaje al admin
+        # (usuario, precio, números), sin pedir otra conexión al pool
+        await cursor.execute("""
+            WITH revision AS (
+                UPDATE pagos
+                SET comprobante = %s, estado = 'en_revision'
+                WHERE id = %s
+                AND estado = 'pendiente'
+                AND timestamp > %s
+                RETURNING id, user_id, rifa_id, timestamp
+            )
+            SELECT rv.id, rv.user_id, u.username, COALESCE(r.precio, 0),
+                   COALESCE(
+                       array_agg(n.numero ORDER BY n.numero) FILTER (WHERE n.numero IS NOT NULL),
+                       '{}'
+                   ),
+                   %s - rv.timestamp
+            FROM revision rv
+            LEFT JOIN usuarios u ON u.user_id = rv.user_id
+            LEFT JOIN rifas r ON r.id = rv.rifa_id
+            LEFT JOIN numeros n ON n.pago_id = rv.id
+            GROUP BY rv.id, rv.user_id, rv.timestamp, u.username, r.precio
+        """, (file_id, pago_id, ahora - TIEMPO_RESERVA, ahora))
+
+        resumen = await cursor.fetchone()
+
+        if not resumen:
             await update.message.reply_text(
                 "⏱ *Tiempo expirado*\n\n"
                 "El plazo para enviar el comprobante terminó.\n"
@@ -1204,23 +1519,12 @@ async def recibir_comprobante(update, context):
             )
             return
 
-        cursor.execute("""
-            UPDATE pagos
-            SET comprobante = %s, estado = 'en_revision'
-            WHERE id = %s
-        """, (file_id, pago_id))
-
-        db.commit()
-    finally:
-        return_db(db)
-
-    await enviar_comprobante_admin(
-        context,
-        pago_id,
-        user_id,
-        rifa_id,
-        file_id
-    )
+        await db.commit()
+
+    cancelar_expiracion(context.job_queue, pago_id)
+    invalidar_estadisticas(rifa_id)
+
+    await enviar_comprobante_admin(resumen, file_id)
 
     await update.message.reply_text(
         "📸 *Comprobante recibido*\n\n"
@@ -1270,30 +1574,15 @@ async def admin_estadisticas(update: Update, context: ContextTypes.DEFAULT_TYPE)
     query = update.callback_query
     await query.answer()
 
-    db = get_db()
-    cursor = db.cursor()
-
-    try:
-        cursor.execute("""
-            SELECT r.id, r.nombre,
-            COUNT(n.id),
-            SUM(CASE WHEN n.reservado = 1 THEN 1 ELSE 0 END)
-            FROM rifas r
-            LEFT JOIN numeros n ON r.id = n.rifa_id
-            GROUP BY r.id, r.nombre
-        """)
-
-        texto = "📊 *ESTADÍSTICAS*\n\n"
-        for rifa_id, nombre, total, reservados in cursor.fetchall():
-            reservados = reservados or 0
-            texto += (
-                f"🎯 *{nombre}*\n"
-                f"Total: {total}\n"
-                f"Reservados: {reservados}\n"
-                f"Libres: {total - reservados}\n\n"
-            )
-    finally:
-        return_db(db)
+    texto = "📊 *ESTADÍSTICAS*\n\n"
+    for rifa_id, nombre, _, total, ocupados, vendidos in await listar_rifas(solo_activas=False):
+        texto += (
+            f"🎯 *{nombre}*\n"
+            f"Total: {total}\n"
+            f"Vendidos: {vendidos}\n"
+            f"Reservados: {ocupados - vendidos}\n"
+            f"Libres: {total - ocupados}\n\n"
+        )
 
     keyboard = [[InlineKeyboardButton("◀️ Volver", callback_data="ir_admin")]]
     await query.message.reply_text(
@@ -1306,68 +1595,296 @@ async def admin_pagos(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    db = get_db()
-    cursor = db.cursor()
+    if query.from_user.id != ADMIN_ID:
+        await query.message.reply_text("⛔ Acceso denegado")
+        return
 
-    try:
-        cursor.execute("""
-            SELECT id, user_id, rifa_id
-            FROM pagos
-            WHERE estado = 'en_revision'
-        """)
+    context.user_data["revision"] = {"offset": 0, "ids": [], "seleccion": set()}
+    await mostrar_revision(query.message, context, editar=False)
+
+async def obtener_pagos_revision(offset, limite=REVISION_POR_PAGINA):
+    """
+    Página de la cola de pagos en revisión (los más antiguos primero) con
+    comprador, rifa, números y monto, en una sola consulta.
+    Devuelve (pagos, total).
+    """
+    async with connection() as db:
+        cursor = await db.execute("""
+            WITH pagina AS (
+                SELECT p.id, p.user_id, p.rifa_id, p.timestamp, p.comprobante,
+                       COUNT(*) OVER () AS total
+                FROM pagos p
+                WHERE p.estado = 'en_revision'
+                ORDER BY p.timestamp, p.id
+                LIMIT %s OFFSET %s
+            )
+            SELECT pg.id, pg.user_id, u.nombre, u.username, r.nombre, r.precio,
+                   COALESCE(
+                       array_agg(n.numero ORDER BY n.numero)
+                       FILTER (WHERE n.numero IS NOT NULL),
+                       '{}'
+                   ),
+                   pg.comprobante, pg.total
+            FROM pagina pg
+            JOIN rifas r ON r.id = pg.rifa_id
+            LEFT JOIN usuarios u ON u.user_id = pg.user_id
+            LEFT JOIN numeros n ON n.pago_id = pg.id
+            GROUP BY pg.id, pg.user_id, pg.timestamp, pg.comprobante, pg.total,
+                     u.nombre, u.username, r.nombre, r.precio
+            ORDER BY pg.timestamp, pg.id
+        """, (limite, offset))
+
+        filas = await cursor.fetchall()
+
+    total = filas[0][8] if filas else 0
+    return [fila[:8] for fila in filas], total
+
+async def mostrar_revision(message, context, editar=True):
+    """Dibuja la cola de revisión: un solo mensaje con la página actual"""
+    revision = context.user_data.setdefault(
+        "revision", {"offset": 0, "ids": [], "seleccion": set()}
+    )
+
+    pagos, total = await obtener_pagos_revision(revision["offset"])
 
-        pagos = cursor.fetchall()
-    finally:
-        return_db(db)
+    if not pagos and revision["offset"] > 0:
+        revision["offset"] = 0
+        pagos, total = await obtener_pagos_revision(0)
+
+    # Solo se pueden aprobar/rechazar los pagos que el admin tiene a la vista
+    revision["ids"] = [pago[0] for pago in pagos]
+    revision["comprobantes"] = {pago[0]: pago[7] for pago in pagos if pago[7]}
+    revision["seleccion"] &= set(revision["ids"])
+    seleccion = revision["seleccion"]
+
+    keyboard = []
 
     if not pagos:
-        keyboard = [[InlineKeyboardButton("◀️ Volver", callback_data="ir_admin")]]
-        await query.message.reply_text(
-            "✅ No hay pagos pendientes.",
-            reply_markup=InlineKeyboardMarkup(keyboard)
+        texto = "✅ No hay pagos pendientes."
+    else:
+        offset = revision["offset"]
+        texto = (
+            f"<b>📥 PAGOS EN REVISIÓN</b> ({offset + 1}–{offset + len(pagos)} de {total})\n\n"
         )
-        return
 
-    for pago_id, user_id, rifa_id in pagos:
-        keyboard = [
-            [
-                InlineKeyboardButton("✅ Aprobar", callback_data=f"aprobar_{pago_id}"),
-                InlineKeyboardButton("❌ Rechazar", callback_data=f"rechazar_{pago_id}")
-            ]
-        ]
+        for pago_id, user_id, nombre, username, rifa_nombre, precio, numeros, _ in pagos:
+            marca = "☑️" if pago_id in seleccion else "⬜"
+            comprador = html.escape(nombre or (f"@{username}" if username else str(user_id)))
+            numeros_txt = ", ".join(map(str, numeros[:MAX_NUMEROS_REVISION]))
+            if len(numeros) > MAX_NUMEROS_REVISION:
+                numeros_txt += f" … (+{len(numeros) - MAX_NUMEROS_REVISION})"
 
-        await query.message.reply_text(
-            f"💳 *Pago ID:* {pago_id}\n"
-            f"👤 Usuario: `{user_id}`\n"
-            f"🎟 Rifa: `{rifa_id}`",
+            texto += (
+                f"{marca} <b>#{pago_id}</b> · 👤 {comprador} · 🎫 {html.escape(rifa_nombre)}\n"
+                f"      🎟️ {numeros_txt or '—'} · 💰 <b>${precio * len(numeros):,}</b>\n"
+            )
+
+        fila = []
+        for pago_id in revision["ids"]:
+            marca = "☑️" if pago_id in seleccion else "⬜"
+            fila.append(InlineKeyboardButton(f"{marca} #{pago_id}", callback_data=f"rev_sel_{pago_id}"))
+            if len(fila) == 4:
+                keyboard.append(fila)
+                fila = []
+        if fila:
+            keyboard.append(fila)
+
+        todos = len(seleccion) == len(revision["ids"])
+        keyboard.append([
+            InlineKeyboardButton("⬜ Ninguno" if todos else "☑️ Todos", callback_data="rev_todos"),
+            InlineKeyboardButton("🖼 Comprobantes", callback_data="rev_fotos")
+        ])
+        keyboard.append([
+            InlineKeyboardButton(f"✅ Aprobar ({len(seleccion)})", callback_data="rev_ok"),
+            InlineKeyboardButton(f"❌ Rechazar ({len(seleccion)})", callback_data="rev_no")
+        ])
+
+        nav = []
+        if offset > 0:
+            nav.append(InlineKeyboardButton(
+                "⬅️", callback_data=f"rev_pag_{max(offset - REVISION_POR_PAGINA, 0)}"
+            ))
+        nav.append(InlineKeyboardButton("🔄", callback_data=f"rev_pag_{offset}"))
+        if offset + REVISION_POR_PAGINA < total:
+            nav.append(InlineKeyboardButton(
+                "➡️", callback_data=f"rev_pag_{offset + REVISION_POR_PAGINA}"
+            ))
+        keyboard.append(nav)
+
+    keyboard.append([InlineKeyboardButton("◀️ Volver", callback_data="ir_admin")])
+
+    if editar:
+        await message.edit_text(
+            texto,
             reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode="HTML"
+        )
+    else:
+        await message.reply_text(
+            texto,
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode="HTML"
+        )
+
+async def revision_seleccionar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    if query.from_user.id != ADMIN_ID:
+        return
+
+    revision = context.user_data.setdefault(
+        "revision", {"offset": 0, "ids": [], "seleccion": set()}
+    )
+
+    if query.data == "rev_todos":
+        if len(revision["seleccion"]) == len(revision["ids"]):
+            revision["seleccion"] = set()
+        else:
+            revision["seleccion"] = set(revision["ids"])
+    else:
+        pago_id = int(query.data.split("_")[2])
+        revision["seleccion"] ^= {pago_id}
+
+    await mostrar_revision(query.message, context)
+
+async def revision_pagina(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    if query.from_user.id != ADMIN_ID:
+        return
+
+    revision = context.user_data.setdefault(
+        "revision", {"offset": 0, "ids": [], "seleccion": set()}
+    )
+    revision["offset"] = int(query.data.split("_")[2])
+    revision["seleccion"] = set()
+
+    await mostrar_revision(query.message, context)
+
+async def revision_comprobantes(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Envía las fotos de la página como álbumes (hasta 10 por llamada)"""
+    query = update.callback_query
+    await query.answer()
+
+    if query.from_user.id != ADMIN_ID:
+        return
+
+    comprobantes = list(context.user_data.get("revision", {}).get("comprobantes", {}).items())
+
+    for i in range(0, len(comprobantes), 10):
+        await query.message.reply_media_group([
+            InputMediaPhoto(file_id, caption=f"#{pago_id}")
+            for pago_id, file_id in comprobantes[i:i + 10]
+        ])
+
+async def revision_aplicar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Aprueba o rechaza en bloque los pagos seleccionados"""
+    query = update.callback_query
+
+    if query.from_user.id != ADMIN_ID:
+        await query.answer()
+        return
+
+    revision = context.user_data.get("revision", {})
+    seleccion = sorted(set(revision.get("seleccion", set())) & set(revision.get("ids", [])))
+
+    if not seleccion:
+        await query.answer("Selecciona al menos un pago.", show_alert=True)
+        return
+
+    await query.answer()
+    aprobar = query.data == "rev_ok"
+
+    # Un solo cambio de estado para todo el lote; "AND estado = 'en_revision'"
+    # ignora los pagos que otro admin ya resolvió
+    async with connection() as db:
+        if aprobar:
+            cursor = await db.execute("""
+                WITH resueltos AS (
+                    UPDATE pagos
+                    SET estado = 'aprobado'
+                    WHERE id = ANY(%s)
+                    AND estado = 'en_revision'
+                    RETURNING id, user_id, rifa_id
+                )
+                SELECT r.id, r.user_id, r.rifa_id,
+                       COALESCE(
+                           array_agg(n.numero ORDER BY n.numero)
+                           FILTER (WHERE n.numero IS NOT NULL),
+                           '{}'
+                       )
+                FROM resueltos r
+                LEFT JOIN numeros n ON n.pago_id = r.id
+                GROUP BY r.id, r.user_id, r.rifa_id
+            """, (seleccion,))
+        else:
+            cursor = await db.execute("""
+                WITH resueltos AS (
+                    UPDATE pagos
+                    SET estado = 'rechazado'
+                    WHERE id = ANY(%s)
+                    AND estado = 'en_revision'
+                    RETURNING id, user_id, rifa_id
+                ),
+                liberados AS (
+                    UPDATE numeros n
+                    SET reservado = 0,
+                        user_id = NULL,
+                        pago_id = NULL
+                    FROM resueltos r
+                    WHERE n.pago_id = r.id
+                    RETURNING r.id AS pago_id, n.numero
+                )
+                SELECT r.id, r.user_id, r.rifa_id,
+                       COALESCE(
+                           array_agg(l.numero ORDER BY l.numero)
+                           FILTER (WHERE l.numero IS NOT NULL),
+                           '{}'
+                       )
+                FROM resueltos r
+                LEFT JOIN liberados l ON l.pago_id = r.id
+                GROUP BY r.id, r.user_id, r.rifa_id
+            """, (seleccion,))
+
+        resueltos = await cursor.fetchall()
+
+    for _, _, rifa_id, numeros in resueltos:
+        if aprobar:
+            invalidar_estadisticas(rifa_id)
+        else:
+            marcar_liberados(rifa_id, numeros)
+
+    # Avisar a los compradores (después del commit) a través de la cola de envíos
+    for _, user_id, _, numeros in resueltos:
+        encolar(
+            "send_message",
+            PRIORIDAD_USUARIO,
+            chat_id=user_id,
+            text=(
+                texto_pago_aprobado(", ".join(map(str, numeros)))
+                if aprobar else texto_pago_rechazado()
+            ),
             parse_mode="Markdown"
         )
 
+    revision["seleccion"] = set()
+    await mostrar_revision(query.message, context)
+
+    omitidos = len(seleccion) - len(resueltos)
+    await query.message.reply_text(
+        f"{'✅ Aprobados' if aprobar else '❌ Rechazados'}: {len(resueltos)}"
+        + (f"\n⚠️ {omitidos} ya no estaban en revisión." if omitidos else "")
+    )
+
 async def admin_talonario_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Callback para ver el talonario desde el panel admin"""
     query = update.callback_query
     await query.answer()
     
-    db = get_db()
-    cursor = db.cursor()
-
-    try:
-        cursor.execute("""
-            SELECT r.id, r.nombre,
-                   COUNT(n.id) as vendidos
-            FROM rifas r
-            LEFT JOIN numeros n
-                ON r.id = n.rifa_id
-                AND n.pago_id IN (
-                    SELECT id FROM pagos WHERE estado = 'aprobado'
-                )
-            GROUP BY r.id, r.nombre
-        """)
-
-        rifas_list = cursor.fetchall()
-    finally:
-        return_db(db)
+    # Vendidos desde el contador de rifas, sin agrupar los números de cada una
+    rifas_list = await listar_rifas(solo_activas=False)
 
     if not rifas_list:
         keyboard = [[InlineKeyboardButton("◀️ Volver", callback_data="ir_admin")]]
@@ -1379,7 +1896,7 @@ async def admin_talonario_callback(update: Update, context: ContextTypes.DEFAULT
 
     teclado = []
 
-    for rifa_id, nombre, vendidos in rifas_list:
+    for rifa_id, nombre, _, _, _, vendidos in rifas_list:
         teclado.append([
             InlineKeyboardButton(
                 f"{nombre} | 🎟️ {vendidos} vendidos",
@@ -1414,14 +1931,11 @@ async def admin_eliminar_rifa_callback(update: Update, context: ContextTypes.DEF
     query = update.callback_query
     await query.answer()
     
-    db = get_db()
-    cursor = db.cursor()
+    async with connection() as db:
+        cursor = db.cursor()
 
-    try:
-        cursor.execute("SELECT id, nombre FROM rifas")
-        rifas_list = cursor.fetchall()
-    finally:
-        return_db(db)
+        await cursor.execute("SELECT id, nombre FROM rifas")
+        rifas_list = await cursor.fetchall()
 
     if not rifas_list:
         keyboard = [[InlineKeyboardButton("◀️ Volver", callback_data="ir_admin")]]
@@ -1455,22 +1969,21 @@ async def confirmar_eliminar_rifa_callback(update: Update, context: ContextTypes
 
     rifa_id = int(query.data.split("_")[2])
 
-    db = get_db()
-    cursor = db.cursor()
+    async with connection() as db:
+        cursor = db.cursor()
 
-    try:
-        cursor.execute("SELECT nombre FROM rifas WHERE id = %s", (rifa_id,))
-        rifa = cursor.fetchone()
+        await cursor.execute("SELECT nombre FROM rifas WHERE id = %s", (rifa_id,))
+        rifa = await cursor.fetchone()
 
         if not rifa:
             await query.message.reply_text("❌ Rifa no encontrada.")
             return
 
         # Eliminar la rifa (CASCADE elimina números y pagos)
-        cursor.execute("DELETE FROM rifas WHERE id = %s", (rifa_id,))
-        db.commit()
-    finally:
-        return_db(db)
+        await cursor.execute("DELETE FROM rifas WHERE id = %s", (rifa_id,))
+        await db.commit()
+
+    invalidar_rifa(rifa_id)
 
     keyboard = [[InlineKeyboardButton("◀️ Volver", callback_data="ir_admin")]]
     await query.message.reply_text(
@@ -1484,25 +1997,8 @@ async def admin_pdf_talonario_callback(update: Update, context: ContextTypes.DEF
     query = update.callback_query
     await query.answer()
     
-    db = get_db()
-    cursor = db.cursor()
-
-    try:
-        cursor.execute("""
-            SELECT r.id, r.nombre,
-                   COUNT(n.id) as vendidos
-            FROM rifas r
-            LEFT JOIN numeros n
-                ON r.id = n.rifa_id
-                AND n.pago_id IN (
-                    SELECT id FROM pagos WHERE estado = 'aprobado'
-                )
-            GROUP BY r.id, r.nombre
-        """)
-
-        rifas_list = cursor.fetchall()
-    finally:
-        return_db(db)
+    # Vendidos desde el contador de rifas, sin agrupar los números de cada una
+    rifas_list = await listar_rifas(solo_activas=False)
 
     if not rifas_list:
         keyboard = [[InlineKeyboardButton("◀️ Volver", callback_data="ir_admin")]]
@@ -1514,7 +2010,7 @@ async def admin_pdf_talonario_callback(update: Update, context: ContextTypes.DEF
 
     teclado = []
 
-    for rifa_id, nombre, vendidos in rifas_list:
+    for rifa_id, nombre, _, _, _, vendidos in rifas_list:
         teclado.append([
             InlineKeyboardButton(
                 f"📄 {nombre} | 🎟️ {vendidos} vendidos",
@@ -1541,52 +2037,68 @@ async def generar_pdf_talonario_callback(update: Update, context: ContextTypes.D
 
     rifa_id = int(query.data.split("_")[2])
 
-    await query.message.reply_text("⏳ Generando PDF del talonario...")
+    aviso = await query.message.reply_text("⏳ Generando PDF del talonario...")
+
+    async def progreso(estado, segundos):
+        encolar(
+            "edit_message_text",
+            PRIORIDAD_ADMIN,
+            chat_id=aviso.chat_id,
+            message_id=aviso.message_id,
+            text=f"⏳ PDF del talonario: {estado}... ({segundos} s)"
+        )
 
     try:
-        pdf_path = await generar_pdf_talonario(rifa_id)
-        
-        # Enviar PDF al admin
-        with open(pdf_path, 'rb') as pdf_file:
-            await query.message.reply_document(
-                document=pdf_file,
-                caption="📄 *Talonario de la rifa*",
-                parse_mode="Markdown"
-            )
-        
-        # Eliminar archivo temporal
-        import os
-        os.remove(pdf_path)
-        
+        pdf = await generar_pdf_talonario(rifa_id, progreso)
+
+        # Enviar PDF al admin (el archivo queda en la caché de artefactos)
+        await responder_artefacto(
+            query.message,
+            pdf,
+            regenerar=lambda: generar_pdf_talonario(rifa_id, progreso),
+            caption="📄 *Talonario de la rifa*",
+            parse_mode="Markdown"
+        )
+
+    except RenderOcupado:
+        await query.message.reply_text(
+            "⏳ Ya hay varias exportaciones en curso. Intenta de nuevo en un momento."
+        )
+    except RenderReiniciado:
+        await query.message.reply_text(
+            "🔄 Otra exportación tardó demasiado y se reiniciaron los procesos. Intenta de nuevo."
+        )
+    except TimeoutError:
+        await query.message.reply_text("⌛ El PDF tardó demasiado y se canceló.")
     except Exception as e:
         await query.message.reply_text(f"❌ Error al generar PDF: {str(e)}")
 
-async def generar_pdf_talonario(rifa_id):
-    """Genera el archivo PDF del talonario"""
-    from reportlab.lib.pagesizes import letter, A4
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib.units import inch
-    from reportlab.lib import colors
+async def generar_pdf_talonario(rifa_id, al_progreso=None):
+    """
+    Consulta el talonario y arma el PDF en un proceso aparte (render.py):
+    el loop no se bloquea mientras reportlab trabaja. Si la rifa no cambió
+    desde el último PDF se reutiliza. Devuelve la entrada de artefactos.
+    """
     from datetime import datetime
-    import tempfile
-    import os
 
-    db = get_db()
-    cursor = db.cursor()
+    async with connection() as db:
+        cursor = db.cursor()
 
-    try:
         # Información de la rifa
-        cursor.execute("SELECT nombre FROM rifas WHERE id = %s", (rifa_id,))
-        rifa = cursor.fetchone()
+        await cursor.execute("SELECT nombre, version FROM rifas WHERE id = %s", (rifa_id,))
+        rifa = await cursor.fetchone()
 
         if not rifa:
             raise Exception("Rifa no encontrada")
 
-        nombre_rifa = rifa[0]
+        nombre_rifa, version = rifa
+
+        pdf = artefactos.obtener("pdf", rifa_id, version)
+        if pdf is not None:
+            return pdf
 
         # Talonario completo
-        cursor.execute("""
+        await cursor.execute("""
             SELECT n.numero,
                    COALESCE(u.nombre, 'DISPONIBLE') as nombre,
                    COALESCE(u.username, '') as username,
@@ -1604,88 +2116,87 @@ async def generar_pdf_talonario(rifa_id):
             ORDER BY n.numero
         """, (rifa_id, rifa_id,))
 
-        datos = cursor.fetchall()
-    finally:
-        return_db(db)
-
-    # Crear archivo temporal
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-    temp_file.close()
-
-    # Crear PDF
-    doc = SimpleDocTemplate(temp_file.name, pagesize=A4)
-    styles = getSampleStyleSheet()
-    story = []
-
-    # Título
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=16,
-        spaceAfter=30,
-        alignment=1  # Centrado
-    )
+        datos = await cursor.fetchall()
 
-    story.append(Paragraph(f"TALONARIO - {nombre_rifa}", title_style))
-    story.append(Paragraph(f"Generado: {datetime.now().strftime('%d/%m/%Y %H:%M')}", styles['Normal']))
-    story.append(Spacer(1, 20))
+    ruta = artefactos.ruta_nueva("pdf", rifa_id, version, "pdf")
 
-    # Tabla de datos
-    table_data = [['#', 'Nombre', 'Usuario', 'Teléfono', 'Estado']]
-    
-    for numero, nombre, username, telefono, estado in datos:
-        table_data.append([
-            str(numero).zfill(2),
-            nombre[:20],  # Limitar longitud
-            f"@{username[:15]}" if username else "",
-            telefono[:15],
-            estado
-        ])
+    try:
+        await renderizar(
+            pdf_talonario,
+            nombre_rifa,
+            datetime.now().strftime('%d/%m/%Y %H:%M'),
+            datos,
+            ruta,
+            al_progreso=al_progreso
+        )
+    except BaseException:
+        artefactos.descartar(ruta)
+        raise
+
+    return artefactos.guardar("pdf", rifa_id, version, ruta)
+
+async def responder_artefacto(message, artefacto, regenerar=None, **kwargs):
+    """
+    Responde con el PDF o la(s) imagen(es) del talonario y devuelve sus
+    file_id. Si esta versión ya se subió a Telegram se reenvía por file_id,
+    sin subir los archivos otra vez. Si la caché borró los archivos antes de
+    abrirlos, `regenerar()` (p. ej. generar_pdf_talonario) los vuelve a crear.
+    """
+    file_ids = artefactos.file_ids_guardados(artefacto)
+    if file_ids:
+        try:
+            await _responder_archivos(message, artefacto["tipo"], file_ids, **kwargs)
+            return file_ids
+        except BadRequest:
+            artefactos.olvidar_file_ids(artefacto)
 
-    # Crear tabla
-    table = Table(table_data, colWidths=[0.5*inch, 2*inch, 1.5*inch, 1.5*inch, 1*inch])
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('FONTSIZE', (0, 1), (-1, -1), 8),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey])
-    ]))
-
-    story.append(table)
-    doc.build(story)
-
-    return temp_file.name
+    try:
+        with ExitStack() as pila:
+            archivos = [pila.enter_context(open(ruta, 'rb')) for ruta in artefacto["rutas"]]
+            mensajes = await _responder_archivos(message, artefacto["tipo"], archivos, **kwargs)
+    except FileNotFoundError:
+        # Expulsado por LRU o reemplazado por una versión nueva desde obtener()
+        if regenerar is None:
+            raise
+        return await responder_artefacto(message, await regenerar(), **kwargs)
+
+    file_ids = [
+        mensaje.document.file_id if artefacto["tipo"] == "pdf" else mensaje.photo[-1].file_id
+        for mensaje in mensajes
+    ]
+    artefactos.recordar_file_ids(artefacto, file_ids)
+
+    return file_ids
+
+async def _responder_archivos(message, tipo, archivos, **kwargs):
+    """Un documento, una foto, o álbumes de hasta 10 fotos (el texto va en el primero)"""
+    if tipo == "pdf":
+        return [await message.reply_document(document=archivos[0], **kwargs)]
+
+    mensajes = []
+
+    for i in range(0, len(archivos), FOTOS_POR_ALBUM):
+        grupo = archivos[i:i + FOTOS_POR_ALBUM]
+        extra = kwargs if i == 0 else {}
+
+        # Un álbum necesita al menos dos fotos
+        if len(grupo) == 1:
+            mensajes.append(await message.reply_photo(photo=grupo[0], **extra))
+        else:
+            mensajes.extend(await message.reply_media_group(
+                media=[InputMediaPhoto(media=foto) for foto in grupo],
+                **extra
+            ))
+
+    return mensajes
 
 async def admin_imagen_talonario_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Callback para generar imagen del talonario desde el panel admin"""
     query = update.callback_query
     await query.answer()
     
-    db = get_db()
-    cursor = db.cursor()
-
-    try:
-        cursor.execute("""
-            SELECT r.id, r.nombre,
-                   COUNT(n.id) as vendidos
-            FROM rifas r
-            LEFT JOIN numeros n
-                ON r.id = n.rifa_id
-                AND n.pago_id IN (
-                    SELECT id FROM pagos WHERE estado = 'aprobado'
-                )
-            GROUP BY r.id, r.nombre
-        """)
-
-        rifas_list = cursor.fetchall()
-    finally:
-        return_db(db)
+    # Vendidos desde el contador de rifas, sin agrupar los números de cada una
+    rifas_list = await listar_rifas(solo_activas=False)
 
     if not rifas_list:
         keyboard = [[InlineKeyboardButton("◀️ Volver", callback_data="ir_admin")]]
@@ -1697,7 +2208,7 @@ async def admin_imagen_talonario_callback(update: Update, context: ContextTypes.
 
     teclado = []
 
-    for rifa_id, nombre, vendidos in rifas_list:
+    for rifa_id, nombre, _, _, _, vendidos in rifas_list:
         teclado.append([
             InlineKeyboardButton(
                 f"🖼️ {nombre} | 🎟️ {vendidos} vendidos",
@@ -1724,135 +2235,105 @@ async def generar_imagen_talonario_callback(update: Update, context: ContextType
 
     rifa_id = int(query.data.split("_")[2])
 
-    await query.message.reply_text("⏳ Generando imagen del talonario...")
+    aviso = await query.message.reply_text("⏳ Generando imagen del talonario...")
+
+    async def progreso(estado, segundos):
+        encolar(
+            "edit_message_text",
+            PRIORIDAD_ADMIN,
+            chat_id=aviso.chat_id,
+            message_id=aviso.message_id,
+            text=f"⏳ Imagen del talonario: {estado}... ({segundos} s)"
+        )
 
     try:
-        imagen_path = await generar_imagen_talonario(rifa_id)
-        
-        # Enviar imagen al admin
-        with open(imagen_path, 'rb') as imagen_file:
-            await query.message.reply_photo(
-                photo=imagen_file,
-                caption="🖼️ *Talonario visual de la rifa*\n\n🟢 = Disponible\n🔴 = Vendido\n🟡 = Reservado\n🟠 = En Revisión",
-                parse_mode="Markdown"
-            )
-        
-        # Eliminar archivo temporal
-        import os
-        os.remove(imagen_path)
-        
+        imagen = await generar_imagen_talonario(rifa_id, progreso)
+
+        # Enviar imagen al admin (el archivo queda en la caché de artefactos)
+        await responder_artefacto(
+            query.message,
+            imagen,
+            regenerar=lambda: generar_imagen_talonario(rifa_id, progreso),
+            caption="🖼️ *Talonario visual de la rifa*\n\n🟢 = Disponible\n🔴 = Vendido\n🟡 = Reservado\n🟠 = En Revisión",
+            parse_mode="Markdown"
+        )
+
+    except RenderOcupado:
+        await query.message.reply_text(
+            "⏳ Ya hay varias exportaciones en curso. Intenta de nuevo en un momento."
+        )
+    except RenderReiniciado:
+        await query.message.reply_text(
+            "🔄 Otra exportación tardó demasiado y se reiniciaron los procesos. Intenta de nuevo."
+        )
+    except TimeoutError:
+        await query.message.reply_text("⌛ La imagen tardó demasiado y se canceló.")
     except Exception as e:
         await query.message.reply_text(f"❌ Error al generar imagen: {str(e)}")
 
-async def generar_imagen_talonario(rifa_id):
-    """Genera la imagen visual del talonario"""
-    from PIL import Image, ImageDraw, ImageFont
-    import tempfile
-    import os
-
-    db = get_db()
-    cursor = db.cursor()
+async def generar_imagen_talonario(rifa_id, al_progreso=None):
+    """
+    Genera la imagen visual del talonario (una por cada bloque de 100
+    números) en procesos aparte (render.py), o reutiliza las últimas si la
+    rifa no cambió. Devuelve la entrada de artefactos.
+    """
+    async with connection() as db:
+        cursor = db.cursor()
 
-    try:
         # Información de la rifa
-        cursor.execute("SELECT nombre FROM rifas WHERE id = %s", (rifa_id,))
-        rifa = cursor.fetchone()
+        await cursor.execute("SELECT version, total_numeros FROM rifas WHERE id = %s", (rifa_id,))
+        rifa = await cursor.fetchone()
 
         if not rifa:
             raise Exception("Rifa no encontrada")
 
-        nombre_rifa = rifa[0]
+        version, total_numeros = rifa
+
+        imagen = artefactos.obtener("imagen", rifa_id, version)
+        if imagen is not None:
+            return imagen
 
-        # Obtener números y sus estados
-        cursor.execute("""
+        # Solo los números con marca (los disponibles quedan como en la tabla)
+        await cursor.execute("""
             SELECT n.numero,
                    CASE 
                        WHEN p.estado = 'aprobado' THEN 'VENDIDO'
                        WHEN p.estado = 'pendiente' THEN 'RESERVADO'
-                       WHEN p.estado = 'en_revision' THEN 'EN_REVISION'
-                       ELSE 'DISPONIBLE'
+                       ELSE 'EN_REVISION'
                    END as estado
             FROM numeros n
-            LEFT JOIN pagos p ON n.pago_id = p.id
+            JOIN pagos p ON n.pago_id = p.id
             WHERE n.rifa_id = %s
-            ORDER BY n.numero
+            AND p.estado IN ('aprobado', 'pendiente', 'en_revision')
         """, (rifa_id,))
 
-        numeros_data = cursor.fetchall()
-    finally:
-        return_db(db)
+        estados = dict(await cursor.fetchall())
 
-    # Crear diccionario de estados
-    estados = {num[0]: num[1] for num in numeros_data}
-
-    # Ruta de la imagen base diseñada
-    base_dir = os.path.dirname(__file__)
-    base_path = os.path.join(base_dir, "Tabla diseñada.png")
-
-    # Abrir imagen base y preparar para dibujar overlays
-    img = Image.open(base_path).convert("RGBA")
-    draw = ImageDraw.Draw(img)
+    # Cada bloque recibe solo sus números
+    bloques = []
+    for inicio, cantidad in paginas_talonario(total_numeros):
+        bloques.append((
+            {n: e for n, e in estados.items() if inicio <= n < inicio + cantidad},
+            inicio,
+            artefactos.ruta_nueva("imagen", rifa_id, version, IMAGEN_FORMATO)
+        ))
 
-    # Parámetros de la cuadrícula (coordenadas exactas medidas - NUEVA IMAGEN)
-    TABLE_X0 = 77     # borde izquierdo de la tabla
-    TABLE_Y0 = 349      # borde superior de la tabla
-    CELL_W = 96        # ancho de celda
-    CELL_H = 95        # alto de celda
+    rutas = [ruta for _, _, ruta in bloques]
 
-    # Colores para las marcas (RGBA)
-    colores_estado = {
-        'VENDIDO': (229, 57, 53, 255),      # rojo
-        'RESERVADO': (251, 192, 45, 255),   # amarillo
-        'EN_REVISION': (251, 140, 0, 255)   # naranja
-    }
+    try:
+        await renderizar_lote(
+            imagen_talonario,
+            [
+                (rifa_id, estados_bloque, ruta, total_numeros, inicio)
+                for estados_bloque, inicio, ruta in bloques
+            ],
+            al_progreso=al_progreso
+        )
+    except BaseException:
+        artefactos.descartar(*rutas)
+        raise
 
-    # Tamaños de marcas (proporcionales al tamaño de celda)
-    marca_offset = 15   # tamaño de la X vendida
-    marca_radio = 12    # radio de círculos
-    marca_width = 3     # grosor de líneas
-
-    # Dibujar marcas sobre la imagen base (00-99)
-    for num in range(0, 100):
-        fila = num // 10
-        columna = num % 10
-
-        # Centro geométrico de la celda
-        centro_x = int(TABLE_X0 + columna * CELL_W + CELL_W / 2)
-        centro_y = int(TABLE_Y0 + fila * CELL_H + CELL_H / 2)
-
-        estado = estados.get(num, 'DISPONIBLE')
-
-        # Marcar según estado
-        if estado == 'VENDIDO':
-            # X roja
-            draw.line([(centro_x - marca_offset, centro_y - marca_offset), 
-                      (centro_x + marca_offset, centro_y + marca_offset)], 
-                     fill=colores_estado['VENDIDO'], width=marca_width)
-            draw.line([(centro_x - marca_offset, centro_y + marca_offset), 
-                      (centro_x + marca_offset, centro_y - marca_offset)], 
-                     fill=colores_estado['VENDIDO'], width=marca_width)
-        elif estado == 'RESERVADO':
-            # Círculo amarillo
-            draw.ellipse([(centro_x - marca_radio, centro_y - marca_radio), 
-                         (centro_x + marca_radio, centro_y + marca_radio)], 
-                        outline=colores_estado['RESERVADO'], width=marca_width)
-        elif estado == 'EN_REVISION':
-            # Círculo naranja con línea horizontal
-            draw.ellipse([(centro_x - marca_radio, centro_y - marca_radio), 
-                         (centro_x + marca_radio, centro_y + marca_radio)], 
-                        outline=colores_estado['EN_REVISION'], width=marca_width)
-            draw.line([(centro_x - marca_radio, centro_y), 
-                      (centro_x + marca_radio, centro_y)], 
-                     fill=colores_estado['EN_REVISION'], width=marca_width)
-
-    # Crear archivo temporal
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-    temp_file.close()
-    
-    # Guardar imagen
-    img.save(temp_file.name, 'PNG')
-    
-    return temp_file.name
+    return artefactos.guardar("imagen", rifa_id, version, *rutas)
 
 async def approbar_pago(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -1860,17 +2341,25 @@ async def approbar_pago(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     pago_id = int(query.data.split("_")[1])
 
-    db = get_db()
-    cursor = db.cursor()
+    async with connection() as db:
+        cursor = db.cursor()
 
-    try:
-        cursor.execute("""
-            UPDATE pagos SET estado = 'aprobado' WHERE id = %s
+        # Condicional: el mismo clic repetido (o atendido en otra réplica)
+        # no vuelve a aprobar
+        await cursor.execute("""
+            UPDATE pagos SET estado = 'aprobado'
+            WHERE id = %s AND estado = 'en_revision'
+            RETURNING rifa_id
         """, (pago_id,))
+        pago = await cursor.fetchone()
+
+        await db.commit()
 
-        db.commit()
-    finally:
-        return_db(db)
+    if not pago:
+        await query.message.reply_text("⚠️ Este pago ya fue procesado.")
+        return
+
+    invalidar_estadisticas(pago[0])
 
     await query.message.reply_text("✅ Pago aprobado correctamente.")
 
@@ -1880,23 +2369,33 @@ async def rechazar_pago(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     pago_id = int(query.data.split("_")[1])
 
-    db = get_db()
-    cursor = db.cursor()
+    async with connection() as db:
+        cursor = db.cursor()
 
-    try:
-        cursor.execute("""
+        # Primero el pago y luego sus números (mismo orden de bloqueo que
+        # aprobar y expirar, así los triggers de contadores no se cruzan)
+        await cursor.execute("""
+            UPDATE pagos SET estado = 'rechazado'
+            WHERE id = %s AND estado = 'en_revision'
+            RETURNING id
+        """, (pago_id,))
+
+        if await cursor.fetchone() is None:
+            await query.message.reply_text("⚠️ Este pago ya fue procesado.")
+            return
+
+        await cursor.execute("""
             UPDATE numeros
             SET reservado = 0, user_id = NULL, pago_id = NULL
             WHERE pago_id = %s
+            RETURNING rifa_id, numero
         """, (pago_id,))
+        liberados = await cursor.fetchall()
 
-        cursor.execute("""
-            UPDATE pagos SET estado = 'rechazado' WHERE id = %s
-        """, (pago_id,))
+        await db.commit()
 
-        db.commit()
-    finally:
-        return_db(db)
+    for rifa_id, numero in liberados:
+        marcar_liberados(rifa_id, [numero])
 
     await query.message.reply_text("❌ Pago rechazado y números liberados.")
 
@@ -1917,16 +2416,15 @@ async def eliminar_rifa(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ El ID debe ser un número.")
         return
 
-    db = get_db()
-    cursor = db.cursor()
+    async with connection() as db:
+        cursor = db.cursor()
 
-    try:
         # Verificar que la rifa exista
-        cursor.execute(
+        await cursor.execute(
             "SELECT nombre FROM rifas WHERE id = %s",
             (rifa_id,)
         )
-        rifa = cursor.fetchone()
+        rifa = await cursor.fetchone()
 
         if not rifa:
             await update.message.reply_text("❌ La rifa no existe.")
@@ -1935,13 +2433,13 @@ async def eliminar_rifa(update: Update, context: ContextTypes.DEFAULT_TYPE):
         nombre_rifa = rifa[0]
 
         # 🧨 BORRADO TOTAL
-        cursor.execute("DELETE FROM numeros WHERE rifa_id = %s", (rifa_id,))
-        cursor.execute("DELETE FROM pagos WHERE rifa_id = %s", (rifa_id,))
-        cursor.execute("DELETE FROM rifas WHERE id = %s", (rifa_id,))
+        await cursor.execute("DELETE FROM numeros WHERE rifa_id = %s", (rifa_id,))
+        await cursor.execute("DELETE FROM pagos WHERE rifa_id = %s", (rifa_id,))
+        await cursor.execute("DELETE FROM rifas WHERE id = %s", (rifa_id,))
+
+        await db.commit()
 
-        db.commit()
-    finally:
-        return_db(db)
+    invalidar_rifa(rifa_id)
 
     await update.message.reply_text(
         "🧨 *RIFA ELIMINADA CORRECTAMENTE*\n\n"
@@ -1951,6 +2449,25 @@ async def eliminar_rifa(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode="Markdown"
     )
 
+def texto_pago_aprobado(numeros_texto):
+    return (
+        "✅ *Pago APROBADO*\n\n"
+        "🎉 Tu comprobante fue verificado correctamente.\n"
+        f"🎟️ *Tus números:* {numeros_texto}\n"
+        "Tus números ya están asegurados.\n\n"
+        "Puedes comunicarte con el admin si tienes alguna duda\n"
+        "¡Mucha suerte en la rifa! 🍀"
+    )
+
+def texto_pago_rechazado():
+    return (
+        "❌ *Pago RECHAZADO*\n\n"
+        "🚫 El comprobante no pudo ser validado.\n"
+        "🎟️ Los números de esta compra fueron liberados.\n\n"
+        "Puedes comunicarte con el admin si tienes alguna duda\n"
+        "Puedes intentar comprar nuevamente cuando quieras."
+    )
+
 async def acciones_admin(update, context):
     query = update.callback_query
     await query.answer()
@@ -1958,17 +2475,16 @@ async def acciones_admin(update, context):
     accion, pago_id = query.data.split("_")
     pago_id = int(pago_id)
 
-    db = get_db()
-    cursor = db.cursor()
+    async with connection() as db:
+        cursor = db.cursor()
 
-    try:
         # Obtener datos del pago
-        cursor.execute("""
+        await cursor.execute("""
             SELECT user_id, rifa_id
             FROM pagos
             WHERE id = %s
         """, (pago_id,))
-        pago = cursor.fetchone()
+        pago = await cursor.fetchone()
 
         if not pago:
             await query.edit_message_caption("❌ Pago no encontrado.")
@@ -1978,65 +2494,74 @@ async def acciones_admin(update, context):
 
         if accion == "aprobar":
             # Obtener números del pago
-            cursor.execute("""
+            await cursor.execute("""
                 SELECT numero FROM numeros WHERE pago_id = %s ORDER BY numero
             """, (pago_id,))
-            numeros = [str(n[0]) for n in cursor.fetchall()]
+            numeros = [str(n[0]) for n in await cursor.fetchall()]
             numeros_texto = ", ".join(numeros)
 
-            # Aprobar pago
-            cursor.execute("""
+            # Aprobar pago (condicional: un clic repetido o atendido por
+            # otra réplica no vuelve a aprobar ni a avisar al usuario)
+            await cursor.execute("""
                 UPDATE pagos
                 SET estado = 'aprobado'
                 WHERE id = %s
+                AND estado = 'en_revision'
+                RETURNING id
             """, (pago_id,))
 
-            db.commit()
+            if await cursor.fetchone() is None:
+                await query.edit_message_caption("⚠️ Este pago ya fue procesado.")
+                return
+
+            await db.commit()
+            invalidar_estadisticas(rifa_id)
 
             # 📩 Avisar al usuario
-            await context.bot.send_message(
+            encolar(
+                "send_message",
+                PRIORIDAD_USUARIO,
                 chat_id=user_id,
-                text=(
-                    "✅ *Pago APROBADO*\n\n"
-                    "🎉 Tu comprobante fue verificado correctamente.\n"
-                    f"🎟️ *Tus números:* {numeros_texto}\n"
-                    "Tus números ya están asegurados.\n\n"
-                    "Puedes comunicarte con el admin si tienes alguna duda\n"
-                    "¡Mucha suerte en la rifa! 🍀"
-                ),
+                text=texto_pago_aprobado(numeros_texto),
                 parse_mode="Markdown"
             )
 
             texto_admin = "✅ *Pago APROBADO*"
 
         else:  # liberar / rechazar
+            # Primero el pago (mismo orden de bloqueo que aprobar y expirar)
+            await cursor.execute("""
+                UPDATE pagos
+                SET estado = 'rechazado'
+                WHERE id = %s
+                AND estado = 'en_revision'
+                RETURNING id
+            """, (pago_id,))
+
+            if await cursor.fetchone() is None:
+                await query.edit_message_caption("⚠️ Este pago ya fue procesado.")
+                return
+
             # Liberar SOLO los números de este pago
-            cursor.execute("""
+            await cursor.execute("""
                 UPDATE numeros
                 SET reservado = 0,
                     user_id = NULL,
                     pago_id = NULL
                 WHERE pago_id = %s
+                RETURNING numero
             """, (pago_id,))
+            liberados = [n for (n,) in await cursor.fetchall()]
 
-            cursor.execute("""
-                UPDATE pagos
-                SET estado = 'rechazado'
-                WHERE id = %s
-            """, (pago_id,))
-
-            db.commit()
+            await db.commit()
+            marcar_liberados(rifa_id, liberados)
 
             # 📩 Avisar al usuario
-            await context.bot.send_message(
+            encolar(
+                "send_message",
+                PRIORIDAD_USUARIO,
                 chat_id=user_id,
-                text=(
-                    "❌ *Pago RECHAZADO*\n\n"
-                    "🚫 El comprobante no pudo ser validado.\n"
-                    "🎟️ Los números de esta compra fueron liberados.\n\n"
-                    "Puedes comunicarte con el admin si tienes alguna duda\n"
-                    "Puedes intentar comprar nuevamente cuando quieras."
-                ),
+                text=texto_pago_rechazado(),
                 parse_mode="Markdown"
             )
 
@@ -2047,8 +2572,160 @@ async def acciones_admin(update, context):
             caption=texto_admin,
             parse_mode="Markdown"
         )
-    finally:
-        return_db(db)
+
+# =====================
+# DIFUSIONES
+# =====================
+async def difusion(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /difusion <texto> envía el texto a todos los usuarios registrados.
+    Respondiendo a una foto, envía la foto con el texto como pie.
+    """
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("⛔ No autorizado.")
+        return
+
+    partes = update.message.text.split(None, 1)
+    texto = partes[1].strip() if len(partes) > 1 else None
+
+    respuesta = update.message.reply_to_message
+    foto = respuesta.photo[-1].file_id if respuesta and respuesta.photo else None
+    if foto and not texto:
+        texto = respuesta.caption
+
+    if not texto and not foto:
+        await update.message.reply_text(
+            "⚠️ Uso correcto:\n/difusion <mensaje>\n\n"
+            "O responde a una foto con /difusion <pie de foto>"
+        )
+        return
+
+    if texto and len(texto) > (1024 if foto else 4096):
+        await update.message.reply_text("❌ El mensaje es demasiado largo.")
+        return
+
+    await lanzar_difusion(update.message, texto, foto)
+
+async def difusion_talonario(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/difusion_talonario <id_rifa> [texto]: envía la imagen del talonario a todos"""
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("⛔ No autorizado.")
+        return
+
+    if not context.args:
+        await update.message.reply_text(
+            "⚠️ Uso correcto:\n/difusion_talonario <id_rifa> [mensaje]"
+        )
+        return
+
+    try:
+        rifa_id = int(context.args[0])
+    except ValueError:
+        await update.message.reply_text("❌ El ID debe ser un número.")
+        return
+
+    partes = update.message.text.split(None, 2)
+    texto = partes[2].strip() if len(partes) > 2 else (
+        "🎟️ ¡Ya puedes reservar tus números!\n\nEscribe /start para participar."
+    )
+
+    if len(texto) > 1024:
+        await update.message.reply_text("❌ El mensaje es demasiado largo.")
+        return
+
+    await update.message.reply_text("⏳ Generando imagen del talonario...")
+
+    try:
+        imagen = await generar_imagen_talonario(rifa_id)
+    except Exception as e:
+        await update.message.reply_text(f"❌ Error al generar imagen: {str(e)}")
+        return
+
+    # Más de un álbum por usuario (rifas de más de 1.000 números) es demasiado
+    if len(imagen["rutas"]) > FOTOS_POR_ALBUM:
+        await update.message.reply_text(
+            f"❌ El talonario tiene {len(imagen['rutas'])} imágenes; la difusión "
+            f"admite hasta {FOTOS_POR_ALBUM} (rifas de hasta {FOTOS_POR_ALBUM * render.CELDAS:,} números)."
+        )
+        return
+
+    # Se sube una sola vez (al admin) y la difusión reutiliza los file_id
+    file_ids = await responder_artefacto(
+        update.message,
+        imagen,
+        regenerar=lambda: generar_imagen_talonario(rifa_id),
+        caption=texto
+    )
+
+    if len(file_ids) == 1:
+        await lanzar_difusion(update.message, texto, file_ids[0])
+    else:
+        await lanzar_difusion(update.message, texto, album=file_ids)
+
+async def lanzar_difusion(message, texto, foto=None, album=None):
+    difusion_id, total = await crear_difusion(texto, foto, album)
+
+    if not total:
+        await cancelar_difusion(difusion_id)
+        await message.reply_text("❌ No hay usuarios registrados.")
+        return
+
+    iniciar_difusion(difusion_id, ADMIN_ID)
+
+    await message.reply_text(
+        f"📣 Difusión #{difusion_id} en marcha para {total} usuarios.\n\n"
+        "/difusiones para ver el avance\n"
+        f"/cancelar_difusion {difusion_id} para detenerla"
+    )
+
+async def ver_difusiones(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("⛔ No autorizado.")
+        return
+
+    difusiones = await listar_difusiones()
+
+    if not difusiones:
+        await update.message.reply_text("📭 No hay difusiones.")
+        return
+
+    from datetime import datetime
+
+    estados = {
+        "enviando": "📤 Enviando",
+        "terminada": "✅ Terminada",
+        "cancelada": "🚫 Cancelada",
+    }
+
+    texto = "<b>📣 DIFUSIONES</b>\n\n"
+    for difusion_id, estado, total, enviados, fallidos, creada in difusiones:
+        fecha = datetime.fromtimestamp(creada).strftime("%d/%m/%Y %H:%M")
+        texto += (
+            f"<b>#{difusion_id}</b> · {estados.get(estado, estado)} · {fecha}\n"
+            f"   ✅ {enviados} · ❌ {fallidos} · 👥 {total}\n"
+        )
+
+    await update.message.reply_text(texto, parse_mode="HTML")
+
+async def cancelar_difusion_comando(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("⛔ No autorizado.")
+        return
+
+    if not context.args:
+        await update.message.reply_text("⚠️ Uso correcto:\n/cancelar_difusion <id>")
+        return
+
+    try:
+        difusion_id = int(context.args[0])
+    except ValueError:
+        await update.message.reply_text("❌ El ID debe ser un número.")
+        return
+
+    if await cancelar_difusion(difusion_id):
+        await update.message.reply_text(f"🚫 Difusión #{difusion_id} cancelada.")
+    else:
+        await update.message.reply_text("❌ Esa difusión no está en curso.")
 
 # =====================
 # CONVERSACIONES
@@ -2076,6 +2753,8 @@ user_conv = ConversationHandler(
     },
     fallbacks=[],
     per_message=False,
+    name="user_conv",
+    persistent=True,
 )
 
 admin_conv = ConversationHandler(
@@ -2085,21 +2764,128 @@ admin_conv = ConversationHandler(
     states={
         RIFA_NOMBRE: [MessageHandler(filters.TEXT & ~filters.COMMAND, rifa_nombre)],
         RIFA_PRECIO: [MessageHandler(filters.TEXT & ~filters.COMMAND, rifa_precio)],
+        RIFA_TOTAL: [MessageHandler(filters.TEXT & ~filters.COMMAND, rifa_total)],
         RIFA_PREMIO: [MessageHandler(filters.TEXT & ~filters.COMMAND, rifa_premio)],
         RIFA_FECHA: [MessageHandler(filters.TEXT & ~filters.COMMAND, rifa_fecha)],
         RIFA_DESC: [MessageHandler(filters.TEXT & ~filters.COMMAND, rifa_desc)],
     },
     fallbacks=[],
     per_message=False,
+    name="admin_conv",
+    persistent=True,
 )
 
+# Conversaciones cuyo paso se comparte entre réplicas (ver replicas.py)
+CONVERSACIONES = {conv.name: conv for conv in (user_conv, admin_conv)}
+
+# =====================
+# RÉPLICAS
+# =====================
+# Callbacks que mueven pagos o rifas: se registran en updates_procesados
+# para no repetirlos aunque Telegram los entregue a otra réplica
+CALLBACKS_REGISTRADOS = (
+    "confirmar", "aprobar_", "rechazar_", "liberar_", "rev_ok", "rev_no", "confirmar_eliminar_"
+)
+
+def necesita_registro(update):
+    """Comprobantes, pagos y difusiones; el resto se descarta solo en memoria"""
+    if update.callback_query:
+        return (update.callback_query.data or "").startswith(CALLBACKS_REGISTRADOS)
+
+    if update.message:
+        return bool(update.message.photo) or (update.message.text or "").startswith("/difusion")
+
+    return False
+
+async def preparar_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Grupo -1: descarta updates repetidos y trae el estado del usuario"""
+    if not await abrir_update(
+        update,
+        context.user_data,
+        CONVERSACIONES,
+        context.application.persistence,
+        registrar=necesita_registro(update),
+        compartido=webhook_activo()
+    ):
+        raise ApplicationHandlerStop
+
+async def vigilar_liderazgo(application):
+    """
+    Al convertirse en líder, la réplica retoma el trabajo global: reprograma
+    las expiraciones pendientes y reanuda las difusiones en curso.
+    """
+    if await asumir_liderazgo():
+        await recuperar_expiraciones(application)
+        await reanudar_difusiones(ADMIN_ID)
+
+async def vigilar_liderazgo_job(context: ContextTypes.DEFAULT_TYPE):
+    await vigilar_liderazgo(context.application)
+
+async def reintentar_difusiones_job(context: ContextTypes.DEFAULT_TYPE):
+    # Solo las que esta réplica dejó con envíos temporales: sin consultas si no hay
+    reintentar_difusiones(ADMIN_ID)
+
+async def barrido_lider_job(context: ContextTypes.DEFAULT_TYPE):
+    # Red de seguridad: los timers de cada pago y los reintentos de cada
+    # difusión viven en su réplica; esto cubre las que se cayeron
+    if not es_lider():
+        return
+
+    await expirar_pagos()
+    await limpiar_updates()
+
+    # Difusiones de una réplica que murió (turno vencido) o con envíos
+    # pendientes por errores temporales
+    await reanudar_difusiones(ADMIN_ID)
+
 # =====================
 # MAIN
 # =====================
+async def post_init(application):
+    # Abrir el pool antes de recibir updates (evita la latencia del primer handler)
+    await init_connection_pool()
+    await init_db()
+    dispatcher.iniciar(application.bot)
+    artefactos.iniciar()
+    await vigilar_liderazgo(application)
+
+    # Si la líder cae, otra réplica toma el lock en la siguiente vuelta
+    application.job_queue.run_repeating(vigilar_liderazgo_job, interval=15, first=15)
+    application.job_queue.run_repeating(reintentar_difusiones_job, interval=60, first=60)
+    application.job_queue.run_repeating(
+        barrido_lider_job,
+        interval=BARRIDO_INTERVALO,
+        first=BARRIDO_INTERVALO
+    )
+
+async def post_stop(application):
+    # Las difusiones quedan 'enviando' y se retoman al arrancar; se detienen
+    # antes de vaciar la cola para que no sigan encolando envíos
+    await detener_difusiones()
+    # Dar tiempo a que salgan los avisos encolados mientras el bot sigue
+    # abierto (shutdown() cierra la conexión HTTP con Telegram)
+    await dispatcher.detener()
+
+async def post_shutdown(application):
+    await soltar_liderazgo()
+    render.detener()
+    await close_connection_pool()
+
 if __name__ == "__main__":
-    init_db()
+    app = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .concurrent_updates(True)
+        # user_data y conversaciones en PostgreSQL, guardados por lotes
+        .persistence(PersistenciaPostgres())
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
-    app = ApplicationBuilder().token(TOKEN).build()
+    # Antes de todos los demás grupos: updates repetidos y estado de otras réplicas
+    app.add_handler(TypeHandler(Update, preparar_update), group=-1)
 
     app.add_handler(CallbackQueryHandler(elegir_rifa, pattern="^rifa_"))
 
@@ -2110,8 +2896,9 @@ if __name__ == "__main__":
 
     app.add_handler(CallbackQueryHandler(toggle_numero, pattern="^toggle_"))
     app.add_handler(CallbackQueryHandler(confirmar, pattern="^confirmar$"))
-    app.add_handler(CallbackQueryHandler(ir_pag_0, pattern="^pag_0$"))
-    app.add_handler(CallbackQueryHandler(ir_pag_1, pattern="^pag_1$"))
+    app.add_handler(CallbackQueryHandler(ir_pagina, pattern=r"^pag_\d+$"))
+    app.add_handler(CallbackQueryHandler(menu_rangos, pattern=r"^rangos(_\d+)?$"))
+    app.add_handler(CallbackQueryHandler(numero_al_azar, pattern="^azar$"))
     
     # Nuevos handlers para botones
     app.add_handler(CallbackQueryHandler(ir_admin, pattern="^ir_admin$"))
@@ -2139,11 +2926,17 @@ if __name__ == "__main__":
     app.add_handler(
         CallbackQueryHandler(acciones_admin, pattern="^(aprobar|liberar)_"))
     app.add_handler(CommandHandler("misboletas", mis_boletas))
+    app.add_handler(CallbackQueryHandler(mis_boletas_pagina, pattern=r"^misboletas_\d+$"))
 
     app.add_handler(CommandHandler("estadisticas", stats_rifa))
     app.add_handler(CommandHandler("admin", admin_panel))
+    app.add_handler(CommandHandler("estado_db", estado_db))
     app.add_handler(CallbackQueryHandler(admin_estadisticas, pattern="admin_stats"))
     app.add_handler(CallbackQueryHandler(admin_pagos, pattern="admin_pagos"))
+    app.add_handler(CallbackQueryHandler(revision_seleccionar, pattern=r"^rev_(sel_\d+|todos)$"))
+    app.add_handler(CallbackQueryHandler(revision_pagina, pattern=r"^rev_pag_\d+$"))
+    app.add_handler(CallbackQueryHandler(revision_comprobantes, pattern="^rev_fotos$"))
+    app.add_handler(CallbackQueryHandler(revision_aplicar, pattern="^rev_(ok|no)$"))
 
     app.add_handler(CallbackQueryHandler(approbar_pago, pattern="aprobar_"))
     app.add_handler(CallbackQueryHandler(rechazar_pago, pattern="rechazar_"))
@@ -2151,13 +2944,18 @@ if __name__ == "__main__":
     app.add_handler(CommandHandler("talonario", comando_talonario))
     app.add_handler(CallbackQueryHandler(mostrar_talonario, pattern="^talonario_"))
     app.add_handler(CommandHandler("eliminar_rifa", eliminar_rifa))
+    app.add_handler(CommandHandler("difusion", difusion))
+    app.add_handler(CommandHandler("difusion_talonario", difusion_talonario))
+    app.add_handler(CommandHandler("difusiones", ver_difusiones))
+    app.add_handler(CommandHandler("cancelar_difusion", cancelar_difusion_comando))
 
-    job_queue = app.job_queue
-    job_queue.run_repeating(
-        expirar_pagos_y_liberar_job,
-        interval=60,
-        first=10
-    )
+    app.add_error_handler(manejar_error)
+
+    # Las expiraciones se agendan por pago (ver programar_expiracion); la
+    # réplica líder reprograma las pendientes y hace un barrido cada minuto
 
     print("🤖 Bot corriendo...")
-    app.run_polling()
+    if webhook_activo():
+        ejecutar_webhook(app)
+    else:
+        app.run_polling()
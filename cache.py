@@ -0,0 +1,170 @@
+"""
+Caché en memoria de la disponibilidad de números por rifa.
+
+Por cada rifa se guarda su nombre, precio, total de números y un bitmap
+(bytearray, 1 bit por número) con los números reservados. El teclado de
+números se dibuja desde aquí sin ir a la base de datos; los handlers que
+reservan o liberan números actualizan el bitmap después del commit.
+
+La base de datos sigue siendo la fuente de verdad: si la rifa no está en
+caché (o venció su TTL) se recarga, y `confirmar` siempre reserva con un
+UPDATE condicional, así que un dato viejo aquí nunca vende un número dos veces.
+"""
+import os
+import time
+from database import connection
+
+# Segundos antes de recargar una rifa (cubre cambios hechos por otras réplicas)
+CACHE_TTL = float(os.getenv("CACHE_DISPONIBILIDAD_TTL", "60"))
+
+# rifa_id -> {"nombre", "precio", "total", "reservados": bytearray, "cargada"}
+_rifas = {}
+
+# Se incrementa con cada cambio; sirve para descartar cargas que se
+# cruzaron con una reserva o liberación
+_cambios = 0
+
+_metrics = {"hits": 0, "misses": 0}
+
+def _bitmap(total):
+    return bytearray((total + 7) // 8)
+
+def _marcar(bitmap, numero, reservado):
+    if reservado:
+        bitmap[numero >> 3] |= 1 << (numero & 7)
+    else:
+        bitmap[numero >> 3] &= ~(1 << (numero & 7)) & 0xFF
+
+def esta_reservado(rifa, numero):
+    """True si `numero` está reservado o vendido en la rifa cacheada"""
+    if not 0 <= numero < rifa["total"]:
+        return True
+    return bool(rifa["reservados"][numero >> 3] & (1 << (numero & 7)))
+
+async def _cargar(rifa_id):
+    cambios_antes = _cambios
+
+    async with connection() as db:
+        cursor = await db.execute("""
+            SELECT nombre, precio, total_numeros
+            FROM rifas
+            WHERE id = %s
+        """, (rifa_id,))
+        fila = await cursor.fetchone()
+
+        if not fila:
+            return None
+
+        nombre, precio, total = fila
+
+        cursor = await db.execute("""
+            SELECT numero
+            FROM numeros
+            WHERE rifa_id = %s
+            AND reservado = 1
+        """, (rifa_id,))
+        numeros = await cursor.fetchall()
+
+    # total_numeros podría no coincidir con las filas reales (rifas viejas)
+    total = max([total or 0] + [numero + 1 for (numero,) in numeros])
+
+    reservados = _bitmap(total)
+    for (numero,) in numeros:
+        _marcar(reservados, numero, True)
+
+    rifa = {
+        "nombre": nombre,
+        "precio": precio,
+        "total": total,
+        "reservados": reservados,
+        "cargada": time.monotonic(),
+    }
+
+    # Si hubo cambios mientras se leía, se usa la lectura pero no se guarda
+    if _cambios == cambios_antes:
+        _rifas[rifa_id] = rifa
+
+    return rifa
+
+async def obtener_rifa(rifa_id):
+    """Rifa desde la caché (o desde la base si no está); None si no existe"""
+    rifa = _rifas.get(rifa_id)
+
+    if rifa is not None and time.monotonic() - rifa["cargada"] < CACHE_TTL:
+        _metrics["hits"] += 1
+        return rifa
+
+    _metrics["misses"] += 1
+    return await _cargar(rifa_id)
+
+def _actualizar(rifa_id, numeros, reservado):
+    global _cambios
+
+    _cambios += 1
+    invalidar_estadisticas(rifa_id)
+    rifa = _rifas.get(rifa_id)
+
+    if rifa is None:
+        return
+
+    for numero in numeros:
+        if 0 <= numero < rifa["total"]:
+            _marcar(rifa["reservados"], numero, reservado)
+        else:
+            # Número fuera del bitmap: mejor recargar desde la base
+            _rifas.pop(rifa_id, None)
+            return
+
+def marcar_reservados(rifa_id, numeros):
+    """Llamar después del commit que reservó los números"""
+    _actualizar(rifa_id, numeros, True)
+
+def marcar_liberados(rifa_id, numeros):
+    """Llamar después del commit que liberó los números (rechazo, expiración)"""
+    _actualizar(rifa_id, numeros, False)
+
+def invalidar_rifa(rifa_id=None):
+    """Descarta una rifa (p. ej. al eliminarla) o toda la caché"""
+    global _cambios
+
+    _cambios += 1
+    invalidar_estadisticas(rifa_id)
+
+    if rifa_id is None:
+        _rifas.clear()
+    else:
+        _rifas.pop(rifa_id, None)
+
+def cache_metrics():
+    return {
+        "rifas": len(_rifas),
+        "hits": _metrics["hits"],
+        "misses": _metrics["misses"],
+    }
+
+# Estadísticas por rifa: consultas más pesadas que cambian con cada pago,
+# así que se guardan solo unos segundos y se descartan en cada transición
+ESTADISTICAS_TTL = float(os.getenv("CACHE_ESTADISTICAS_TTL", "10"))
+
+# rifa_id (o None = todas las rifas) -> (cargada, estadísticas)
+_estadisticas = {}
+
+def estadisticas_cacheadas(rifa_id=None):
+    """Estadísticas guardadas para `rifa_id` (None = todas) o None si vencieron"""
+    guardadas = _estadisticas.get(rifa_id)
+
+    if guardadas is not None and time.monotonic() - guardadas[0] < ESTADISTICAS_TTL:
+        return guardadas[1]
+
+    return None
+
+def guardar_estadisticas(rifa_id, estadisticas):
+    _estadisticas[rifa_id] = (time.monotonic(), estadisticas)
+
+def invalidar_estadisticas(rifa_id=None):
+    """Llamar cuando cambia el estado de un pago o los números de una rifa"""
+    if rifa_id is None:
+        _estadisticas.clear()
+    else:
+        _estadisticas.pop(rifa_id, None)
+        _estadisticas.pop(None, None)
@@ -0,0 +1,514 @@
+"""
+Difusiones: un mensaje del admin (texto, foto o álbum) para todos los usuarios.
+
+Los destinatarios se leen de `usuarios` con un cursor del lado del servidor
+(la tabla nunca se trae entera a memoria) y se entregan por la cola de
+envíos con la prioridad más baja: una difusión no frena los avisos de pagos
+ni los comprobantes, y los handlers siguen respondiendo mientras corre.
+
+Cada destinatario procesado queda en `difusion_envios` ('enviado' o
+'fallido'). 'fallido' es para errores definitivos de Telegram (bloqueó el
+bot, chat inexistente, BadRequest) o inesperados; los temporales (red, 429,
+cola llena) quedan 'temporal' y se reintentan en otra pasada o al reanudar,
+hasta INTENTOS_POR_DESTINATARIO veces: después pasan a 'fallido' y la
+difusión puede terminar. Los envíos cancelados al apagar no dejan fila. Al
+reiniciar el bot, `reanudar_difusiones` retoma las que seguían en curso
+saltándose a quienes ya terminaron.
+
+Los destinatarios se leen por páginas (user_id > último) con transacciones
+cortas: una difusión larga no ocupa una conexión del pool. Con varias
+réplicas, cada difusión la envía solo la que tiene su turno
+(difusiones.replica / tomada_hasta), que se renueva mientras envía.
+"""
+import os
+import time
+import socket
+import asyncio
+from telegram import InputMediaPhoto
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+from database import connection
+from dispatcher import encolar, enviar, ColaLlena, PRIORIDAD_ADMIN, PRIORIDAD_DIFUSION
+
+# Envíos de una difusión que pueden estar en la cola de salida a la vez
+VENTANA = 200
+
+# Destinatarios leídos por página
+FILAS_POR_LECTURA = 500
+
+# Estados que se acumulan antes de guardarlos en difusion_envios
+LOTE_ESTADOS = 100
+
+# Segundos entre actualizaciones del mensaje de progreso del admin
+INTERVALO_PROGRESO = 5
+
+# Segundos que una réplica se reserva una difusión (lo renueva mientras envía)
+TURNO = 90
+
+# Vueltas sobre los destinatarios que quedaron sin enviar por errores
+# temporales, y segundos entre una y otra
+PASADAS = 3
+PAUSA_ENTRE_PASADAS = 30
+
+# Errores que no se arreglan reintentando. Se revisan antes que los
+# temporales: en PTB 20 BadRequest hereda de NetworkError
+ERRORES_DEFINITIVOS = (Forbidden, BadRequest)
+
+# Errores con los que el envío se reintenta más tarde en lugar de quedar 'fallido'
+ERRORES_TEMPORALES = (TimedOut, NetworkError, RetryAfter, ColaLlena)
+
+# Pasadas con error temporal antes de dar a un destinatario por 'fallido'
+INTENTOS_POR_DESTINATARIO = 5
+
+# Identifica a esta réplica en difusiones.replica
+REPLICA = f"{socket.gethostname()}:{os.getpid()}"
+
+# difusion_id -> asyncio.Task
+_tareas = {}
+
+# Difusiones que esta réplica dejó 'enviando' con envíos temporales
+_por_reintentar = set()
+
+async def crear_difusion(texto=None, foto=None, album=None):
+    """Registra la difusión; devuelve (difusion_id, total de destinatarios)"""
+    async with connection() as db:
+        cursor = await db.execute("""
+            INSERT INTO difusiones (texto, foto, album, total, creada)
+            VALUES (%s, %s, %s, (SELECT COUNT(*) FROM usuarios), %s)
+            RETURNING id, total
+        """, (texto, foto, album, int(time.time())))
+
+        return await cursor.fetchone()
+
+def iniciar_difusion(difusion_id, chat_progreso=None):
+    """Arranca el envío en segundo plano; el progreso se reporta en `chat_progreso`"""
+    if difusion_id in _tareas:
+        return
+
+    _por_reintentar.discard(difusion_id)
+    tarea = asyncio.create_task(
+        _ejecutar(difusion_id, chat_progreso),
+        name=f"difusion-{difusion_id}"
+    )
+    _tareas[difusion_id] = tarea
+    tarea.add_done_callback(lambda _: _tareas.pop(difusion_id, None))
+
+async def reanudar_difusiones(chat_progreso=None):
+    """
+    Retoma las difusiones que quedaron 'enviando' y que ninguna réplica
+    tiene en turno (al arrancar y en el barrido del líder)
+    """
+    async with connection() as db:
+        cursor = await db.execute("""
+            SELECT id
+            FROM difusiones
+            WHERE estado = 'enviando'
+            AND (tomada_hasta IS NULL OR tomada_hasta < %s)
+            ORDER BY id
+        """, (int(time.time()),))
+        pendientes = [difusion_id for (difusion_id,) in await cursor.fetchall()]
+
+    for difusion_id in pendientes:
+        iniciar_difusion(difusion_id, chat_progreso)
+
+    return pendientes
+
+def reintentar_difusiones(chat_progreso=None):
+    """
+    Retoma las difusiones que esta réplica dejó con envíos temporales, sin
+    consultar la base (las de otras réplicas las retoma el barrido del líder)
+    """
+    pendientes = sorted(_por_reintentar)
+
+    for difusion_id in pendientes:
+        iniciar_difusion(difusion_id, chat_progreso)
+
+    return pendientes
+
+async def cancelar_difusion(difusion_id):
+    """
+    Marca la difusión como cancelada; False si no estaba en curso. Si la
+    envía esta réplica se detiene ya; si la envía otra, lo ve al releer el
+    estado (entre páginas y cada INTERVALO_PROGRESO segundos).
+    """
+    async with connection() as db:
+        cursor = await db.execute("""
+            UPDATE difusiones
+            SET estado = 'cancelada',
+                terminada = %s
+            WHERE id = %s
+            AND estado = 'enviando'
+            RETURNING id
+        """, (int(time.time()), difusion_id))
+
+        cancelada = await cursor.fetchone() is not None
+
+    tarea = _tareas.get(difusion_id)
+    if tarea is not None:
+        tarea.cancel()
+
+    return cancelada
+
+async def detener_difusiones():
+    """
+    Detiene las tareas sin cambiar su estado (siguen 'enviando' y se
+    retoman al volver a arrancar). Llamar en post_stop, antes de vaciar la
+    cola de envíos.
+    """
+    tareas = list(_tareas.values())
+
+    for tarea in tareas:
+        tarea.cancel()
+
+    await asyncio.gather(*tareas, return_exceptions=True)
+
+async def listar_difusiones(limite=10):
+    """Últimas difusiones: (id, estado, total, enviados, fallidos, creada)"""
+    async with connection() as db:
+        cursor = await db.execute("""
+            SELECT d.id, d.estado, d.total,
+                   COUNT(e.user_id) FILTER (WHERE e.estado = 'enviado'),
+                   COUNT(e.user_id) FILTER (WHERE e.estado = 'fallido'),
+                   d.creada
+            FROM (
+                SELECT *
+                FROM difusiones
+                ORDER BY id DESC
+                LIMIT %s
+            ) d
+            LEFT JOIN difusion_envios e ON e.difusion_id = d.id
+            GROUP BY d.id, d.estado, d.total, d.creada
+            ORDER BY d.id DESC
+        """, (limite,))
+
+        return await cursor.fetchall()
+
+async def _guardar_estados(difusion_id, estados):
+    """
+    Guarda los estados acumulados. Un 'temporal' suma un intento a la fila
+    del destinatario y pasa a 'fallido' al llegar a INTENTOS_POR_DESTINATARIO;
+    devuelve cuántos pasaron así a 'fallido'.
+    """
+    if not estados:
+        return 0
+
+    user_ids, valores, errores = zip(*estados)
+
+    async with connection() as db:
+        cursor = await db.execute("""
+            INSERT INTO difusion_envios (difusion_id, user_id, estado, error)
+            SELECT %s, u.user_id,
+                   CASE WHEN u.estado = 'temporal' AND %s <= 1 THEN 'fallido' ELSE u.estado END,
+                   u.error
+            FROM unnest(%s::bigint[], %s::text[], %s::text[]) AS u(user_id, estado, error)
+            ON CONFLICT (difusion_id, user_id) DO UPDATE
+            SET estado = CASE
+                    WHEN EXCLUDED.estado = 'temporal'
+                    AND difusion_envios.intentos + 1 >= %s THEN 'fallido'
+                    ELSE EXCLUDED.estado
+                END,
+                error = EXCLUDED.error,
+                intentos = difusion_envios.intentos + 1
+            WHERE difusion_envios.estado = 'temporal'
+            RETURNING user_id, estado
+        """, (
+            difusion_id, INTENTOS_POR_DESTINATARIO,
+            list(user_ids), list(valores), list(errores),
+            INTENTOS_POR_DESTINATARIO
+        ))
+        guardados = await cursor.fetchall()
+
+    temporales = {user_id for user_id, valor, _ in estados if valor == "temporal"}
+    estados.clear()
+
+    return sum(1 for user_id, valor in guardados if valor == "fallido" and user_id in temporales)
+
+def _texto_progreso(difusion_id, estado, total, enviados, fallidos):
+    procesados = enviados + fallidos
+    porcentaje = procesados * 100 // total if total else 100
+
+    return (
+        f"📣 Difusión #{difusion_id}: {estado}\n\n"
+        f"✅ Enviados: {enviados}\n"
+        f"❌ Fallidos: {fallidos}\n"
+        f"📊 Progreso: {procesados}/{total} ({porcentaje}%)"
+    )
+
+async def _tomar(difusion_id):
+    """Toma el turno de la difusión; None si otra réplica la está enviando"""
+    ahora = int(time.time())
+
+    async with connection() as db:
+        cursor = await db.execute("""
+            UPDATE difusiones
+            SET replica = %s,
+                tomada_hasta = %s
+            WHERE id = %s
+            AND estado = 'enviando'
+            AND (replica = %s OR tomada_hasta IS NULL OR tomada_hasta < %s)
+            RETURNING texto, foto, album, total
+        """, (REPLICA, ahora + TURNO, difusion_id, REPLICA, ahora))
+        fila = await cursor.fetchone()
+
+        if fila is None:
+            return None
+
+        cursor = await db.execute("""
+            SELECT COUNT(*) FILTER (WHERE estado = 'enviado'),
+                   COUNT(*) FILTER (WHERE estado = 'fallido')
+            FROM difusion_envios
+            WHERE difusion_id = %s
+        """, (difusion_id,))
+
+        return (*fila, *await cursor.fetchone())
+
+async def _renovar(difusion_id):
+    """
+    Extiende el turno y devuelve el estado de la difusión ('cancelada' si
+    el admin la canceló desde cualquier réplica), o None si esta réplica
+    perdió el turno
+    """
+    async with connection() as db:
+        cursor = await db.execute("""
+            UPDATE difusiones
+            SET tomada_hasta = %s
+            WHERE id = %s
+            AND replica = %s
+            RETURNING estado
+        """, (int(time.time()) + TURNO, difusion_id, REPLICA))
+        fila = await cursor.fetchone()
+
+        return fila[0] if fila else None
+
+async def _soltar(difusion_id):
+    """Deja la difusión para que otra réplica (o esta al reanudar) la retome"""
+    async with connection() as db:
+        await db.execute("""
+            UPDATE difusiones
+            SET tomada_hasta = NULL
+            WHERE id = %s
+            AND replica = %s
+        """, (difusion_id, REPLICA))
+
+async def _destinatarios(difusion_id, desde):
+    """Siguiente página de usuarios pendientes o con error temporal (user_id > desde)"""
+    async with connection() as db:
+        cursor = await db.execute("""
+            SELECT u.user_id
+            FROM usuarios u
+            WHERE u.user_id > %s
+            AND NOT EXISTS (
+                SELECT 1
+                FROM difusion_envios e
+                WHERE e.difusion_id = %s
+                AND e.user_id = u.user_id
+                AND e.estado <> 'temporal'
+            )
+            ORDER BY u.user_id
+            LIMIT %s
+        """, (desde, difusion_id, FILAS_POR_LECTURA))
+
+        return [user_id for (user_id,) in await cursor.fetchall()]
+
+async def _ejecutar(difusion_id, chat_progreso):
+    fila = await _tomar(difusion_id)
+
+    if fila is None:
+        return
+
+    texto, foto, album, total, enviados, fallidos = fila
+
+    if album:
+        # El texto va como pie de la primera foto
+        metodo, contenido = "send_media_group", {
+            "media": [InputMediaPhoto(media=file_id) for file_id in album],
+            "caption": texto
+        }
+    elif foto:
+        metodo, contenido = "send_photo", {"photo": foto, "caption": texto}
+    else:
+        metodo, contenido = "send_message", {"text": texto}
+
+    progreso = None
+    if chat_progreso is not None:
+        try:
+            progreso = await enviar(
+                "send_message",
+                PRIORIDAD_ADMIN,
+                chat_id=chat_progreso,
+                text=_texto_progreso(difusion_id, "enviando", total, enviados, fallidos)
+            )
+        except Exception:
+            progreso = None
+
+    ultimo_progreso = time.monotonic()
+    ultimo_turno = time.monotonic()
+    reportado = (enviados, fallidos)
+    estado = "enviando"
+
+    # futuro -> user_id de los envíos que siguen en la cola de salida
+    en_cola = {}
+    estados = []
+    temporales = 0
+
+    def anotar(futuro, user_id):
+        nonlocal enviados, fallidos, temporales
+
+        # Cancelado al apagar: sin fila, se vuelve a intentar al reanudar
+        if futuro.cancelled():
+            return
+
+        error = futuro.exception()
+
+        if error is None:
+            estados.append((user_id, "enviado", None))
+            enviados += 1
+        elif isinstance(error, ERRORES_TEMPORALES) and not isinstance(error, ERRORES_DEFINITIVOS):
+            # La próxima pasada (o el próximo arranque) lo reintenta
+            estados.append((user_id, "temporal", str(error)[:200]))
+            temporales += 1
+        else:
+            estados.append((user_id, "fallido", str(error)[:200]))
+            fallidos += 1
+
+    async def guardar():
+        """Guarda los estados; los que agotaron sus intentos cuentan como fallidos"""
+        nonlocal fallidos, temporales
+
+        agotados = await _guardar_estados(difusion_id, estados)
+        fallidos += agotados
+        temporales -= agotados
+
+    async def vigente():
+        """Renueva el turno y relee el estado (cancelación desde otra réplica)"""
+        nonlocal ultimo_turno, estado
+
+        ultimo_turno = time.monotonic()
+        estado = await _renovar(difusion_id)
+
+        return estado == "enviando"
+
+    async def recoger(hasta):
+        nonlocal ultimo_progreso, reportado
+
+        while len(en_cola) > hasta:
+            listos, _ = await asyncio.wait(en_cola, return_when=asyncio.FIRST_COMPLETED)
+
+            for futuro in listos:
+                anotar(futuro, en_cola.pop(futuro))
+
+        if len(estados) >= LOTE_ESTADOS:
+            await guardar()
+
+        if time.monotonic() - ultimo_turno >= INTERVALO_PROGRESO:
+            if not await vigente():
+                return False
+
+        if (
+            progreso is not None
+            and time.monotonic() - ultimo_progreso >= INTERVALO_PROGRESO
+            and reportado != (enviados, fallidos)
+        ):
+            ultimo_progreso = time.monotonic()
+            reportado = (enviados, fallidos)
+            encolar(
+                "edit_message_text",
+                PRIORIDAD_ADMIN,
+                chat_id=chat_progreso,
+                message_id=progreso.message_id,
+                text=_texto_progreso(difusion_id, "enviando", total, enviados, fallidos)
+            )
+
+        return True
+
+    try:
+        for pasada in range(PASADAS):
+            if pasada:
+                await asyncio.sleep(PAUSA_ENTRE_PASADAS)
+
+            temporales = 0
+            desde = 0
+
+            while usuarios := await _destinatarios(difusion_id, desde):
+                # Entre páginas (y cada INTERVALO_PROGRESO s dentro de recoger)
+                if not await vigente():
+                    break
+
+                for user_id in usuarios:
+                    if not await recoger(VENTANA - 1):
+                        break
+
+                    futuro = encolar(metodo, PRIORIDAD_DIFUSION, chat_id=user_id, **contenido)
+                    en_cola[futuro] = user_id
+
+                if estado != "enviando":
+                    break
+
+                desde = usuarios[-1]
+
+            if estado != "enviando":
+                # Cancelada (o tomada por otra réplica): lo que sigue en la
+                # cola de salida no se envía
+                for futuro, user_id in en_cola.items():
+                    if futuro.done():
+                        anotar(futuro, user_id)
+                    else:
+                        futuro.cancel()
+                await guardar()
+
+                print(f"📣 Difusión #{difusion_id} detenida ({estado or 'otra réplica'})")
+                if progreso is not None and estado == "cancelada":
+                    encolar(
+                        "edit_message_text",
+                        PRIORIDAD_ADMIN,
+                        chat_id=chat_progreso,
+                        message_id=progreso.message_id,
+                        text=_texto_progreso(difusion_id, "cancelada", total, enviados, fallidos)
+                    )
+                return
+
+            await recoger(0)
+            await guardar()
+
+            if not temporales:
+                break
+
+    except asyncio.CancelledError:
+        # Apagado o cancelación: lo que no salió se saca de la cola, se
+        # guarda lo que sí se alcanzó a procesar y se suelta el turno
+        for futuro, user_id in en_cola.items():
+            if futuro.done():
+                anotar(futuro, user_id)
+            else:
+                futuro.cancel()
+        await guardar()
+        await _soltar(difusion_id)
+        raise
+
+    if temporales:
+        # Sigue 'enviando': la retoma reintentar_difusiones (o el barrido
+        # del líder si esta réplica se cae)
+        _por_reintentar.add(difusion_id)
+        print(f"⚠️ Difusión #{difusion_id}: {temporales} envíos pendientes por errores temporales")
+        await _soltar(difusion_id)
+        return
+
+    async with connection() as db:
+        await db.execute("""
+            UPDATE difusiones
+            SET estado = 'terminada',
+                terminada = %s,
+                tomada_hasta = NULL
+            WHERE id = %s
+            AND estado = 'enviando'
+        """, (int(time.time()), difusion_id))
+
+    print(f"📣 Difusión #{difusion_id} terminada: {enviados} enviados, {fallidos} fallidos")
+
+    if progreso is not None:
+        encolar(
+            "edit_message_text",
+            PRIORIDAD_ADMIN,
+            chat_id=chat_progreso,
+            message_id=progreso.message_id,
+            text=_texto_progreso(difusion_id, "terminada", total, enviados, fallidos)
+        )
@@ -0,0 +1,309 @@
+"""
+Cola central de mensajes salientes hacia Telegram.
+
+Los handlers y jobs no llaman a `bot.send_message` directamente para avisos
+a otros chats: encolan el envío con `encolar(...)` y unos pocos workers lo
+despachan respetando los límites de Telegram:
+
+- global: Telegram admite ~30 mensajes por segundo por bot (por defecto se usan 25)
+- por chat: 1 mensaje por segundo en privados, 20 por minuto en grupos
+
+Cada envío tiene una prioridad (los comprobantes para el admin salen antes
+que los avisos a usuarios). Si Telegram responde 429 (`RetryAfter`) se
+espera lo que pide y se reintenta; los errores de red se reintentan con
+espera exponencial; los errores definitivos (usuario bloqueó el bot,
+petición inválida) se registran y se cuentan, no se pierden en silencio.
+"""
+import os
+import time
+import asyncio
+import itertools
+from telegram.error import RetryAfter, Forbidden, BadRequest, NetworkError
+
+# Prioridades: número menor sale primero
+PRIORIDAD_ADMIN = 0
+PRIORIDAD_USUARIO = 1
+PRIORIDAD_DIFUSION = 2
+
+NOMBRES_PRIORIDAD = {
+    PRIORIDAD_ADMIN: "admin",
+    PRIORIDAD_USUARIO: "usuarios",
+    PRIORIDAD_DIFUSION: "difusión",
+}
+
+MENSAJES_POR_SEGUNDO = float(os.getenv("DISPATCHER_MSG_POR_SEGUNDO", "25"))
+MAX_COLA = int(os.getenv("DISPATCHER_MAX_COLA", "10000"))
+WORKERS = int(os.getenv("DISPATCHER_WORKERS", "4"))
+MAX_INTENTOS = int(os.getenv("DISPATCHER_MAX_INTENTOS", "5"))
+
+class ColaLlena(Exception):
+    """El envío se descartó porque la cola llegó a DISPATCHER_MAX_COLA"""
+
+class _Cubeta:
+    """Token bucket: `tasa` fichas por segundo, hasta `capacidad` acumuladas"""
+
+    def __init__(self, tasa, capacidad):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self.fichas = capacidad
+        self.actualizada = time.monotonic()
+        self.pausa_hasta = 0.0
+
+    def _recargar(self, ahora):
+        if ahora > self.actualizada:
+            self.fichas = min(self.capacidad, self.fichas + (ahora - self.actualizada) * self.tasa)
+            self.actualizada = ahora
+
+    def espera(self):
+        """Segundos hasta que haya una ficha (0 si ya la hay)"""
+        ahora = time.monotonic()
+        self._recargar(ahora)
+
+        if ahora < self.pausa_hasta:
+            return self.pausa_hasta - ahora
+        if self.fichas >= 1:
+            return 0.0
+        return (1 - self.fichas) / self.tasa
+
+    def tomar(self):
+        self.fichas -= 1
+
+    def pausar(self, segundos):
+        self.pausa_hasta = max(self.pausa_hasta, time.monotonic() + segundos)
+        # Al terminar la pausa se empieza sin fichas acumuladas
+        self.fichas = 0
+        self.actualizada = self.pausa_hasta
+
+class _Envio:
+    __slots__ = ("metodo", "kwargs", "prioridad", "futuro", "intentos")
+
+    def __init__(self, metodo, kwargs, prioridad, futuro):
+        self.metodo = metodo
+        self.kwargs = kwargs
+        self.prioridad = prioridad
+        self.futuro = futuro
+        self.intentos = 0
+
+_bot = None
+_cola = None
+_workers = []
+_global = None
+
+# chat_id -> _Cubeta (se limpian las que llevan rato sin uso)
+_chats = {}
+
+# Desempata dentro de la misma prioridad: el más antiguo primero
+_orden = itertools.count()
+
+# Envíos esperando un reintento (fuera de la cola)
+_diferidos = 0
+_en_vuelo = 0
+
+_metrics = {
+    "encolados": 0,
+    "enviados": 0,
+    "reintentos": 0,
+    "limitados": 0,
+    "fallidos": 0,
+    "descartados": 0,
+}
+_pendientes = {prioridad: 0 for prioridad in NOMBRES_PRIORIDAD}
+
+def _cubeta_chat(chat_id):
+    cubeta = _chats.get(chat_id)
+
+    if cubeta is None:
+        if len(_chats) > 10000:
+            _limpiar_chats()
+
+        # Ids negativos = grupos y canales
+        if isinstance(chat_id, int) and chat_id < 0:
+            cubeta = _Cubeta(20 / 60, 3)
+        else:
+            cubeta = _Cubeta(1, 1)
+        _chats[chat_id] = cubeta
+
+    return cubeta
+
+def _limpiar_chats():
+    """Olvida las cubetas llenas: un chat sin envíos recientes vuelve a empezar igual"""
+    ahora = time.monotonic()
+    for chat_id, cubeta in list(_chats.items()):
+        cubeta._recargar(ahora)
+        if cubeta.fichas >= cubeta.capacidad and ahora >= cubeta.pausa_hasta:
+            del _chats[chat_id]
+
+def iniciar(bot):
+    """Arranca los workers; llamar una vez con el loop ya corriendo (post_init)"""
+    global _bot, _cola, _global
+
+    if _cola is not None:
+        return
+
+    _bot = bot
+    _cola = asyncio.PriorityQueue()
+    # Sin ráfagas: una ficha acumulada como máximo, así ninguna ventana
+    # de un segundo supera MENSAJES_POR_SEGUNDO
+    _global = _Cubeta(MENSAJES_POR_SEGUNDO, 1)
+
+    for i in range(WORKERS):
+        _workers.append(asyncio.create_task(_worker(), name=f"dispatcher-{i}"))
+
+async def detener(timeout=10):
+    """Espera (hasta `timeout` s) a que se vacíe la cola y apaga los workers"""
+    global _bot, _cola
+
+    if _cola is None:
+        return
+
+    limite = time.monotonic() + timeout
+    while (not _cola.empty() or _diferidos or _en_vuelo) and time.monotonic() < limite:
+        await asyncio.sleep(0.1)
+
+    for worker in _workers:
+        worker.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+    # Lo que no alcanzó a salir se reporta como fallido
+    while not _cola.empty():
+        _, _, envio = _cola.get_nowait()
+        _pendientes[envio.prioridad] -= 1
+        _metrics["fallidos"] += 1
+        if not envio.futuro.done():
+            envio.futuro.cancel()
+
+    if _diferidos:
+        print(f"⚠️ Dispatcher detenido con {_diferidos} envíos esperando reintento")
+
+    _bot = None
+    _cola = None
+
+def _poner(envio):
+    _pendientes[envio.prioridad] += 1
+    _cola.put_nowait((envio.prioridad, next(_orden), envio))
+
+def _reintentar_en(envio, segundos):
+    """Vuelve a encolar el envío después de `segundos` sin ocupar un worker"""
+    global _diferidos
+
+    _diferidos += 1
+
+    def volver():
+        global _diferidos
+        _diferidos -= 1
+        if _cola is not None:
+            _poner(envio)
+        elif not envio.futuro.done():
+            # El dispatcher se detuvo mientras esperaba
+            _metrics["fallidos"] += 1
+            envio.futuro.cancel()
+
+    asyncio.get_running_loop().call_later(segundos, volver)
+
+def encolar(metodo, prioridad=PRIORIDAD_USUARIO, **kwargs):
+    """
+    Encola `bot.<metodo>(**kwargs)` (p. ej. "send_message") y devuelve un
+    Future con el resultado. Quien no necesita el resultado puede ignorarlo:
+    los fallos quedan registrados en las métricas y en el log.
+    """
+    if _cola is None:
+        raise RuntimeError("El dispatcher no está iniciado")
+
+    futuro = asyncio.get_running_loop().create_future()
+    # Marca la excepción como leída para que un envío sin await no ensucie el log
+    futuro.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    if sum(_pendientes.values()) + _diferidos >= MAX_COLA:
+        _metrics["descartados"] += 1
+        print(f"⚠️ Cola de envíos llena, se descarta {metodo} a {kwargs.get('chat_id')}")
+        futuro.set_exception(ColaLlena(metodo))
+        return futuro
+
+    _metrics["encolados"] += 1
+    _poner(_Envio(metodo, kwargs, prioridad, futuro))
+    return futuro
+
+async def enviar(metodo, prioridad=PRIORIDAD_USUARIO, **kwargs):
+    """Como `encolar`, pero espera a que el envío salga (o falle definitivamente)"""
+    return await encolar(metodo, prioridad, **kwargs)
+
+async def _worker():
+    global _en_vuelo
+
+    while True:
+        _, _, envio = await _cola.get()
+        _pendientes[envio.prioridad] -= 1
+
+        if envio.futuro.done():
+            continue
+
+        # Límite global: este worker espera su turno
+        while (espera := _global.espera()) > 0:
+            await asyncio.sleep(espera)
+
+        # Límite por chat: si el chat no tiene ficha, el envío vuelve a la
+        # cola más tarde y el worker sigue con otros chats
+        cubeta = _cubeta_chat(envio.kwargs.get("chat_id"))
+        espera = cubeta.espera()
+        if espera > 0:
+            _reintentar_en(envio, espera)
+            continue
+
+        _global.tomar()
+        cubeta.tomar()
+        envio.intentos += 1
+        _en_vuelo += 1
+
+        try:
+            resultado = await getattr(_bot, envio.metodo)(**envio.kwargs)
+        except RetryAfter as e:
+            # Telegram pide esperar: se frena todo el bot, no solo este chat
+            _metrics["limitados"] += 1
+            _global.pausar(e.retry_after)
+            cubeta.pausar(e.retry_after)
+            _fallo_temporal(envio, e, e.retry_after)
+        except (Forbidden, BadRequest) as e:
+            _fallo_definitivo(envio, e)
+        except NetworkError as e:
+            _fallo_temporal(envio, e, 2 ** envio.intentos)
+        except asyncio.CancelledError:
+            envio.futuro.cancel()
+            raise
+        except Exception as e:
+            _fallo_definitivo(envio, e)
+        else:
+            _metrics["enviados"] += 1
+            if not envio.futuro.done():
+                envio.futuro.set_result(resultado)
+        finally:
+            _en_vuelo -= 1
+
+def _fallo_temporal(envio, error, espera):
+    if envio.intentos >= MAX_INTENTOS:
+        _fallo_definitivo(envio, error)
+        return
+
+    _metrics["reintentos"] += 1
+    _reintentar_en(envio, espera)
+
+def _fallo_definitivo(envio, error):
+    _metrics["fallidos"] += 1
+    print(
+        f"❌ No se pudo enviar {envio.metodo} a {envio.kwargs.get('chat_id')} "
+        f"({envio.intentos} intentos): {error}"
+    )
+    if not envio.futuro.done():
+        envio.futuro.set_exception(error)
+
+def dispatcher_metrics():
+    """Profundidad de la cola por prioridad y contadores de envíos"""
+    return {
+        "pendientes": {
+            NOMBRES_PRIORIDAD[prioridad]: cantidad
+            for prioridad, cantidad in _pendientes.items()
+        },
+        "diferidos": _diferidos,
+        "en_vuelo": _en_vuelo,
+        **_metrics,
+    }
@@ -0,0 +1,42 @@
+-- Esquema base del bot. Usa IF NOT EXISTS para adoptar bases de datos
+-- creadas antes del sistema de migraciones sin tocar sus datos.
+
+-- migrate:up
+CREATE TABLE IF NOT EXISTS rifas (
+    id SERIAL PRIMARY KEY,
+    nombre TEXT NOT NULL,
+    precio INTEGER NOT NULL,
+    total_numeros INTEGER NOT NULL,
+    activa INTEGER DEFAULT 1
+);
+
+CREATE TABLE IF NOT EXISTS numeros (
+    id SERIAL PRIMARY KEY,
+    rifa_id INTEGER REFERENCES rifas(id) ON DELETE CASCADE,
+    numero INTEGER,
+    user_id BIGINT,
+    pago_id INTEGER,
+    reservado INTEGER DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS usuarios (
+    user_id BIGINT PRIMARY KEY,
+    username TEXT,
+    nombre TEXT,
+    telefono TEXT
+);
+
+CREATE TABLE IF NOT EXISTS pagos (
+    id SERIAL PRIMARY KEY,
+    user_id BIGINT,
+    rifa_id INTEGER REFERENCES rifas(id) ON DELETE CASCADE,
+    comprobante TEXT,
+    estado TEXT,
+    timestamp INTEGER
+);
+
+-- migrate:down
+DROP TABLE IF EXISTS pagos CASCADE;
+DROP TABLE IF EXISTS numeros CASCADE;
+DROP TABLE IF EXISTS usuarios CASCADE;
+DROP TABLE IF EXISTS rifas CASCADE;
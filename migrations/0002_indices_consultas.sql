@@ -0,0 +1,26 @@
+-- Índices de las rutas calientes (grilla, pagos de un usuario, expiración)
+
+-- migrate:up
+-- Un número no puede existir dos veces en la misma rifa; también sirve
+-- para todos los filtros por rifa_id (grilla, estadísticas, talonario)
+CREATE UNIQUE INDEX IF NOT EXISTS numeros_rifa_numero_key
+ON numeros (rifa_id, numero);
+
+-- Números de un pago (aprobar, rechazar, expirar, mis boletas)
+CREATE INDEX IF NOT EXISTS numeros_pago_id_idx
+ON numeros (pago_id);
+
+-- Último pago de un usuario (recibir_comprobante, mis boletas)
+CREATE INDEX IF NOT EXISTS pagos_user_timestamp_idx
+ON pagos (user_id, timestamp DESC);
+
+-- Barrido de reservas vencidas: solo los pagos pendientes
+CREATE INDEX IF NOT EXISTS pagos_pendientes_timestamp_idx
+ON pagos (timestamp)
+WHERE estado = 'pendiente';
+
+-- migrate:down
+DROP INDEX IF EXISTS pagos_pendientes_timestamp_idx;
+DROP INDEX IF EXISTS pagos_user_timestamp_idx;
+DROP INDEX IF EXISTS numeros_pago_id_idx;
+DROP INDEX IF EXISTS numeros_rifa_numero_key;
@@ -0,0 +1,9 @@
+-- Pagos de una rifa por estado (estadísticas, talonario, eliminar rifa)
+
+-- migrate:up
+-- Sin este índice contar los pagos de una rifa recorre la tabla entera
+CREATE INDEX IF NOT EXISTS pagos_rifa_estado_idx
+ON pagos (rifa_id, estado);
+
+-- migrate:down
+DROP INDEX IF EXISTS pagos_rifa_estado_idx;
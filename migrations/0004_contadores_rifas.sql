@@ -0,0 +1,172 @@
+-- Contadores por rifa mantenidos con triggers: listar rifas lee solo la
+-- tabla rifas en lugar de agrupar todos los números en cada vista
+
+-- migrate:up
+-- Nadie escribe números ni pagos mientras se cargan los contadores
+LOCK TABLE numeros, pagos IN SHARE ROW EXCLUSIVE MODE;
+
+-- numeros_ocupados: números con reservado = 1 (pendientes, en revisión o vendidos)
+-- numeros_vendidos: números cuyo pago está aprobado
+ALTER TABLE rifas ADD COLUMN IF NOT EXISTS numeros_ocupados INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE rifas ADD COLUMN IF NOT EXISTS numeros_vendidos INTEGER NOT NULL DEFAULT 0;
+
+-- Suma los cambios (por rifa) a los contadores. Bloquea las filas de rifas
+-- en orden de id para que dos sentencias que tocan varias rifas no se crucen.
+-- NO KEY UPDATE (no FOR UPDATE): no choca con el FOR KEY SHARE que toma la
+-- FK de pagos.rifa_id al insertar un pago en la misma rifa.
+CREATE OR REPLACE FUNCTION sumar_contadores_rifas(cambios JSONB) RETURNS VOID AS $$
+BEGIN
+    PERFORM 1
+    FROM rifas
+    WHERE id IN (SELECT (c->>'rifa_id')::INTEGER FROM jsonb_array_elements(cambios) c)
+    ORDER BY id
+    FOR NO KEY UPDATE;
+
+    UPDATE rifas r
+    SET numeros_ocupados = r.numeros_ocupados + d.ocupados,
+        numeros_vendidos = r.numeros_vendidos + d.vendidos
+    FROM (
+        SELECT (c->>'rifa_id')::INTEGER AS rifa_id,
+               (c->>'ocupados')::INTEGER AS ocupados,
+               (c->>'vendidos')::INTEGER AS vendidos
+        FROM jsonb_array_elements(cambios) c
+    ) d
+    WHERE r.id = d.rifa_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Trigger por sentencia sobre numeros: compara las filas viejas y nuevas
+-- (tablas de transición) y aplica un solo UPDATE por rifa afectada
+CREATE OR REPLACE FUNCTION contar_numeros_rifa() RETURNS TRIGGER AS $$
+DECLARE
+    cambios JSONB;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT jsonb_agg(d) INTO cambios
+        FROM (
+            SELECT n.rifa_id,
+                   COUNT(*) FILTER (WHERE n.reservado = 1) AS ocupados,
+                   COUNT(p.id) AS vendidos
+            FROM nuevos n
+            LEFT JOIN pagos p ON p.id = n.pago_id AND p.estado = 'aprobado'
+            GROUP BY n.rifa_id
+        ) d
+        WHERE d.ocupados <> 0 OR d.vendidos <> 0;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT jsonb_agg(d) INTO cambios
+        FROM (
+            SELECT n.rifa_id,
+                   -COUNT(*) FILTER (WHERE n.reservado = 1) AS ocupados,
+                   -COUNT(p.id) AS vendidos
+            FROM viejos n
+            LEFT JOIN pagos p ON p.id = n.pago_id AND p.estado = 'aprobado'
+            GROUP BY n.rifa_id
+        ) d
+        WHERE d.ocupados <> 0 OR d.vendidos <> 0;
+    ELSE
+        SELECT jsonb_agg(d) INTO cambios
+        FROM (
+            SELECT rifa_id, SUM(ocupados) AS ocupados, SUM(vendidos) AS vendidos
+            FROM (
+                SELECT n.rifa_id,
+                       COUNT(*) FILTER (WHERE n.reservado = 1) AS ocupados,
+                       COUNT(p.id) AS vendidos
+                FROM nuevos n
+                LEFT JOIN pagos p ON p.id = n.pago_id AND p.estado = 'aprobado'
+                GROUP BY n.rifa_id
+                UNION ALL
+                SELECT n.rifa_id,
+                       -COUNT(*) FILTER (WHERE n.reservado = 1),
+                       -COUNT(p.id)
+                FROM viejos n
+                LEFT JOIN pagos p ON p.id = n.pago_id AND p.estado = 'aprobado'
+                GROUP BY n.rifa_id
+            ) t
+            GROUP BY rifa_id
+        ) d
+        WHERE d.ocupados <> 0 OR d.vendidos <> 0;
+    END IF;
+
+    IF cambios IS NOT NULL THEN
+        PERFORM sumar_contadores_rifas(cambios);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Trigger por sentencia sobre pagos: un pago que entra o sale de
+-- 'aprobado' mueve todos sus números a (o desde) vendidos
+CREATE OR REPLACE FUNCTION contar_pagos_rifa() RETURNS TRIGGER AS $$
+DECLARE
+    cambios JSONB;
+BEGIN
+    SELECT jsonb_agg(d) INTO cambios
+    FROM (
+        SELECT n.rifa_id,
+               0 AS ocupados,
+               SUM(CASE WHEN nuevo.estado = 'aprobado' THEN 1 ELSE -1 END) AS vendidos
+        FROM nuevos nuevo
+        JOIN viejos viejo ON viejo.id = nuevo.id
+        JOIN numeros n ON n.pago_id = nuevo.id
+        WHERE (viejo.estado = 'aprobado') IS DISTINCT FROM (nuevo.estado = 'aprobado')
+        GROUP BY n.rifa_id
+    ) d
+    WHERE d.vendidos <> 0;
+
+    IF cambios IS NOT NULL THEN
+        PERFORM sumar_contadores_rifas(cambios);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS numeros_contadores_insert ON numeros;
+CREATE TRIGGER numeros_contadores_insert
+AFTER INSERT ON numeros
+REFERENCING NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION contar_numeros_rifa();
+
+DROP TRIGGER IF EXISTS numeros_contadores_update ON numeros;
+CREATE TRIGGER numeros_contadores_update
+AFTER UPDATE ON numeros
+REFERENCING OLD TABLE AS viejos NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION contar_numeros_rifa();
+
+DROP TRIGGER IF EXISTS numeros_contadores_delete ON numeros;
+CREATE TRIGGER numeros_contadores_delete
+AFTER DELETE ON numeros
+REFERENCING OLD TABLE AS viejos
+FOR EACH STATEMENT EXECUTE FUNCTION contar_numeros_rifa();
+
+DROP TRIGGER IF EXISTS pagos_contadores_update ON pagos;
+CREATE TRIGGER pagos_contadores_update
+AFTER UPDATE ON pagos
+REFERENCING OLD TABLE AS viejos NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION contar_pagos_rifa();
+
+-- Carga inicial desde los datos existentes
+UPDATE rifas r
+SET numeros_ocupados = c.ocupados,
+    numeros_vendidos = c.vendidos
+FROM (
+    SELECT n.rifa_id,
+           COUNT(*) FILTER (WHERE n.reservado = 1) AS ocupados,
+           COUNT(p.id) AS vendidos
+    FROM numeros n
+    LEFT JOIN pagos p ON p.id = n.pago_id AND p.estado = 'aprobado'
+    GROUP BY n.rifa_id
+) c
+WHERE r.id = c.rifa_id;
+
+-- migrate:down
+DROP TRIGGER IF EXISTS pagos_contadores_update ON pagos;
+DROP TRIGGER IF EXISTS numeros_contadores_delete ON numeros;
+DROP TRIGGER IF EXISTS numeros_contadores_update ON numeros;
+DROP TRIGGER IF EXISTS numeros_contadores_insert ON numeros;
+DROP FUNCTION IF EXISTS contar_pagos_rifa();
+DROP FUNCTION IF EXISTS contar_numeros_rifa();
+DROP FUNCTION IF EXISTS sumar_contadores_rifas(JSONB);
+ALTER TABLE rifas DROP COLUMN IF EXISTS numeros_vendidos;
+ALTER TABLE rifas DROP COLUMN IF EXISTS numeros_ocupados;
@@ -0,0 +1,26 @@
+-- Difusiones del admin a todos los usuarios, con el estado de cada envío
+-- para poder retomarlas después de un reinicio
+
+-- migrate:up
+CREATE TABLE IF NOT EXISTS difusiones (
+    id SERIAL PRIMARY KEY,
+    texto TEXT,
+    foto TEXT,                                  -- file_id de Telegram (opcional)
+    estado TEXT NOT NULL DEFAULT 'enviando',    -- 'enviando', 'terminada', 'cancelada'
+    total INTEGER NOT NULL DEFAULT 0,           -- usuarios registrados al empezar
+    creada BIGINT NOT NULL,
+    terminada BIGINT
+);
+
+-- Una fila por destinatario ya procesado: lo que no está aquí falta por enviar
+CREATE TABLE IF NOT EXISTS difusion_envios (
+    difusion_id INTEGER NOT NULL REFERENCES difusiones(id) ON DELETE CASCADE,
+    user_id BIGINT NOT NULL,
+    estado TEXT NOT NULL,                       -- 'enviado', 'fallido'
+    error TEXT,
+    PRIMARY KEY (difusion_id, user_id)
+);
+
+-- migrate:down
+DROP TABLE IF EXISTS difusion_envios;
+DROP TABLE IF EXISTS difusiones;
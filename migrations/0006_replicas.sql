@@ -0,0 +1,27 @@
+-- Estado compartido entre réplicas del bot: updates ya procesados y el
+-- estado de cada usuario (user_data y conversaciones en curso)
+
+-- migrate:up
+-- Telegram puede entregar el mismo update más de una vez (reintentos del
+-- webhook, cambio entre polling y webhook): solo se procesa la primera
+CREATE TABLE IF NOT EXISTS updates_procesados (
+    update_id BIGINT PRIMARY KEY,
+    recibido BIGINT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS updates_procesados_recibido_idx
+ON updates_procesados (recibido);
+
+-- version sube con cada escritura: una réplica recarga el estado solo si
+-- otra lo cambió después de su última lectura
+CREATE TABLE IF NOT EXISTS estado_usuarios (
+    user_id BIGINT PRIMARY KEY,
+    datos JSONB NOT NULL DEFAULT '{}',
+    conversaciones JSONB NOT NULL DEFAULT '{}',
+    version INTEGER NOT NULL DEFAULT 0,
+    actualizado BIGINT NOT NULL
+);
+
+-- migrate:down
+DROP TABLE IF EXISTS estado_usuarios;
+DROP TABLE IF EXISTS updates_procesados;
@@ -0,0 +1,229 @@
+-- Versión del estado de cada rifa: sube con cualquier cambio en sus números
+-- o en el estado de sus pagos (reservar, enviar comprobante, aprobar,
+-- rechazar, expirar). El talonario (PDF e imagen) se cachea por versión.
+
+-- migrate:up
+ALTER TABLE rifas ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0;
+
+-- Igual que en 0004, y además sube la versión de cada rifa tocada
+CREATE OR REPLACE FUNCTION sumar_contadores_rifas(cambios JSONB) RETURNS VOID AS $$
+BEGIN
+    PERFORM 1
+    FROM rifas
+    WHERE id IN (SELECT (c->>'rifa_id')::INTEGER FROM jsonb_array_elements(cambios) c)
+    ORDER BY id
+    FOR NO KEY UPDATE;
+
+    UPDATE rifas r
+    SET numeros_ocupados = r.numeros_ocupados + d.ocupados,
+        numeros_vendidos = r.numeros_vendidos + d.vendidos,
+        version = r.version + 1
+    FROM (
+        SELECT (c->>'rifa_id')::INTEGER AS rifa_id,
+               (c->>'ocupados')::INTEGER AS ocupados,
+               (c->>'vendidos')::INTEGER AS vendidos
+        FROM jsonb_array_elements(cambios) c
+    ) d
+    WHERE r.id = d.rifa_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Cualquier sentencia sobre numeros cambia el talonario: las rifas tocadas
+-- pasan a sumar_contadores_rifas aunque sus contadores no cambien
+CREATE OR REPLACE FUNCTION contar_numeros_rifa() RETURNS TRIGGER AS $$
+DECLARE
+    cambios JSONB;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT jsonb_agg(d) INTO cambios
+        FROM (
+            SELECT n.rifa_id,
+                   COUNT(*) FILTER (WHERE n.reservado = 1) AS ocupados,
+                   COUNT(p.id) AS vendidos
+            FROM nuevos n
+            LEFT JOIN pagos p ON p.id = n.pago_id AND p.estado = 'aprobado'
+            GROUP BY n.rifa_id
+        ) d;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT jsonb_agg(d) INTO cambios
+        FROM (
+            SELECT n.rifa_id,
+                   -COUNT(*) FILTER (WHERE n.reservado = 1) AS ocupados,
+                   -COUNT(p.id) AS vendidos
+            FROM viejos n
+            LEFT JOIN pagos p ON p.id = n.pago_id AND p.estado = 'aprobado'
+            GROUP BY n.rifa_id
+        ) d;
+    ELSE
+        SELECT jsonb_agg(d) INTO cambios
+        FROM (
+            SELECT rifa_id, SUM(ocupados) AS ocupados, SUM(vendidos) AS vendidos
+            FROM (
+                SELECT n.rifa_id,
+                       COUNT(*) FILTER (WHERE n.reservado = 1) AS ocupados,
+                       COUNT(p.id) AS vendidos
+                FROM nuevos n
+                LEFT JOIN pagos p ON p.id = n.pago_id AND p.estado = 'aprobado'
+                GROUP BY n.rifa_id
+                UNION ALL
+                SELECT n.rifa_id,
+                       -COUNT(*) FILTER (WHERE n.reservado = 1),
+                       -COUNT(p.id)
+                FROM viejos n
+                LEFT JOIN pagos p ON p.id = n.pago_id AND p.estado = 'aprobado'
+                GROUP BY n.rifa_id
+            ) t
+            GROUP BY rifa_id
+        ) d;
+    END IF;
+
+    IF cambios IS NOT NULL THEN
+        PERFORM sumar_contadores_rifas(cambios);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Cualquier cambio de estado de un pago cambia el talonario (p. ej.
+-- pendiente -> en_revision), no solo la entrada o salida de 'aprobado'
+CREATE OR REPLACE FUNCTION contar_pagos_rifa() RETURNS TRIGGER AS $$
+DECLARE
+    cambios JSONB;
+BEGIN
+    SELECT jsonb_agg(d) INTO cambios
+    FROM (
+        SELECT n.rifa_id,
+               0 AS ocupados,
+               SUM(
+                   CASE
+                       WHEN nuevo.estado = 'aprobado' THEN 1
+                       WHEN viejo.estado = 'aprobado' THEN -1
+                       ELSE 0
+                   END
+               ) AS vendidos
+        FROM nuevos nuevo
+        JOIN viejos viejo ON viejo.id = nuevo.id
+        JOIN numeros n ON n.pago_id = nuevo.id
+        WHERE viejo.estado IS DISTINCT FROM nuevo.estado
+        GROUP BY n.rifa_id
+    ) d;
+
+    IF cambios IS NOT NULL THEN
+        PERFORM sumar_contadores_rifas(cambios);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- migrate:down
+CREATE OR REPLACE FUNCTION sumar_contadores_rifas(cambios JSONB) RETURNS VOID AS $$
+BEGIN
+    PERFORM 1
+    FROM rifas
+    WHERE id IN (SELECT (c->>'rifa_id')::INTEGER FROM jsonb_array_elements(cambios) c)
+    ORDER BY id
+    FOR NO KEY UPDATE;
+
+    UPDATE rifas r
+    SET numeros_ocupados = r.numeros_ocupados + d.ocupados,
+        numeros_vendidos = r.numeros_vendidos + d.vendidos
+    FROM (
+        SELECT (c->>'rifa_id')::INTEGER AS rifa_id,
+               (c->>'ocupados')::INTEGER AS ocupados,
+               (c->>'vendidos')::INTEGER AS vendidos
+        FROM jsonb_array_elements(cambios) c
+    ) d
+    WHERE r.id = d.rifa_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Trigger por sentencia sobre numeros: compara las filas viejas y nuevas
+-- (tablas de transición) y aplica un solo UPDATE por rifa afectada
+CREATE OR REPLACE FUNCTION contar_numeros_rifa() RETURNS TRIGGER AS $$
+DECLARE
+    cambios JSONB;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT jsonb_agg(d) INTO cambios
+        FROM (
+            SELECT n.rifa_id,
+                   COUNT(*) FILTER (WHERE n.reservado = 1) AS ocupados,
+                   COUNT(p.id) AS vendidos
+            FROM nuevos n
+            LEFT JOIN pagos p ON p.id = n.pago_id AND p.estado = 'aprobado'
+            GROUP BY n.rifa_id
+        ) d
+        WHERE d.ocupados <> 0 OR d.vendidos <> 0;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT jsonb_agg(d) INTO cambios
+        FROM (
+            SELECT n.rifa_id,
+                   -COUNT(*) FILTER (WHERE n.reservado = 1) AS ocupados,
+                   -COUNT(p.id) AS vendidos
+            FROM viejos n
+            LEFT JOIN pagos p ON p.id = n.pago_id AND p.estado = 'aprobado'
+            GROUP BY n.rifa_id
+        ) d
+        WHERE d.ocupados <> 0 OR d.vendidos <> 0;
+    ELSE
+        SELECT jsonb_agg(d) INTO cambios
+        FROM (
+            SELECT rifa_id, SUM(ocupados) AS ocupados, SUM(vendidos) AS vendidos
+            FROM (
+                SELECT n.rifa_id,
+                       COUNT(*) FILTER (WHERE n.reservado = 1) AS ocupados,
+                       COUNT(p.id) AS vendidos
+                FROM nuevos n
+                LEFT JOIN pagos p ON p.id = n.pago_id AND p.estado = 'aprobado'
+                GROUP BY n.rifa_id
+                UNION ALL
+                SELECT n.rifa_id,
+                       -COUNT(*) FILTER (WHERE n.reservado = 1),
+                       -COUNT(p.id)
+                FROM viejos n
+                LEFT JOIN pagos p ON p.id = n.pago_id AND p.estado = 'aprobado'
+                GROUP BY n.rifa_id
+            ) t
+            GROUP BY rifa_id
+        ) d
+        WHERE d.ocupados <> 0 OR d.vendidos <> 0;
+    END IF;
+
+    IF cambios IS NOT NULL THEN
+        PERFORM sumar_contadores_rifas(cambios);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Trigger por sentencia sobre pagos: un pago que entra o sale de
+-- 'aprobado' mueve todos sus números a (o desde) vendidos
+CREATE OR REPLACE FUNCTION contar_pagos_rifa() RETURNS TRIGGER AS $$
+DECLARE
+    cambios JSONB;
+BEGIN
+    SELECT jsonb_agg(d) INTO cambios
+    FROM (
+        SELECT n.rifa_id,
+               0 AS ocupados,
+               SUM(CASE WHEN nuevo.estado = 'aprobado' THEN 1 ELSE -1 END) AS vendidos
+        FROM nuevos nuevo
+        JOIN viejos viejo ON viejo.id = nuevo.id
+        JOIN numeros n ON n.pago_id = nuevo.id
+        WHERE (viejo.estado = 'aprobado') IS DISTINCT FROM (nuevo.estado = 'aprobado')
+        GROUP BY n.rifa_id
+    ) d
+    WHERE d.vendidos <> 0;
+
+    IF cambios IS NOT NULL THEN
+        PERFORM sumar_contadores_rifas(cambios);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+ALTER TABLE rifas DROP COLUMN IF EXISTS version;
@@ -0,0 +1,9 @@
+-- Difusiones con varias fotos (la imagen del talonario de una rifa de más
+-- de 100 números es una por cada bloque de 100)
+
+-- migrate:up
+-- file_id de las fotos de un álbum (de 2 a 10); si está, se usa en lugar de foto
+ALTER TABLE difusiones ADD COLUMN IF NOT EXISTS album TEXT[];
+
+-- migrate:down
+ALTER TABLE difusiones DROP COLUMN IF EXISTS album;
@@ -0,0 +1,12 @@
+-- Qué réplica envía cada difusión, sin mantener una transacción abierta
+-- mientras dura (antes: advisory lock de transacción + cursor con nombre)
+
+-- migrate:up
+-- La réplica renueva tomada_hasta mientras envía; si muere, otra la retoma
+-- cuando vence
+ALTER TABLE difusiones ADD COLUMN IF NOT EXISTS replica TEXT;
+ALTER TABLE difusiones ADD COLUMN IF NOT EXISTS tomada_hasta BIGINT;
+
+-- migrate:down
+ALTER TABLE difusiones DROP COLUMN IF EXISTS tomada_hasta;
+ALTER TABLE difusiones DROP COLUMN IF EXISTS replica;
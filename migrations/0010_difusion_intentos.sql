@@ -0,0 +1,11 @@
+-- Reintentos por destinatario de una difusión: un usuario con errores
+-- temporales se reintenta hasta INTENTOS_POR_DESTINATARIO veces y luego queda
+-- 'fallido', así una difusión no queda abierta para siempre
+
+-- migrate:up
+-- estado 'temporal': falló por un error temporal y se vuelve a intentar
+ALTER TABLE difusion_envios ADD COLUMN IF NOT EXISTS intentos INTEGER NOT NULL DEFAULT 1;
+
+-- migrate:down
+DELETE FROM difusion_envios WHERE estado = 'temporal';
+ALTER TABLE difusion_envios DROP COLUMN IF EXISTS intentos;
@@ -0,0 +1,55 @@
+-- El PDF del talonario muestra nombre, usuario y teléfono de cada comprador:
+-- si cambian (el usuario vuelve a registrarse), sube la versión de las
+-- rifas donde tiene números para que no se reenvíe un PDF viejo
+
+-- migrate:up
+CREATE OR REPLACE FUNCTION versionar_rifas_usuarios() RETURNS TRIGGER AS $$
+DECLARE
+    cambios JSONB;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT jsonb_agg(d) INTO cambios
+        FROM (
+            SELECT DISTINCT n.rifa_id, 0 AS ocupados, 0 AS vendidos
+            FROM nuevos u
+            JOIN pagos p ON p.user_id = u.user_id
+            JOIN numeros n ON n.pago_id = p.id
+        ) d;
+    ELSE
+        SELECT jsonb_agg(d) INTO cambios
+        FROM (
+            SELECT DISTINCT n.rifa_id, 0 AS ocupados, 0 AS vendidos
+            FROM nuevos u
+            JOIN viejos v ON v.user_id = u.user_id
+            JOIN pagos p ON p.user_id = u.user_id
+            JOIN numeros n ON n.pago_id = p.id
+            WHERE (v.nombre, v.username, v.telefono)
+                  IS DISTINCT FROM (u.nombre, u.username, u.telefono)
+        ) d;
+    END IF;
+
+    -- Contadores sin cambio: solo sube la versión (con el mismo orden de locks)
+    IF cambios IS NOT NULL THEN
+        PERFORM sumar_contadores_rifas(cambios);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS usuarios_version_insert ON usuarios;
+CREATE TRIGGER usuarios_version_insert
+AFTER INSERT ON usuarios
+REFERENCING NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION versionar_rifas_usuarios();
+
+DROP TRIGGER IF EXISTS usuarios_version_update ON usuarios;
+CREATE TRIGGER usuarios_version_update
+AFTER UPDATE ON usuarios
+REFERENCING OLD TABLE AS viejos NEW TABLE AS nuevos
+FOR EACH STATEMENT EXECUTE FUNCTION versionar_rifas_usuarios();
+
+-- migrate:down
+DROP TRIGGER IF EXISTS usuarios_version_update ON usuarios;
+DROP TRIGGER IF EXISTS usuarios_version_insert ON usuarios;
+DROP FUNCTION IF EXISTS versionar_rifas_usuarios();
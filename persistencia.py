@@ -0,0 +1,286 @@
+"""
+Persistencia de PTB en PostgreSQL: `context.user_data` (carrito de números,
+datos del registro, rifa en creación) y el paso de las conversaciones
+sobreviven a un reinicio o a un deploy.
+
+Las escrituras no van a la base en cada update. PTB anota qué usuarios
+cambiaron y cada PERSISTENCIA_INTERVALO segundos llama a update_user_data /
+update_conversation; aquí solo se actualiza la copia en memoria y, al
+terminar esa vuelta, todos los usuarios con cambios se guardan en un solo
+upsert. Veinte toques en toggle_numero dentro del intervalo son una sola
+escritura. Al apagar, PTB llama a flush() y se guarda lo pendiente.
+
+El estado vive en estado_usuarios (una fila por usuario, con `version`
+para que otras réplicas sepan cuándo recargarlo; ver replicas.py). El
+upsert solo escribe si la versión en la base es la que esta réplica leyó:
+si otra réplica la cambió antes, se descarta el cambio local y el próximo
+update del usuario recarga el estado guardado.
+"""
+import os
+import json
+import time
+import asyncio
+from telegram.ext import BasePersistence, PersistenceInput
+from database import connection, init_db
+
+# Segundos entre guardados (lo que se pierde como máximo si el proceso muere
+# sin apagarse bien)
+PERSISTENCIA_INTERVALO = float(os.getenv("PERSISTENCIA_INTERVALO", "5"))
+
+def _a_json(valor):
+    # user_data guarda sets (números seleccionados, pagos marcados)
+    if isinstance(valor, (set, frozenset)):
+        try:
+            return {"__set__": sorted(valor)}
+        except TypeError:
+            return {"__set__": list(valor)}
+    raise TypeError(f"No se puede guardar {type(valor).__name__} en el estado")
+
+def _de_json(objeto):
+    if len(objeto) == 1 and "__set__" in objeto:
+        return set(objeto["__set__"])
+    return objeto
+
+def codificar(valor):
+    return json.dumps(valor, default=_a_json, sort_keys=True, ensure_ascii=False)
+
+def decodificar(texto):
+    return json.loads(texto, object_hook=_de_json)
+
+# Estado de un usuario sin datos ni conversaciones: no necesita fila
+_VACIO = codificar([{}, {}])
+
+class PersistenciaPostgres(BasePersistence):
+    """
+    Solo se guarda user_data y las conversaciones; chat_data, bot_data y
+    callback_data no se usan en el bot.
+    """
+
+    def __init__(self, update_interval=PERSISTENCIA_INTERVALO):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._cargado = False
+
+        # Copia en memoria de lo que hay (o habrá) en estado_usuarios
+        self._datos = {}            # user_id -> user_data
+        self._conversaciones = {}   # user_id -> {"nombre:chat_id": estado}
+        self._versiones = {}        # user_id -> version en la base
+        self._guardado = {}         # user_id -> último estado guardado (JSON)
+
+        # Usuarios con cambios sin guardar (y los que se están guardando)
+        self._sucios = set()
+        self._en_vuelo = set()
+
+        self._bloqueo = asyncio.Lock()
+        self._tarea = None
+        self._metrics = {"guardados": 0, "lotes": 0, "errores": 0, "conflictos": 0}
+
+    # =====================
+    # CARGA (Application.initialize)
+    # =====================
+    async def _cargar(self):
+        if self._cargado:
+            return
+
+        # initialize() carga la persistencia antes de post_init: las
+        # migraciones tienen que estar aplicadas desde aquí
+        await init_db()
+
+        async with connection() as db:
+            cursor = await db.execute("""
+                SELECT user_id, version, datos::text, conversaciones::text
+                FROM estado_usuarios
+                WHERE datos <> '{}'::jsonb
+                OR conversaciones <> '{}'::jsonb
+            """)
+            filas = await cursor.fetchall()
+
+        for user_id, version, datos, conversaciones in filas:
+            self.recargar(user_id, version, decodificar(datos), json.loads(conversaciones))
+
+        self._cargado = True
+        print(f"💾 Estado restaurado de {len(filas)} usuarios")
+
+    async def get_user_data(self):
+        await self._cargar()
+        return {user_id: dict(datos) for user_id, datos in self._datos.items()}
+
+    async def get_conversations(self, name):
+        await self._cargar()
+        prefijo = f"{name}:"
+
+        return {
+            (int(clave[len(prefijo):]), user_id): estado
+            for user_id, estados in self._conversaciones.items()
+            for clave, estado in estados.items()
+            if clave.startswith(prefijo)
+        }
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    # =====================
+    # CAMBIOS (solo en memoria hasta el próximo lote)
+    # =====================
+    async def update_user_data(self, user_id, data):
+        self._datos[user_id] = data
+        self._marcar(user_id)
+
+    async def drop_user_data(self, user_id):
+        self._datos[user_id] = {}
+        self._marcar(user_id)
+
+    async def update_conversation(self, name, key, new_state):
+        chat_id, user_id = key[0], key[-1]
+        estados = self._conversaciones.setdefault(user_id, {})
+
+        if new_state is None:
+            estados.pop(f"{name}:{chat_id}", None)
+        else:
+            estados[f"{name}:{chat_id}"] = new_state
+
+        self._marcar(user_id)
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    # La recarga entre réplicas la hace replicas.abrir_update (una sola
+    # consulta junto con el registro del update)
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    def _marcar(self, user_id):
+        self._sucios.add(user_id)
+
+        # PTB entrega todos los cambios de una vuelta juntos (asyncio.gather);
+        # la tarea arranca después de todos ellos y los guarda en un solo lote
+        if self._tarea is None or self._tarea.done():
+            self._tarea = asyncio.create_task(self.flush())
+
+    # =====================
+    # GUARDADO
+    # =====================
+    async def flush(self):
+        """Guarda en un solo upsert a todos los usuarios con cambios"""
+        async with self._bloqueo:
+            # Los cambios que llegan mientras se guarda un lote van en el siguiente
+            while self._sucios:
+                if not await self._guardar_lote():
+                    break
+
+    async def _guardar_lote(self):
+        user_ids, datos, conversaciones, versiones, snapshots = [], [], [], [], {}
+
+        # Orden fijo de user_id: dos réplicas guardando a la vez no se bloquean
+        for user_id in sorted(self._sucios):
+            estados = self._conversaciones.get(user_id, {})
+            snapshot = codificar([self._datos.get(user_id, {}), estados])
+
+            if snapshot == self._guardado.get(user_id, _VACIO):
+                continue
+
+            user_ids.append(user_id)
+            datos.append(codificar(self._datos.get(user_id, {})))
+            conversaciones.append(codificar(estados))
+            versiones.append(self.version(user_id) + 1)
+            snapshots[user_id] = snapshot
+
+        self._en_vuelo = set(self._sucios)
+        self._sucios.clear()
+
+        try:
+            if user_ids:
+                async with connection() as db:
+                    # Compare-and-set: solo sobre la versión que esta réplica leyó
+                    cursor = await db.execute("""
+                        INSERT INTO estado_usuarios (user_id, datos, conversaciones, version, actualizado)
+                        SELECT t.user_id, t.datos::jsonb, t.conversaciones::jsonb, t.version, %s
+                        FROM unnest(%s::bigint[], %s::text[], %s::text[], %s::integer[])
+                             AS t(user_id, datos, conversaciones, version)
+                        ON CONFLICT (user_id) DO UPDATE SET
+                        datos = EXCLUDED.datos,
+                        conversaciones = EXCLUDED.conversaciones,
+                        version = EXCLUDED.version,
+                        actualizado = EXCLUDED.actualizado
+                        WHERE estado_usuarios.version = EXCLUDED.version - 1
+                        RETURNING user_id, version
+                    """, (int(time.time()), user_ids, datos, conversaciones, versiones))
+
+                    guardados = await cursor.fetchall()
+
+                for user_id, version in guardados:
+                    self._versiones[user_id] = version
+                    self._guardado[user_id] = snapshots[user_id]
+
+                # Otra réplica guardó primero: su estado gana. La versión local
+                # queda vieja, así que el próximo update del usuario lo recarga
+                conflictos = len(user_ids) - len(guardados)
+                if conflictos:
+                    print(f"⚠️ {conflictos} usuarios cambiaron en otra réplica; se recarga su estado")
+                    self._metrics["conflictos"] += conflictos
+
+                self._metrics["guardados"] += len(guardados)
+                self._metrics["lotes"] += 1
+
+        except Exception as e:
+            # Se reintenta en el próximo lote; la copia en memoria sigue intacta
+            print(f"⚠️ No se pudo guardar el estado de {len(user_ids)} usuarios: {e}")
+            self._metrics["errores"] += 1
+            self._sucios.update(self._en_vuelo)
+            return False
+
+        finally:
+            self._en_vuelo = set()
+
+        return True
+
+    # =====================
+    # RÉPLICAS
+    # =====================
+    def version(self, user_id):
+        return self._versiones.get(user_id, 0)
+
+    def pendiente(self, user_id):
+        """True si esta réplica tiene cambios del usuario aún sin guardar"""
+        return user_id in self._sucios or user_id in self._en_vuelo
+
+    def guardando(self, user_id):
+        """True si el lote en curso incluye al usuario (su versión aún puede cambiar)"""
+        return user_id in self._en_vuelo
+
+    def descartar(self, user_id):
+        """Olvida los cambios locales sin guardar (otra réplica guardó otros)"""
+        self._sucios.discard(user_id)
+
+    def recargar(self, user_id, version, datos, conversaciones):
+        """Toma como propio el estado que otra réplica guardó"""
+        self._datos[user_id] = datos
+        self._conversaciones[user_id] = conversaciones
+        self._versiones[user_id] = version
+        self._guardado[user_id] = codificar([datos, conversaciones])
+
+    def metricas(self):
+        return {"pendientes": len(self._sucios), **self._metrics}
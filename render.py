@@ -0,0 +1,545 @@
+"""
+Servicio de render: los archivos pesados del talonario (PDF e imagen) se generan en
+procesos aparte para que el loop del bot siga atendiendo a los compradores
+mientras un admin exporta.
+
+- RENDER_WORKERS procesos (ProcessPoolExecutor) hacen el trabajo de CPU.
+- Como mucho RENDER_MAX_COLA trabajos esperan o corren a la vez; el
+  siguiente recibe RenderOcupado en lugar de acumularse sin límite.
+- Un trabajo que pasa de RENDER_TIMEOUT segundos se aborta y el llamador
+  recibe TimeoutError. Un render colgado solo se corta terminando su
+  proceso, y ProcessPoolExecutor da por roto todo el pool cuando muere un
+  worker: se reinician todos y las demás exportaciones en curso reciben
+  RenderReiniciado (se pueden reintentar enseguida).
+
+Las funciones que corren en los workers viven en este módulo (sin imports
+de bot.py): reciben los datos ya consultados y la ruta donde escribir el
+archivo (ver artefactos.ruta_nueva), y la devuelven.
+
+La imagen se arma con sprites: la tabla base se decodifica una sola vez por
+proceso, las tres marcas (X roja, círculo amarillo, círculo naranja con
+línea) se dibujan una vez como RGBA y se pegan con alpha_composite. Cada
+worker guarda la última imagen de las rifas recientes; si se vuelve a pedir
+la misma rifa solo se redibujan las celdas que cambiaron de estado.
+
+La tabla diseñada es de 10 x 10 (00-99). Una rifa de más de 100 números
+se reparte en una imagen por cada bloque de 100 (ver paginas_talonario):
+sobre el mismo fondo se dibuja una tabla con los números del bloque, con
+las cifras que pida el tamaño de la rifa. Los bloques se generan en
+paralelo (renderizar_lote) y se guardan en PNG (o WebP) dentro de los límites
+de Telegram para fotos.
+"""
+import os
+import time
+import asyncio
+import signal
+import multiprocessing
+from queue import Empty
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Por defecto un proceso por núcleo, hasta 4 (cada uno carga PIL y reportlab)
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+RENDER_MAX_COLA = int(os.getenv("RENDER_MAX_COLA", "4"))
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", "120"))
+
+# Segundos entre avisos de progreso al admin
+INTERVALO_PROGRESO = 3
+
+# Imagen base del talonario y su cuadrícula (coordenadas exactas medidas)
+TABLA_BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Tabla diseñada.png")
+TABLE_X0 = 77     # borde izquierdo de la tabla
+TABLE_Y0 = 349    # borde superior de la tabla
+CELL_W = 96       # ancho de celda
+CELL_H = 95       # alto de celda
+COLUMNAS = 10
+CELDAS = 100      # números por imagen (00-99 en la tabla diseñada)
+
+# Tabla dibujada para rifas de más de 100 números
+COLOR_CELDA = (255, 255, 255, 255)
+COLOR_CELDA_VACIA = (205, 205, 205, 255)   # después del último número de la rifa
+COLOR_LINEA = (166, 166, 166, 255)
+COLOR_TEXTO = (33, 33, 33, 255)
+LINEA_WIDTH = 2
+TAMANO_LETRA = 30
+
+# Archivo que se envía como foto: "png" o "webp" (más liviano, pero no todos
+# los clientes de Telegram muestran igual una foto WebP)
+IMAGEN_FORMATO = os.getenv("IMAGEN_FORMATO", "png").lower()
+IMAGEN_CALIDAD = int(os.getenv("IMAGEN_CALIDAD", "90"))   # WebP
+
+# Límites de Telegram para fotos
+FOTO_MAX_BYTES = 10 * 1024 * 1024
+FOTO_MAX_LADOS = 10000   # ancho + alto
+
+# Colores para las marcas (RGBA)
+COLORES_ESTADO = {
+    'VENDIDO': (229, 57, 53, 255),      # rojo
+    'RESERVADO': (251, 192, 45, 255),   # amarillo
+    'EN_REVISION': (251, 140, 0, 255)   # naranja
+}
+
+# Tamaños de marcas (proporcionales al tamaño de celda)
+MARCA_OFFSET = 15   # tamaño de la X vendida
+MARCA_RADIO = 12    # radio de círculos
+MARCA_WIDTH = 3     # grosor de líneas
+
+# Últimas imágenes por worker (para redibujar solo las celdas que cambian)
+IMAGENES_RECIENTES = 8
+
+class RenderOcupado(Exception):
+    """Ya hay RENDER_MAX_COLA trabajos esperando o en curso"""
+
+class RenderReiniciado(Exception):
+    """Los workers se reiniciaron por otro trabajo (timeout o caída): se puede reintentar"""
+
+_executor = None
+_pids = None        # cola donde cada worker anota su pid al arrancar
+_generacion = 0     # sube con cada reinicio del pool
+_en_curso = 0
+
+_metrics = {
+    "terminados": 0, "rechazados": 0, "timeouts": 0, "errores": 0,
+    "reiniciados": 0, "segundos": 0.0
+}
+
+def _anotar_pid(cola):
+    """Inicializador de cada worker"""
+    cola.put(os.getpid())
+
+def _pool():
+    global _executor, _pids
+
+    if _executor is None:
+        # spawn: los workers no heredan el loop, los sockets de Telegram ni
+        # las conexiones del pool de PostgreSQL (por eso bot.py arranca el
+        # bot solo bajo `if __name__ == "__main__"`)
+        contexto = multiprocessing.get_context("spawn")
+        _pids = contexto.Queue()
+        _executor = ProcessPoolExecutor(
+            max_workers=RENDER_WORKERS,
+            mp_context=contexto,
+            initializer=_anotar_pid,
+            initargs=(_pids,)
+        )
+
+    return _executor
+
+def _reiniciar_pool():
+    """Termina los workers (un render colgado no se puede cancelar de otra forma)"""
+    global _executor, _pids, _generacion
+
+    executor, _executor = _executor, None
+    pids, _pids = _pids, None
+    if executor is None:
+        return
+
+    _generacion += 1
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    while True:
+        try:
+            pid = pids.get_nowait()
+        except Empty:
+            break
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    pids.close()
+
+async def renderizar(funcion, *args, al_progreso=None):
+    """
+    Ejecuta `funcion(*args)` en un worker y devuelve su resultado.
+    `al_progreso(estado, segundos)` (async, opcional) se llama cada
+    INTERVALO_PROGRESO segundos mientras el trabajo espera o corre.
+    """
+    return (await renderizar_lote(funcion, [args], al_progreso=al_progreso))[0]
+
+async def renderizar_lote(funcion, lista_args, al_progreso=None):
+    """
+    Ejecuta `funcion(*args)` para cada `args` de `lista_args`, repartidos
+    entre los workers, y devuelve los resultados en el mismo orden. El lote
+    cuenta como una sola exportación para RENDER_MAX_COLA y RENDER_TIMEOUT.
+    """
+    global _en_curso
+
+    if _en_curso >= RENDER_MAX_COLA:
+        _metrics["rechazados"] += 1
+        raise RenderOcupado(f"{_en_curso} exportaciones en curso")
+
+    _en_curso += 1
+    inicio = time.monotonic()
+    generacion = _generacion
+    esperas = []
+
+    try:
+        futuros = [_pool().submit(funcion, *args) for args in lista_args]
+        esperas = [asyncio.wrap_future(futuro) for futuro in futuros]
+
+        while True:
+            restante = RENDER_TIMEOUT - (time.monotonic() - inicio)
+            if restante <= 0:
+                _metrics["timeouts"] += 1
+                _reiniciar_pool()
+                raise TimeoutError(f"El render superó {RENDER_TIMEOUT:.0f} s")
+
+            listos, pendientes = await asyncio.wait(
+                esperas,
+                timeout=min(INTERVALO_PROGRESO, restante),
+                return_when=asyncio.FIRST_EXCEPTION
+            )
+
+            # Con que falle una parte falla el lote
+            for espera in listos:
+                if espera.cancelled():
+                    # shutdown(cancel_futures=True) de otro lote antes de que empezara
+                    raise BrokenProcessPool("Pool reiniciado")
+                if espera.exception() is not None:
+                    raise espera.exception()
+
+            if not pendientes:
+                break
+
+            if al_progreso is not None:
+                if any(futuro.running() for futuro in futuros):
+                    estado = "generando"
+                    if len(futuros) > 1:
+                        estado += f" {len(futuros) - len(pendientes)}/{len(futuros)}"
+                else:
+                    estado = "en cola"
+                try:
+                    await al_progreso(estado, int(time.monotonic() - inicio))
+                except Exception:
+                    pass
+
+        resultados = [espera.result() for espera in esperas]
+
+    except (RenderOcupado, TimeoutError):
+        raise
+    except BrokenProcessPool:
+        if generacion != _generacion:
+            # Otro lote reinició los workers (timeout o caída): este no falló
+            _metrics["reiniciados"] += 1
+            raise RenderReiniciado("Se reiniciaron los procesos de render; intenta de nuevo") from None
+
+        # Un worker murió (p. ej. sin memoria): el próximo trabajo usa procesos nuevos
+        _metrics["errores"] += 1
+        _reiniciar_pool()
+        raise
+    except Exception:
+        _metrics["errores"] += 1
+        raise
+    finally:
+        _en_curso -= 1
+
+        # Si el lote falló, lo que no empezó se cancela y lo que sigue (o
+        # termina con BrokenProcessPool al matar el worker) se descarta
+        for espera in esperas:
+            if not espera.done():
+                espera.cancel()
+            espera.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    _metrics["terminados"] += 1
+    _metrics["segundos"] += time.monotonic() - inicio
+    return resultados
+
+def detener():
+    """Apaga los workers (llamar en post_shutdown)"""
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+def render_metrics():
+    return {"en_curso": _en_curso, **_metrics}
+
+# =====================
+# TRABAJOS (corren en los workers)
+# =====================
+def pdf_talonario(nombre_rifa, generado, datos, ruta):
+    """
+    Arma el PDF del talonario en `ruta`. `datos` son las filas (numero,
+    nombre, username, telefono, estado) ya consultadas.
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import inch
+    from reportlab.lib import colors
+
+    # Crear PDF
+    doc = SimpleDocTemplate(ruta, pagesize=A4)
+    styles = getSampleStyleSheet()
+    story = []
+
+    # Título
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=16,
+        spaceAfter=30,
+        alignment=1  # Centrado
+    )
+
+    story.append(Paragraph(f"TALONARIO - {nombre_rifa}", title_style))
+    story.append(Paragraph(f"Generado: {generado}", styles['Normal']))
+    story.append(Spacer(1, 20))
+
+    # Tabla de datos
+    table_data = [['#', 'Nombre', 'Usuario', 'Teléfono', 'Estado']]
+
+    for numero, nombre, username, telefono, estado in datos:
+        table_data.append([
+            str(numero).zfill(2),
+            nombre[:20],  # Limitar longitud
+            f"@{username[:15]}" if username else "",
+            telefono[:15],
+            estado
+        ])
+
+    # Crear tabla (el encabezado se repite en cada página)
+    table = Table(
+        table_data,
+        colWidths=[0.5*inch, 2*inch, 1.5*inch, 1.5*inch, 1*inch],
+        repeatRows=1
+    )
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('FONTSIZE', (0, 1), (-1, -1), 8),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey])
+    ]))
+
+    story.append(table)
+    doc.build(story)
+
+    return ruta
+
+# =====================
+# IMAGEN DEL TALONARIO
+# =====================
+_tabla = None
+_sprites = None
+
+# Tablas sin marcas de los bloques usados hace poco (rifas de más de 100)
+_paginas = OrderedDict()
+
+# (rifa_id, inicio) -> (tabla, estados, imagen) de los últimos renders de este proceso
+_recientes = OrderedDict()
+
+def _cargar_tabla():
+    """Tabla base decodificada (una vez por proceso)"""
+    global _tabla
+
+    if _tabla is None:
+        from PIL import Image
+
+        with Image.open(TABLA_BASE) as archivo:
+            _tabla = archivo.convert("RGBA")
+
+    return _tabla
+
+def _cargar_sprites():
+    """Las marcas de cada estado como imágenes RGBA transparentes"""
+    global _sprites
+
+    if _sprites is None:
+        from PIL import Image, ImageDraw
+
+        lado = 2 * (MARCA_OFFSET + MARCA_WIDTH) + 1
+        c = lado // 2
+        _sprites = {}
+
+        for estado, color in COLORES_ESTADO.items():
+            sprite = Image.new("RGBA", (lado, lado), (0, 0, 0, 0))
+            draw = ImageDraw.Draw(sprite)
+
+            if estado == 'VENDIDO':
+                # X roja
+                draw.line([(c - MARCA_OFFSET, c - MARCA_OFFSET),
+                          (c + MARCA_OFFSET, c + MARCA_OFFSET)],
+                         fill=color, width=MARCA_WIDTH)
+                draw.line([(c - MARCA_OFFSET, c + MARCA_OFFSET),
+                          (c + MARCA_OFFSET, c - MARCA_OFFSET)],
+                         fill=color, width=MARCA_WIDTH)
+            else:
+                # Círculo (amarillo o naranja)
+                draw.ellipse([(c - MARCA_RADIO, c - MARCA_RADIO),
+                             (c + MARCA_RADIO, c + MARCA_RADIO)],
+                            outline=color, width=MARCA_WIDTH)
+
+            if estado == 'EN_REVISION':
+                # Línea horizontal del círculo naranja
+                draw.line([(c - MARCA_RADIO, c), (c + MARCA_RADIO, c)],
+                         fill=color, width=MARCA_WIDTH)
+
+            _sprites[estado] = sprite
+
+    return _sprites
+
+def paginas_talonario(total_numeros):
+    """Bloques (inicio, cantidad) del talonario: una imagen por cada 100 números"""
+    return [
+        (inicio, min(CELDAS, total_numeros - inicio))
+        for inicio in range(0, max(total_numeros, 1), CELDAS)
+    ]
+
+def _digitos(total_numeros):
+    """Cifras de cada número en la tabla (00-99, 000-999, 0000-9999)"""
+    return max(2, len(str(max(total_numeros, 1) - 1)))
+
+def _celda(i):
+    """Esquina superior izquierda de la celda `i` (0-99) de la imagen"""
+    fila, columna = divmod(i, COLUMNAS)
+    return TABLE_X0 + columna * CELL_W, TABLE_Y0 + fila * CELL_H
+
+def _fuente(digitos):
+    """La letra más grande (hasta TAMANO_LETRA) en la que el número cabe en la celda"""
+    from PIL import ImageFont
+
+    tamano = TAMANO_LETRA
+    while True:
+        fuente = ImageFont.load_default(size=tamano)
+        if fuente.getlength("8" * digitos) <= CELL_W - 16 or tamano <= 10:
+            return fuente
+        tamano -= 2
+
+def _pagina(total_numeros, inicio, cantidad):
+    """La tabla sin marcas de un bloque (se reutiliza mientras esté en _paginas)"""
+    clave = (total_numeros > CELDAS, _digitos(total_numeros), inicio, cantidad)
+
+    if clave in _paginas:
+        _paginas.move_to_end(clave)
+        return clave, _paginas[clave]
+
+    pagina = _cargar_tabla()
+
+    if total_numeros > CELDAS:
+        from PIL import ImageDraw
+
+        pagina = pagina.copy()
+        draw = ImageDraw.Draw(pagina)
+        digitos = _digitos(total_numeros)
+        fuente = _fuente(digitos)
+
+        for i in range(CELDAS):
+            x, y = _celda(i)
+            draw.rectangle(
+                [(x, y), (x + CELL_W, y + CELL_H)],
+                fill=COLOR_CELDA if i < cantidad else COLOR_CELDA_VACIA,
+                outline=COLOR_LINEA,
+                width=LINEA_WIDTH
+            )
+
+            if i < cantidad:
+                draw.text(
+                    (x + CELL_W / 2, y + CELL_H / 2),
+                    str(inicio + i).zfill(digitos),
+                    fill=COLOR_TEXTO,
+                    font=fuente,
+                    anchor="mm"
+                )
+
+    _paginas[clave] = pagina
+    while len(_paginas) > IMAGENES_RECIENTES:
+        _paginas.popitem(last=False)
+
+    return clave, pagina
+
+def _caja_celda(i, lado):
+    """Esquina superior izquierda del sprite centrado en la celda `i`"""
+    x, y = _celda(i)
+
+    # Centro geométrico de la celda
+    centro_x = int(x + CELL_W / 2)
+    centro_y = int(y + CELL_H / 2)
+
+    return centro_x - lado // 2, centro_y - lado // 2
+
+def componer_imagen(rifa_id, estados, total_numeros=CELDAS, inicio=0):
+    """
+    Imagen (RGBA, en memoria) del bloque de 100 números que empieza en
+    `inicio`. `estados` es {numero: estado} con 'VENDIDO', 'RESERVADO' o
+    'EN_REVISION'; el resto está disponible.
+    """
+    cantidad = min(CELDAS, total_numeros - inicio) if total_numeros > CELDAS else CELDAS
+    clave, tabla = _pagina(total_numeros, inicio, cantidad)
+    sprites = _cargar_sprites()
+    lado = next(iter(sprites.values())).width
+
+    # Celda (0-99) -> estado
+    estados = {
+        numero - inicio: estado
+        for numero, estado in estados.items()
+        if 0 <= numero - inicio < cantidad and estado in sprites
+    }
+
+    anterior = _recientes.pop((rifa_id, inicio), None)
+
+    if anterior is None or anterior[0] != clave:
+        img = tabla.copy()
+        cambiadas = estados
+        anterior = None
+    else:
+        _, estados_previos, img = anterior
+        cambiadas = {
+            i: estados.get(i)
+            for i in estados.keys() | estados_previos.keys()
+            if estados.get(i) != estados_previos.get(i)
+        }
+
+    for i, estado in cambiadas.items():
+        x, y = _caja_celda(i, lado)
+
+        if anterior is not None:
+            # Borrar la marca anterior con el pedazo de la tabla sin marcas
+            img.paste(tabla.crop((x, y, x + lado, y + lado)), (x, y))
+
+        if estado is not None:
+            img.alpha_composite(sprites[estado], (x, y))
+
+    _recientes[(rifa_id, inicio)] = (clave, estados, img)
+    while len(_recientes) > IMAGENES_RECIENTES:
+        _recientes.popitem(last=False)
+
+    return img
+
+def guardar_imagen(img, ruta, formato=IMAGEN_FORMATO):
+    """
+    Guarda la imagen como foto para Telegram: sin canal alfa, en WebP o PNG,
+    y si pasa del límite de Telegram se baja la calidad o la resolución.
+    """
+    img = img.convert("RGB")
+    calidad = IMAGEN_CALIDAD
+
+    while True:
+        if img.width + img.height > FOTO_MAX_LADOS:
+            escala = FOTO_MAX_LADOS / (img.width + img.height)
+            img = img.resize((int(img.width * escala), int(img.height * escala)))
+
+        if formato == "webp":
+            img.save(ruta, "WEBP", quality=calidad, method=4)
+        else:
+            img.save(ruta, "PNG")
+
+        if os.path.getsize(ruta) <= FOTO_MAX_BYTES:
+            return ruta
+
+        if formato == "webp" and calidad > 50:
+            calidad -= 15
+        else:
+            img = img.resize((img.width * 3 // 4, img.height * 3 // 4))
+
+def imagen_talonario(rifa_id, estados, ruta, total_numeros=CELDAS, inicio=0, formato=IMAGEN_FORMATO):
+    """Guarda en `ruta` la imagen de un bloque del talonario y la devuelve"""
+    return guardar_imagen(componer_imagen(rifa_id, estados, total_numeros, inicio), ruta, formato)
@@ -0,0 +1,113 @@
+"""
+Reproduce updates grabados contra el webhook del bot (prueba local).
+
+Los updates se graban con WEBHOOK_GRABAR=updates.jsonl (una línea JSON por
+update) o se copian del resultado de getUpdates. Cada update se envía por
+POST con la cabecera del secreto, igual que lo haría Telegram, y al final
+se muestran los códigos de respuesta y la latencia.
+
+⚠️ El bot responde de verdad a los chats de los updates: usar un token y
+usuarios de prueba.
+
+Uso:
+    python replay_updates.py updates.jsonl [--url http://localhost:8080/telegram]
+                             [--concurrencia 10] [--repetir 1] [--renumerar]
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+from collections import Counter
+from urllib.parse import urljoin
+from aiohttp import ClientSession, ClientError
+
+def cargar_updates(ruta):
+    with open(ruta, encoding="utf-8") as archivo:
+        return [json.loads(linea) for linea in archivo if linea.strip()]
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))]
+
+async def reproducir(url, secreto, updates, concurrencia):
+    codigos = Counter()
+    latencias = []
+    cola = asyncio.Queue()
+
+    for update in updates:
+        cola.put_nowait(update)
+
+    async def trabajador(sesion):
+        while not cola.empty():
+            update = cola.get_nowait()
+            inicio = time.perf_counter()
+            try:
+                async with sesion.post(
+                    url,
+                    json=update,
+                    headers={"X-Telegram-Bot-Api-Secret-Token": secreto}
+                ) as respuesta:
+                    await respuesta.read()
+                    codigos[respuesta.status] += 1
+            except ClientError as e:
+                codigos[type(e).__name__] += 1
+            latencias.append((time.perf_counter() - inicio) * 1000)
+
+    inicio = time.perf_counter()
+    async with ClientSession() as sesion:
+        await asyncio.gather(*[trabajador(sesion) for _ in range(concurrencia)])
+    transcurrido = time.perf_counter() - inicio
+
+    return codigos, latencias, transcurrido
+
+async def main(args):
+    updates = cargar_updates(args.archivo) * args.repetir
+
+    # Ids nuevos: el bot descarta los update_id que ya procesó
+    if args.renumerar:
+        base = int(time.time() * 1000)
+        for i, update in enumerate(updates):
+            update = dict(update)
+            update["update_id"] = base + i
+            updates[i] = update
+
+    # /health cuelga de la raíz del servidor, no de WEBHOOK_PATH
+    url_salud = urljoin(args.url, "/health")
+    async with ClientSession() as sesion:
+        try:
+            async with sesion.get(url_salud) as respuesta:
+                print(f"🩺 {url_salud}: {respuesta.status} {await respuesta.text()}")
+        except ClientError as e:
+            print(f"❌ No se pudo contactar el webhook ({url_salud}): {e}")
+            return
+
+    print(f"▶️  Enviando {len(updates)} updates con {args.concurrencia} conexiones...")
+    codigos, latencias, transcurrido = await reproducir(
+        args.url, args.secreto, updates, args.concurrencia
+    )
+
+    print(f"✅ {len(updates)} updates en {transcurrido:.2f}s ({len(updates) / transcurrido:,.0f} updates/s)")
+    print("   Respuestas:", dict(codigos))
+    print(
+        f"   Latencia ms: p50 {percentil(latencias, 50):.1f} · "
+        f"p95 {percentil(latencias, 95):.1f} · máx {max(latencias, default=0):.1f}"
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reproduce updates grabados contra el webhook")
+    parser.add_argument("archivo", help="Archivo JSONL con un update por línea")
+    parser.add_argument(
+        "--url",
+        default=f"http://localhost:{os.getenv('PORT', '8080')}{os.getenv('WEBHOOK_PATH', '/telegram')}",
+        help="URL del webhook"
+    )
+    parser.add_argument("--secreto", default=os.getenv("WEBHOOK_SECRET", ""), help="WEBHOOK_SECRET del bot")
+    parser.add_argument("--concurrencia", type=int, default=10, help="Peticiones simultáneas")
+    parser.add_argument("--repetir", type=int, default=1, help="Veces que se envía el archivo completo")
+    parser.add_argument("--renumerar", action="store_true", help="Asigna update_id nuevos a cada envío")
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
@@ -0,0 +1,210 @@
+"""
+Lo necesario para correr el bot en varias réplicas (p. ej. detrás del
+balanceador en modo webhook).
+
+- Liderazgo: una sola réplica (la que tiene el advisory lock LLAVE_LIDER)
+  corre los trabajos globales: barrido de expiraciones, reanudar
+  difusiones, limpieza. El lock es de sesión, así que vive en una conexión
+  propia fuera del pool; si la réplica muere, PostgreSQL lo suelta y otra
+  lo toma en la siguiente vuelta de `asumir_liderazgo`.
+- Updates repetidos: cada réplica recuerda en memoria los update_id que
+  procesó. Los que mueven pagos o difusiones (bot.py decide cuáles) además
+  se registran en updates_procesados, para descartarlos aunque Telegram
+  los entregue otra vez a otra réplica; el resto (tocar números, pasar de
+  página) no se registra.
+- Estado de usuario: `context.user_data` y el paso de las conversaciones
+  los guarda persistencia.py en estado_usuarios; antes de un update se
+  recargan si otra réplica los cambió (columna version). Con varias réplicas
+  (modo webhook) la versión se compara en cada update; con una sola (long
+  polling, que no admite más de una) basta una vez cada REVISION_ESTADO
+  segundos por usuario. Si la base tiene una versión más nueva, gana sobre
+  los cambios locales sin guardar: el guardado de esos cambios fallaría de
+  todos modos (persistencia.py escribe solo sobre la versión que leyó).
+"""
+import json
+import time
+import psycopg
+from collections import OrderedDict
+from database import connection, get_database_url
+from persistencia import decodificar, PERSISTENCIA_INTERVALO
+
+# Advisory lock del líder (cualquier entero fijo sirve)
+LLAVE_LIDER = 7246641
+
+# Los update_id se recuerdan un día (Telegram no reintenta más allá)
+RETENCION_UPDATES = 24 * 60 * 60
+
+# update_id recordados en memoria por réplica
+UPDATES_RECIENTES = 10000
+
+# Segundos entre consultas del estado de un mismo usuario
+REVISION_ESTADO = PERSISTENCIA_INTERVALO
+
+_lider = {"conexion": None, "es_lider": False}
+
+_updates_recientes = OrderedDict()   # update_id -> None
+_revisados = {}                      # user_id -> time.monotonic() de la última consulta
+
+_metrics = {"duplicados": 0, "recargas": 0, "consultas": 0}
+
+# =====================
+# LIDERAZGO
+# =====================
+def es_lider():
+    return _lider["es_lider"]
+
+async def asumir_liderazgo():
+    """
+    Intenta tomar (o confirma que sigue teniendo) el lock del líder.
+    Devuelve True solo cuando esta réplica acaba de convertirse en líder.
+    """
+    conexion = _lider["conexion"]
+
+    try:
+        if conexion is None or conexion.closed:
+            conexion = await psycopg.AsyncConnection.connect(get_database_url(), autocommit=True)
+            _lider["conexion"] = conexion
+            _lider["es_lider"] = False
+
+        if _lider["es_lider"]:
+            # Si la conexión sigue viva el lock sigue siendo nuestro
+            await conexion.execute("SELECT 1")
+            return False
+
+        cursor = await conexion.execute("SELECT pg_try_advisory_lock(%s)", (LLAVE_LIDER,))
+        _lider["es_lider"] = (await cursor.fetchone())[0]
+
+        if _lider["es_lider"]:
+            print("👑 Esta réplica es la líder")
+
+        return _lider["es_lider"]
+
+    except psycopg.Error as e:
+        if _lider["es_lider"]:
+            print(f"⚠️ Se perdió el liderazgo: {e}")
+        _lider["es_lider"] = False
+        if conexion is not None:
+            await conexion.close()
+        _lider["conexion"] = None
+        return False
+
+async def soltar_liderazgo():
+    """Cierra la conexión del lock (otra réplica puede tomarlo de inmediato)"""
+    conexion = _lider["conexion"]
+    _lider["conexion"] = None
+    _lider["es_lider"] = False
+
+    if conexion is not None:
+        await conexion.close()
+
+# =====================
+# ESTADO COMPARTIDO
+# =====================
+def _restaurar_conversaciones(conversaciones, user_id, estados):
+    for nombre, conv in conversaciones.items():
+        for clave in [c for c in conv._conversations if c[-1] == user_id]:
+            del conv._conversations[clave]
+
+    for clave, estado in estados.items():
+        nombre, chat_id = clave.rsplit(":", 1)
+        if nombre in conversaciones:
+            conversaciones[nombre]._conversations[(int(chat_id), user_id)] = estado
+
+def _recordar_update(update_id):
+    """False si esta réplica ya vio el update"""
+    if update_id in _updates_recientes:
+        return False
+
+    _updates_recientes[update_id] = None
+    while len(_updates_recientes) > UPDATES_RECIENTES:
+        _updates_recientes.popitem(last=False)
+
+    return True
+
+def _toca_revisar(user_id):
+    ahora = time.monotonic()
+
+    if ahora - _revisados.get(user_id, float("-inf")) < REVISION_ESTADO:
+        return False
+
+    if len(_revisados) > UPDATES_RECIENTES:
+        for viejo in [u for u, t in _revisados.items() if ahora - t >= REVISION_ESTADO]:
+            del _revisados[viejo]
+
+    _revisados[user_id] = ahora
+    return True
+
+async def abrir_update(update, user_data, conversaciones, persistencia, registrar=False, compartido=False):
+    """
+    Descarta el update si ya se procesó (`registrar`: comprobándolo también
+    en updates_procesados) y trae el estado del usuario si otra réplica lo
+    cambió (`compartido`: puede haber otras réplicas, se compara en cada
+    update). Devuelve False si el update ya se había procesado.
+    """
+    user = update.effective_user
+
+    if not _recordar_update(update.update_id):
+        _metrics["duplicados"] += 1
+        return False
+
+    revisar = user is not None and (compartido or _toca_revisar(user.id))
+
+    # Con una sola réplica, lo común (tocar números, navegar) no va a la base
+    if not registrar and not revisar:
+        return True
+
+    fila = None
+    _metrics["consultas"] += 1
+
+    async with connection() as db:
+        if registrar:
+            cursor = await db.execute("""
+                INSERT INTO updates_procesados (update_id, recibido)
+                VALUES (%s, %s)
+                ON CONFLICT DO NOTHING
+                RETURNING update_id
+            """, (update.update_id, int(time.time())))
+
+            if await cursor.fetchone() is None:
+                _metrics["duplicados"] += 1
+                return False
+
+        if revisar:
+            cursor = await db.execute("""
+                SELECT version, datos::text, conversaciones::text
+                FROM estado_usuarios
+                WHERE user_id = %s
+                AND version > %s
+            """, (user.id, persistencia.version(user.id)))
+            fila = await cursor.fetchone()
+
+    # Si el lote en curso incluye al usuario, la versión leída puede ser la
+    # que esta misma réplica está escribiendo: el compare-and-set decide
+    if fila and not persistencia.guardando(user.id):
+        version, datos, estados = fila
+
+        # Lo guardado por otra réplica gana sobre lo que esta no alcanzó a guardar
+        persistencia.descartar(user.id)
+        datos, estados = decodificar(datos), json.loads(estados)
+
+        user_data.clear()
+        user_data.update(datos)
+        _restaurar_conversaciones(conversaciones, user.id, estados)
+
+        persistencia.recargar(user.id, version, datos, estados)
+        _metrics["recargas"] += 1
+
+    return True
+
+async def limpiar_updates():
+    """Olvida los update_id viejos (lo corre el líder)"""
+    async with connection() as db:
+        cursor = await db.execute("""
+            DELETE FROM updates_procesados
+            WHERE recibido < %s
+        """, (int(time.time()) - RETENCION_UPDATES,))
+
+        return cursor.rowcount
+
+def replicas_metrics():
+    return {"lider": es_lider(), **_metrics}
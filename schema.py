@@ -0,0 +1,156 @@
+"""
+Migraciones versionadas del esquema.
+
+Cada archivo de migrations/ se llama NNNN_descripcion.sql y tiene dos
+secciones separadas por los marcadores `-- migrate:up` y `-- migrate:down`.
+La versión aplicada se guarda en la tabla schema_version.
+
+Uso:
+    python schema.py status
+    python schema.py upgrade [version]
+    python schema.py downgrade <version>
+"""
+import os
+import re
+import sys
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+# Clave del advisory lock: evita que dos réplicas migren a la vez
+SCHEMA_LOCK_ID = 72_000_001
+
+_ARCHIVO = re.compile(r"^(\d{4})_(\w+)\.sql$")
+_MARCADOR = re.compile(r"^--\s*migrate:(up|down)\s*$", re.MULTILINE)
+
+def load_migrations():
+    """Lee migrations/ y devuelve [(version, nombre, sql_up, sql_down)] ordenado"""
+    migraciones = []
+
+    for archivo in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = _ARCHIVO.match(archivo)
+        if not match:
+            continue
+
+        with open(os.path.join(MIGRATIONS_DIR, archivo), encoding="utf-8") as f:
+            contenido = f.read()
+
+        # split con grupo: [preámbulo, "up", sql, "down", sql]
+        partes = _MARCADOR.split(contenido)
+        secciones = dict(zip(partes[1::2], partes[2::2]))
+
+        if "up" not in secciones:
+            raise ValueError(f"La migración {archivo} no tiene sección '-- migrate:up'")
+
+        migraciones.append((
+            int(match.group(1)),
+            match.group(2),
+            secciones["up"].strip(),
+            secciones.get("down", "").strip()
+        ))
+
+    versiones = [m[0] for m in migraciones]
+    if len(versiones) != len(set(versiones)):
+        raise ValueError("Hay dos migraciones con el mismo número de versión")
+
+    return migraciones
+
+async def _preparar(conn):
+    """Toma el lock del esquema (hasta el fin de la transacción) y crea schema_version"""
+    await conn.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_ID,))
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            nombre TEXT NOT NULL,
+            aplicada_en TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+
+async def current_version(conn):
+    cursor = await conn.execute("""
+        SELECT COALESCE(MAX(version), 0) FROM schema_version
+    """)
+    return (await cursor.fetchone())[0]
+
+async def upgrade(conn, target=None):
+    """
+    Aplica las migraciones pendientes hasta `target` (o la última).
+
+    Todo corre en una sola transacción con pg_advisory_xact_lock: si varias
+    réplicas arrancan juntas, la primera migra y las demás esperan y luego
+    no encuentran nada pendiente. Devuelve las versiones aplicadas.
+    """
+    aplicadas = []
+
+    async with conn.transaction():
+        await _preparar(conn)
+        actual = await current_version(conn)
+
+        for version, nombre, sql_up, _ in load_migrations():
+            if version <= actual or (target is not None and version > target):
+                continue
+
+            await conn.execute(sql_up)
+            await conn.execute(
+                "INSERT INTO schema_version (version, nombre) VALUES (%s, %s)",
+                (version, nombre)
+            )
+            aplicadas.append(version)
+
+    return aplicadas
+
+async def downgrade(conn, target):
+    """Revierte, de la más nueva a la más vieja, las migraciones > `target`"""
+    revertidas = []
+
+    async with conn.transaction():
+        await _preparar(conn)
+        actual = await current_version(conn)
+
+        for version, nombre, _, sql_down in reversed(load_migrations()):
+            if version <= target or version > actual:
+                continue
+
+            if not sql_down:
+                raise ValueError(f"La migración {version:04d}_{nombre} no se puede revertir")
+
+            await conn.execute(sql_down)
+            await conn.execute("DELETE FROM schema_version WHERE version = %s", (version,))
+            revertidas.append(version)
+
+    return revertidas
+
+async def _main(argv):
+    from database import connection, close_connection_pool
+
+    comando = argv[0] if argv else "status"
+
+    try:
+        async with connection() as conn:
+            if comando == "upgrade":
+                target = int(argv[1]) if len(argv) > 1 else None
+                aplicadas = await upgrade(conn, target)
+                print(f"✅ Migraciones aplicadas: {aplicadas or 'ninguna'}")
+            elif comando == "downgrade":
+                if len(argv) < 2:
+                    print("⚠️ Uso: python schema.py downgrade <version>")
+                    return
+                revertidas = await downgrade(conn, int(argv[1]))
+                print(f"↩️ Migraciones revertidas: {revertidas or 'ninguna'}")
+            elif comando != "status":
+                print(__doc__)
+                return
+
+            async with conn.transaction():
+                await _preparar(conn)
+                actual = await current_version(conn)
+
+        print(f"📌 Versión del esquema: {actual}")
+        for version, nombre, _, _ in load_migrations():
+            marca = "✅" if version <= actual else "⏳"
+            print(f"  {marca} {version:04d}_{nombre}")
+    finally:
+        await close_connection_pool()
+
+if __name__ == "__main__":
+    import asyncio
+    asyncio.run(_main(sys.argv[1:]))
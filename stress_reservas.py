@@ -0,0 +1,154 @@
+"""
+Prueba de concurrencia de las reservas (necesita PostgreSQL y el .env del bot).
+
+Crea una rifa temporal y lanza miles de compras simultáneas sobre ella con
+el mismo camino que usa confirmar: reservar_numeros y rollback si faltó
+algún número. Al terminar verifica que:
+- ningún número quedó en manos de dos compradores,
+- cada compra confirmada tiene exactamente los números que pidió,
+- no quedaron pagos de compras descartadas,
+- rifas.numeros_ocupados coincide con los números reservados.
+
+La rifa, sus números y sus pagos se eliminan al final. Sale con código 1
+si alguna verificación falla.
+
+Uso:
+    python stress_reservas.py [--compradores 5000] [--numeros 100] [--por-compra 1 3]
+"""
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter
+from psycopg_pool import PoolTimeout
+from database import init_db, connection, close_connection_pool, pool_metrics
+from bot import insertar_rifa, reservar_numeros
+
+async def comprar(rifa_id, user_id, numeros, salida):
+    """Una compra como la hace confirmar; devuelve (pago_id, números) o None"""
+    await salida.wait()
+
+    async with connection() as db:
+        pago_id, _, obtenidos = await reservar_numeros(
+            db, rifa_id, user_id, numeros, int(time.time())
+        )
+
+        if set(obtenidos) != set(numeros):
+            await db.rollback()
+            return None
+
+    return pago_id, set(obtenidos)
+
+async def verificar(rifa_id, confirmadas):
+    """Compara lo que cree cada comprador con lo que quedó en la base"""
+    correcto = True
+
+    def revisar(condicion, mensaje):
+        nonlocal correcto
+        print(f"{'✅' if condicion else '❌'} {mensaje}")
+        correcto &= condicion
+
+    async with connection() as db:
+        cursor = await db.execute("""
+            SELECT numero, pago_id, user_id
+            FROM numeros
+            WHERE rifa_id = %s
+            AND reservado = 1
+        """, (rifa_id,))
+        reservados = await cursor.fetchall()
+
+        cursor = await db.execute("SELECT id FROM pagos WHERE rifa_id = %s", (rifa_id,))
+        pagos = {fila[0] for fila in await cursor.fetchall()}
+
+        cursor = await db.execute("SELECT numeros_ocupados FROM rifas WHERE id = %s", (rifa_id,))
+        ocupados = (await cursor.fetchone())[0]
+
+    repetidos = [
+        numero for numero, veces in
+        Counter(n for _, numeros in confirmadas for n in numeros).items()
+        if veces > 1
+    ]
+    revisar(not repetidos, f"Números vendidos dos veces: {len(repetidos)}")
+
+    en_base = {}
+    for numero, pago_id, _ in reservados:
+        en_base.setdefault(pago_id, set()).add(numero)
+
+    distintas = sum(1 for pago_id, numeros in confirmadas if en_base.get(pago_id) != numeros)
+    revisar(not distintas, f"Compras cuyos números no coinciden con la base: {distintas}")
+
+    huerfanos = pagos - {pago_id for pago_id, _ in confirmadas}
+    revisar(not huerfanos, f"Pagos de compras descartadas: {len(huerfanos)}")
+
+    total = sum(len(numeros) for _, numeros in confirmadas)
+    revisar(
+        ocupados == len(reservados) == total,
+        f"Números ocupados: contador {ocupados} / base {len(reservados)} / compras {total}"
+    )
+
+    return correcto
+
+async def main(args):
+    await init_db()
+
+    async with connection() as db:
+        rifa_id = await insertar_rifa(db, "stress_reservas", 1000, args.numeros)
+
+    try:
+        minimo, maximo = args.por_compra
+        salida = asyncio.Event()
+        tareas = [
+            asyncio.create_task(comprar(
+                rifa_id,
+                -(i + 1),
+                random.sample(range(args.numeros), random.randint(minimo, maximo)),
+                salida
+            ))
+            for i in range(args.compradores)
+        ]
+
+        # Todas las compras arrancan a la vez y compiten por el pool
+        await asyncio.sleep(0)
+        inicio = time.perf_counter()
+        salida.set()
+        resultados = await asyncio.gather(*tareas, return_exceptions=True)
+        duracion = time.perf_counter() - inicio
+
+        confirmadas = [r for r in resultados if isinstance(r, tuple)]
+        sin_conexion = sum(1 for r in resultados if isinstance(r, PoolTimeout))
+        errores = [r for r in resultados if isinstance(r, Exception) and not isinstance(r, PoolTimeout)]
+
+        metrics = pool_metrics()
+        print(f"🎟️ Rifa temporal {rifa_id}: {args.numeros} números, {args.compradores} compradores")
+        print(f"⏱ {duracion:.2f}s ({args.compradores / duracion:,.0f} compras/s), "
+              f"espera media por conexión {metrics['acquire_ms_avg']:.1f} ms")
+        print(f"🛒 Confirmadas: {len(confirmadas)}, rechazadas: "
+              f"{args.compradores - len(confirmadas) - sin_conexion - len(errores)}, "
+              f"sin conexión: {sin_conexion}, errores: {len(errores)}")
+
+        for error in errores[:5]:
+            print(f"   {type(error).__name__}: {error}")
+
+        correcto = await verificar(rifa_id, confirmadas) and not errores
+
+    finally:
+        async with connection() as db:
+            await db.execute("DELETE FROM rifas WHERE id = %s", (rifa_id,))
+        await close_connection_pool()
+
+    if not correcto:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de concurrencia de las reservas")
+    parser.add_argument("--compradores", type=int, default=5000, help="Compras simultáneas")
+    parser.add_argument("--numeros", type=int, default=100, help="Números de la rifa temporal")
+    parser.add_argument(
+        "--por-compra",
+        type=int,
+        nargs=2,
+        default=[1, 3],
+        metavar=("MIN", "MAX"),
+        help="Números que pide cada comprador"
+    )
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,145 @@
+"""
+Modo webhook: Telegram envía cada update por HTTPS en lugar de que el bot
+lo pida con long polling.
+
+Se activa definiendo WEBHOOK_URL (la URL pública del servicio, p. ej. la
+de Railway). El servidor aiohttp expone:
+
+- POST WEBHOOK_PATH  recibe updates; exige la cabecera
+                     X-Telegram-Bot-Api-Secret-Token = WEBHOOK_SECRET
+- GET  /health       200 si el bot acepta updates y la base responde,
+                     503 mientras arranca o se apaga
+
+Al recibir SIGTERM (deploy en Railway) el servidor deja de aceptar updates,
+se terminan los que están en proceso y se ejecutan post_stop y post_shutdown.
+"""
+import os
+import json
+import hmac
+import signal
+import asyncio
+from aiohttp import web
+from telegram import Update
+from database import connection
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Railway indica el puerto en PORT
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+# Conexiones simultáneas que Telegram abre hacia el webhook (1-100)
+WEBHOOK_MAX_CONEXIONES = int(os.getenv("WEBHOOK_MAX_CONEXIONES", "40"))
+# Si se define, cada update recibido se agrega (una línea JSON) a este
+# archivo, para reproducirlo después con replay_updates.py
+WEBHOOK_GRABAR = os.getenv("WEBHOOK_GRABAR")
+
+def webhook_activo():
+    return bool(WEBHOOK_URL)
+
+def crear_servidor(application, estado):
+    """
+    App aiohttp con las rutas del webhook y de salud. `estado["aceptando"]`
+    indica si se reciben updates (False al arrancar y al apagar).
+    """
+
+    async def recibir_update(request):
+        secreto = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(secreto, WEBHOOK_SECRET):
+            return web.Response(status=403)
+
+        if not estado["aceptando"]:
+            # Telegram reintenta el update más tarde (o lo recibe otra réplica)
+            return web.Response(status=503)
+
+        try:
+            datos = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        if WEBHOOK_GRABAR:
+            with open(WEBHOOK_GRABAR, "a", encoding="utf-8") as archivo:
+                archivo.write(json.dumps(datos, ensure_ascii=False) + "\n")
+
+        # Se responde en cuanto el update queda en la cola; los handlers lo
+        # procesan en paralelo (concurrent_updates)
+        await application.update_queue.put(Update.de_json(datos, application.bot))
+        return web.Response()
+
+    async def salud(request):
+        if not estado["aceptando"]:
+            return web.json_response({"ok": False, "motivo": "iniciando o apagando"}, status=503)
+
+        try:
+            async with connection() as db:
+                await db.execute("SELECT 1")
+        except Exception as e:
+            return web.json_response({"ok": False, "motivo": str(e)}, status=503)
+
+        return web.json_response({"ok": True})
+
+    servidor = web.Application()
+    servidor.router.add_post(WEBHOOK_PATH, recibir_update)
+    servidor.router.add_get("/health", salud)
+
+    return servidor
+
+def ejecutar_webhook(application, drop_pending_updates=False):
+    """Equivalente a run_polling para el modo webhook (bloquea hasta SIGTERM/SIGINT)"""
+    asyncio.run(_servir(application, drop_pending_updates))
+
+async def _servir(application, drop_pending_updates):
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET es obligatorio en modo webhook")
+
+    estado = {"aceptando": False}
+    servidor = crear_servidor(application, estado)
+    runner = web.AppRunner(servidor)
+
+    detener = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for senal in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(senal, detener.set)
+        except NotImplementedError:
+            # Windows: Ctrl+C llega como KeyboardInterrupt
+            pass
+
+    try:
+        # Dentro del try: si post_init falla a medias (p. ej. la base no
+        # responde) igual se cierran el pool, los workers y el liderazgo
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+
+        await application.start()
+
+        # /health responde desde antes de registrar el webhook
+        await runner.setup()
+        await web.TCPSite(runner, "0.0.0.0", WEBHOOK_PORT).start()
+
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=drop_pending_updates,
+            max_connections=WEBHOOK_MAX_CONEXIONES,
+        )
+
+        estado["aceptando"] = True
+        print(f"🌐 Webhook escuchando en :{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+        await detener.wait()
+    finally:
+        print("🛑 Apagando webhook...")
+        # Primero dejar de aceptar (el balanceador ve /health en 503)...
+        estado["aceptando"] = False
+        await runner.cleanup()
+
+        # ...y luego terminar los updates que ya estaban en proceso
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)